@@ -34,6 +34,15 @@ def _getPassword(args):
     )
 
 
+def _writeTimingReport(logger, config, timingReport):
+    # Write the build timing report to disk if one was requested
+    if timingReport is not None:
+        logger.info(
+            "Writing build timing report to {}".format(config.timingReportFile), False
+        )
+        timingReport.write(config.timingReportFile)
+
+
 def build():
     # Create our logger to generate coloured output on stderr
     logger = Logger(prefix="[{} build] ".format(sys.argv[0]))
@@ -96,6 +105,22 @@ def build():
             False,
         )
 
+    # If a build timing report was requested then create it so the image builder can record step timings
+    timingReport = (
+        BuildTimingReport()
+        if config.timingReportFile is not None
+        and config.layoutDir is None
+        and config.dryRun == False
+        else None
+    )
+
+    # Create the sinks that will receive the output of each build, prefixing console output with the image name when builds run concurrently
+    sinks = [ConsoleSink(prefix=config.jobs > 1)]
+    if config.logFile is not None:
+        sinks.append(RotatingFileSink(config.logFile, config.logMaxSize))
+    if config.logEventsFile is not None:
+        sinks.append(JsonEventSink(config.logEventsFile))
+
     # Create an auto-deleting temporary directory to hold our build context
     with tempfile.TemporaryDirectory() as tempDir:
         contextOrig = join(os.path.dirname(os.path.abspath(__file__)), "dockerfiles")
@@ -110,14 +135,22 @@ def build():
             config.layoutDir,
             config.opts,
             config.combine,
+            config.skipUnchanged,
+            timingReport,
+            sinks,
+            config.cache,
+            config.instrument,
+            config.instrumentSizes,
         )
 
-        # Resolve our main set of tags for the generated images; this is used only for Source and downstream
-        if config.buildTargets["source"]:
-            mainTags = [
-                "{}{}-{}".format(config.release, config.suffix, config.prereqsTag),
-                config.release + config.suffix,
+        # Resolve our main set of tags for the generated images of each release; this is used only for Source and downstream
+        releaseTags = {
+            release.release: [
+                "{}{}-{}".format(release.release, config.suffix, config.prereqsTag),
+                release.release + config.suffix,
             ]
+            for release in config.releases
+        }
 
         # Print the command-line invocation that triggered this build, masking any supplied passwords
         args = [
@@ -131,18 +164,20 @@ def build():
         logger.info("COMMAND-LINE INVOCATION:", False)
         logger.info(str(args), False)
 
-        # Print the details of the Unreal Engine version being built
+        # Print the details of each Unreal Engine version being built
         logger.info("UNREAL ENGINE VERSION SETTINGS:")
-        logger.info(
-            "Custom build:  {}".format("Yes" if config.custom == True else "No"), False
-        )
-        if config.custom == True:
-            logger.info("Custom name:   " + config.release, False)
-        elif config.release is not None:
-            logger.info("Release:       " + config.release, False)
-        if config.repository is not None:
-            logger.info("Repository:    " + config.repository, False)
-            logger.info("Branch/tag:    " + config.branch + "\n", False)
+        for release in config.releases if len(config.releases) > 0 else [config]:
+            logger.info(
+                "Custom build:  {}".format("Yes" if release.custom == True else "No"),
+                False,
+            )
+            if release.custom == True:
+                logger.info("Custom name:   " + release.release, False)
+            elif release.release is not None:
+                logger.info("Release:       " + release.release, False)
+            if release.repository is not None:
+                logger.info("Repository:    " + release.repository, False)
+                logger.info("Branch/tag:    " + release.branch + "\n", False)
 
         # Determine if we are using a custom version for ue4cli or conan-ue4cli
         if config.ue4cliVersion is not None or config.conanUe4cliVersion is not None:
@@ -296,8 +331,8 @@ def build():
         )
         logger.info(
             "Changelist override: {}".format(
-                config.changelist
-                if config.changelist is not None
+                config.args.changelist
+                if config.args.changelist is not None
                 else "(None specified)"
             ),
             False,
@@ -350,9 +385,8 @@ def build():
             username = ""
             password = ""
 
-        elif (
-            not config.buildTargets["source"]
-            or builder.willBuild("ue4-source", mainTags) == False
+        elif not any(
+            builder.willBuild("ue4-source", tags) for tags in releaseTags.values()
         ):
             # Don't bother prompting the user for any credentials if we're not building the ue4-source image
             logger.info(
@@ -371,12 +405,19 @@ def build():
             print()
 
         # If resource monitoring has been enabled, start the resource monitoring background thread
-        resourceMonitor = ResourceMonitor(logger, config.args.interval)
+        resourceMonitor = ResourceMonitor(
+            logger,
+            config.args.interval,
+            config.args.monitor_output,
+            config.args.monitor_cgroups,
+        )
         if config.args.monitor == True:
             resourceMonitor.start()
 
-        # Prep for endpoint cleanup, if necessary
+        # Prep for endpoint and gitdeps cache proxy cleanup, if necessary
         endpoint = None
+        gitdepsCache = None
+        gitMirror = None
 
         try:
             # Keep track of our starting time
@@ -396,143 +437,292 @@ def build():
                 "NAMESPACE={}".format(GlobalConfiguration.getTagNamespace()),
             ] + config.args.docker_build_args
 
+            # Create the build graph that will schedule our image builds, respecting the dependencies between them
+            graph = BuildGraph(logger, config.jobs)
+
+            # Compute the build arguments that are shared by every image which consumes the UE4 build prerequisites image
+            prereqConsumerArgs = [
+                "--build-arg",
+                "PREREQS_TAG={}".format(config.prereqsTag),
+            ]
+
             # Build the UE4 build prerequisites image
             if config.buildTargets["build-prerequisites"]:
-                # Compute the build options for the UE4 build prerequisites image
-                # (This is the only image that does not use any user-supplied tag suffix, since the tag always reflects any customisations)
-                prereqsArgs = ["--build-arg", "BASEIMAGE=" + config.baseImage]
-                if config.containerPlatform == "windows":
-                    prereqsArgs = prereqsArgs + [
-                        "--build-arg",
-                        "DLLSRCIMAGE=" + config.dllSrcImage,
-                        "--build-arg",
-                        "VISUAL_STUDIO_BUILD_NUMBER="
-                        + config.visualStudio.build_number,
-                    ]
 
-                custom_prerequisites_dockerfile = config.args.prerequisites_dockerfile
-                if custom_prerequisites_dockerfile is not None:
-                    builder.build_builtin_image(
-                        "ue4-base-build-prerequisites",
-                        [config.prereqsTag],
-                        commonArgs + config.platformArgs + prereqsArgs,
-                        builtin_name="ue4-build-prerequisites",
-                    )
-                    builtImages.append("ue4-base-build-prerequisites")
-                else:
-                    builder.build_builtin_image(
-                        "ue4-build-prerequisites",
-                        [config.prereqsTag],
-                        commonArgs + config.platformArgs + prereqsArgs,
+                def buildPrerequisites():
+                    # Compute the build options for the UE4 build prerequisites image
+                    # (This is the only image that does not use any user-supplied tag suffix, since the tag always reflects any customisations)
+                    prereqsArgs = ["--build-arg", "BASEIMAGE=" + config.baseImage]
+                    if config.containerPlatform == "windows":
+                        prereqsArgs = prereqsArgs + [
+                            "--build-arg",
+                            "DLLSRCIMAGE=" + config.dllSrcImage,
+                            "--build-arg",
+                            "VISUAL_STUDIO_BUILD_NUMBER="
+                            + config.visualStudio.build_number,
+                        ]
+
+                    custom_prerequisites_dockerfile = (
+                        config.args.prerequisites_dockerfile
                     )
+                    if custom_prerequisites_dockerfile is not None:
+                        builder.build_builtin_image(
+                            "ue4-base-build-prerequisites",
+                            [config.prereqsTag],
+                            commonArgs + config.platformArgs + prereqsArgs,
+                            builtin_name="ue4-build-prerequisites",
+                        )
+                        builtImages.append("ue4-base-build-prerequisites")
+                    else:
+                        builder.build_builtin_image(
+                            "ue4-build-prerequisites",
+                            [config.prereqsTag],
+                            commonArgs + config.platformArgs + prereqsArgs,
+                        )
 
-                prereqConsumerArgs = [
-                    "--build-arg",
-                    "PREREQS_TAG={}".format(config.prereqsTag),
-                ]
+                    if custom_prerequisites_dockerfile is not None:
+                        builder.build(
+                            "ue4-build-prerequisites",
+                            [config.prereqsTag],
+                            commonArgs + config.platformArgs + prereqConsumerArgs,
+                            dockerfile_template=custom_prerequisites_dockerfile,
+                            context_dir=os.path.dirname(
+                                custom_prerequisites_dockerfile
+                            ),
+                        )
 
-                if custom_prerequisites_dockerfile is not None:
-                    builder.build(
-                        "ue4-build-prerequisites",
-                        [config.prereqsTag],
-                        commonArgs + config.platformArgs + prereqConsumerArgs,
-                        dockerfile_template=custom_prerequisites_dockerfile,
-                        context_dir=os.path.dirname(custom_prerequisites_dockerfile),
-                    )
+                    builtImages.append("ue4-build-prerequisites")
 
-                builtImages.append("ue4-build-prerequisites")
+                graph.add("ue4-build-prerequisites", buildPrerequisites)
             else:
                 logger.info("Skipping ue4-build-prerequisities image build.")
 
-            # Build the UE4 source image
+            # Start the HTTP credential endpoint in a background thread and wait for it to start
+            # (A single endpoint is shared by the ue4-source builds for every release, each of which uses its own security token)
             if config.buildTargets["source"]:
-                # Start the HTTP credential endpoint as a child process and wait for it to start
                 if config.opts["credential_mode"] == "endpoint":
-                    endpoint = CredentialEndpoint(username, password)
+                    endpoint = CredentialEndpoint(
+                        username, password, config.credentialPort
+                    )
                     endpoint.start()
 
                 # If we're using build secrets then pass the Git username and password to the UE4 source image as secrets
                 secrets = {}
                 if config.opts["credential_mode"] == "secrets":
                     secrets = {"username": username, "password": password}
-                credentialArgs = [] if len(secrets) > 0 else endpoint.args()
+                credentialArgs = []
 
-                ue4SourceArgs = prereqConsumerArgs + [
-                    "--build-arg",
-                    "GIT_REPO={}".format(config.repository),
-                    "--build-arg",
-                    "GIT_BRANCH={}".format(config.branch),
-                    "--build-arg",
-                    "VERBOSE_OUTPUT={}".format("1" if config.verbose == True else "0"),
-                ]
+                # If requested, start the caching proxy for the dependency data downloaded by the Setup script
+                if config.gitdepsCache == True and config.dryRun == False:
+                    gitdepsCache = GitdepsCache(
+                        GlobalConfiguration.getGitdepsCacheDir()
+                    )
+                    gitdepsCache.start()
+                    credentialArgs = credentialArgs + gitdepsCache.args()
+
+                # If requested, serve our local mirrors of the git repositories to the ue4-source builds
+                if (
+                    config.opts.get("source_mode", "git") == "mirror"
+                    and config.dryRun == False
+                ):
+                    gitMirror = GitMirror(GlobalConfiguration.getGitMirrorDir())
+                    gitMirror.start()
+
+            # If custom version strings were specified for ue4cli and/or conan-ue4cli, use them
+            infrastructureFlags = []
+            if config.ue4cliVersion is not None:
+                infrastructureFlags.extend(
+                    [
+                        "--build-arg",
+                        "UE4CLI_VERSION={}".format(config.ue4cliVersion),
+                    ]
+                )
+            if config.conanUe4cliVersion is not None:
+                infrastructureFlags.extend(
+                    [
+                        "--build-arg",
+                        "CONAN_UE4CLI_VERSION={}".format(config.conanUe4cliVersion),
+                    ]
+                )
 
-                changelistArgs = (
-                    ["--build-arg", "CHANGELIST={}".format(config.changelist)]
-                    if config.changelist is not None
-                    else []
+            # Generates a unique build graph node name for an image, qualified by the release when building a matrix
+            def nodeName(image, release):
+                if len(config.releases) > 1:
+                    return "{}:{}".format(image, releaseTags[release.release][1])
+                return image
+
+            # Determines the version of the Engine for the specified release, preferring the Build.version file from the
+            # ue4-source image (which reflects hotfix releases and changelist overrides) and falling back to the release number
+            def engineVersion(release, tags):
+                sourceImage = "{}:{}".format(
+                    GlobalConfiguration.resolveTag("ue4-source"), tags[0]
                 )
+                if (
+                    builder.dryRun == False
+                    and builder.layoutDir is None
+                    and DockerUtils.exists(sourceImage)
+                ):
+                    container = DockerUtils.create(sourceImage)
+                    try:
+                        return EngineVersion.fromContainer(
+                            container, config.containerPlatform
+                        )
+                    except Exception as e:
+                        logger.warning(
+                            "Warning: failed to read the Engine version from {}: {}".format(
+                                sourceImage, e
+                            )
+                        )
+                    finally:
+                        container.remove(force=True)
 
-                builder.build_builtin_image(
-                    "ue4-source",
-                    mainTags,
-                    commonArgs
-                    + config.platformArgs
-                    + ue4SourceArgs
-                    + credentialArgs
-                    + changelistArgs,
-                    secrets=secrets,
+                return (
+                    EngineVersion.fromRelease(release.release, release.changelist)
+                    if release.custom == False
+                    else None
                 )
-                builtImages.append("ue4-source")
-            else:
-                logger.info("Skipping ue4-source image build.")
 
-            # Build the minimal UE4 CI image, unless requested otherwise by the user
-            if config.buildTargets["minimal"]:
+            # Adds the build graph nodes for the images of the specified release, which all depend on the shared prerequisites image
+            def addReleaseImages(release):
+                mainTags = releaseTags[release.release]
+
+                # Build the UE4 source image
+                if config.buildTargets["source"]:
+
+                    def buildSource():
+                        ue4SourceArgs = prereqConsumerArgs + [
+                            "--build-arg",
+                            "GIT_REPO={}".format(release.repository),
+                            "--build-arg",
+                            "GIT_BRANCH={}".format(release.branch),
+                            "--build-arg",
+                            "VERBOSE_OUTPUT={}".format(
+                                "1" if config.verbose == True else "0"
+                            ),
+                        ]
+
+                        changelistArgs = (
+                            ["--build-arg", "CHANGELIST={}".format(release.changelist)]
+                            if release.changelist is not None
+                            else []
+                        )
+
+                        # If we are cloning from a local mirror then bring it up to date with the remote repository first
+                        mirrorArgs = []
+                        if gitMirror is not None and builder.willBuild(
+                            "ue4-source", mainTags
+                        ):
+                            logger.action(
+                                "Updating local mirror of {} ({})...".format(
+                                    release.repository, release.branch
+                                )
+                            )
+                            mirrorArgs = gitMirror.update(
+                                release.repository, release.branch, username, password
+                            )
+
+                        # If we are using the credential endpoint then generate a security token for this build
+                        token = endpoint.register() if endpoint is not None else None
+                        tokenArgs = endpoint.args(token) if endpoint is not None else []
+
+                        try:
+                            builder.build_builtin_image(
+                                "ue4-source",
+                                mainTags,
+                                commonArgs
+                                + config.platformArgs
+                                + ue4SourceArgs
+                                + credentialArgs
+                                + tokenArgs
+                                + changelistArgs
+                                + mirrorArgs,
+                                secrets=secrets,
+                            )
+                        finally:
+                            if token is not None:
+                                endpoint.unregister(token)
+                        builtImages.append("ue4-source")
+
+                    graph.add(
+                        nodeName("ue4-source", release),
+                        buildSource,
+                        ["ue4-build-prerequisites"],
+                    )
+
+                # Compute the build arguments that are shared by the ue4-minimal and ue4-full images
                 minimalArgs = prereqConsumerArgs + [
                     "--build-arg",
                     "TAG={}".format(mainTags[1]),
                 ]
 
-                builder.build_builtin_image(
-                    "ue4-minimal",
-                    mainTags,
-                    commonArgs + config.platformArgs + minimalArgs,
-                )
-                builtImages.append("ue4-minimal")
-            else:
-                logger.info("Skipping ue4-minimal image build.")
-
-            # Build the full UE4 CI image, unless requested otherwise by the user
-            if config.buildTargets["full"]:
-                # If custom version strings were specified for ue4cli and/or conan-ue4cli, use them
-                infrastructureFlags = []
-                if config.ue4cliVersion is not None:
-                    infrastructureFlags.extend(
-                        [
-                            "--build-arg",
-                            "UE4CLI_VERSION={}".format(config.ue4cliVersion),
-                        ]
+                # Build the minimal UE4 CI image, unless requested otherwise by the user
+                if config.buildTargets["minimal"]:
+
+                    def buildMinimal():
+                        # Record the version of the Engine in the labels of the image (which are inherited by ue4-full),
+                        # so that other commands can identify it without reading the filesystem of a container
+                        versionArgs = []
+                        if config.opts.get("disable_labels", False) == False:
+                            version = engineVersion(release, mainTags)
+                            if version is not None:
+                                versionArgs = version.labelArgs()
+
+                        builder.build_builtin_image(
+                            "ue4-minimal",
+                            mainTags,
+                            commonArgs
+                            + config.platformArgs
+                            + minimalArgs
+                            + versionArgs,
+                        )
+                        builtImages.append("ue4-minimal")
+
+                    graph.add(
+                        nodeName("ue4-minimal", release),
+                        buildMinimal,
+                        [nodeName("ue4-source", release)],
                     )
-                if config.conanUe4cliVersion is not None:
-                    infrastructureFlags.extend(
-                        [
-                            "--build-arg",
-                            "CONAN_UE4CLI_VERSION={}".format(config.conanUe4cliVersion),
-                        ]
+
+                # Build the full UE4 CI image, unless requested otherwise by the user
+                if config.buildTargets["full"]:
+
+                    def buildFull():
+                        builder.build_builtin_image(
+                            "ue4-full",
+                            mainTags,
+                            commonArgs
+                            + config.platformArgs
+                            + minimalArgs
+                            + infrastructureFlags,
+                        )
+                        builtImages.append("ue4-full")
+
+                    graph.add(
+                        nodeName("ue4-full", release),
+                        buildFull,
+                        [nodeName("ue4-minimal", release)],
                     )
 
-                # Build the image
-                builder.build_builtin_image(
-                    "ue4-full",
-                    mainTags,
-                    commonArgs
-                    + config.platformArgs
-                    + minimalArgs
-                    + infrastructureFlags,
-                )
-                builtImages.append("ue4-full")
-            else:
-                logger.info("Skipping ue4-full image build.")
+            # Add the images for each release, fanning out from the shared prerequisites image
+            for release in config.releases:
+                addReleaseImages(release)
+
+            # Report any images that we are not building
+            for target, image in [
+                ("source", "ue4-source"),
+                ("minimal", "ue4-minimal"),
+                ("full", "ue4-full"),
+            ]:
+                if not config.buildTargets[target]:
+                    logger.info("Skipping {} image build.".format(image))
+
+            # If resource monitoring has been enabled, attribute each sample to the images being built when it was taken
+            if config.args.monitor == True:
+                for node in graph.nodes():
+                    node.action = resourceMonitor.tagged(node.name, node.action)
+
+            # Build each of the requested images, running independent builds concurrently where permitted
+            graph.run()
 
             # If we are generating Dockerfiles then include information about the options used to generate them
             if config.layoutDir is not None:
@@ -592,6 +782,10 @@ def build():
                         ),
                     )
 
+            # Report the time taken by each image build and the critical path through the build graph
+            if config.layoutDir is None and config.dryRun == False:
+                graph.report()
+
             # Report the total execution time
             endTime = time.time()
             logger.action(
@@ -600,17 +794,39 @@ def build():
                 )
             )
 
-            # Stop the resource monitoring background thread if it is running
+            # Write the build timing report to disk if one was requested
+            _writeTimingReport(logger, config, timingReport)
+
+            # Stop the resource monitoring background thread if it is running and report the resource usage for each image
             resourceMonitor.stop()
+            if config.args.monitor == True:
+                resourceMonitor.report()
 
-            # Stop the HTTP server
+            # Stop the HTTP server and the gitdeps cache proxy
             if endpoint is not None:
                 endpoint.stop()
+            if gitdepsCache is not None:
+                gitdepsCache.stop()
+            if gitMirror is not None:
+                gitMirror.stop()
+
+            # Flush and close our output sinks
+            for sink in sinks:
+                sink.close()
 
         except (Exception, KeyboardInterrupt) as e:
             # One of the images failed to build
             logger.error("Error: {}".format(e))
+            _writeTimingReport(logger, config, timingReport)
             resourceMonitor.stop()
+            if config.args.monitor == True:
+                resourceMonitor.report()
             if endpoint is not None:
                 endpoint.stop()
+            if gitdepsCache is not None:
+                gitdepsCache.stop()
+            if gitMirror is not None:
+                gitMirror.stop()
+            for sink in sinks:
+                sink.close()
             sys.exit(1)
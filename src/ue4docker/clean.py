@@ -1,4 +1,4 @@
-import argparse, itertools, subprocess, sys
+import argparse, humanfriendly, itertools, subprocess, sys
 from .infrastructure import *
 
 
@@ -16,6 +16,36 @@ def _cleanMatching(cleaner, filter, tag, dryRun):
     )
 
 
+def _cleanGitdeps(logger, limit, dryRun):
+    cacheDir = GlobalConfiguration.getGitdepsCacheDir()
+    try:
+        limitBytes = humanfriendly.parse_size(limit, binary=True)
+    except humanfriendly.InvalidSize:
+        logger.error('Error: invalid gitdeps cache size limit "{}"'.format(limit))
+        sys.exit(1)
+
+    entries = GitdepsCache.entries(cacheDir)
+    total = sum(size for _, size, _ in entries)
+    logger.action(
+        "gitdeps cache at {} contains {} files ({})".format(
+            cacheDir, len(entries), humanfriendly.format_size(total, binary=True)
+        )
+    )
+
+    removed = GitdepsCache.evict(cacheDir, limitBytes, dryRun)
+    removedBytes = sum(size for _, size, _ in removed)
+    if dryRun == True:
+        for path, _, _ in removed:
+            print("Would remove: {}".format(path))
+    logger.action(
+        "{} {} files ({}) from the gitdeps cache".format(
+            "Would evict" if dryRun == True else "Evicted",
+            len(removed),
+            humanfriendly.format_size(removedBytes, binary=True),
+        )
+    )
+
+
 def clean():
     # Create our logger to generate coloured output on stderr
     logger = Logger(prefix="[{} clean] ".format(sys.argv[0]))
@@ -33,6 +63,16 @@ def clean():
     parser.add_argument(
         "--all", action="store_true", help="Clean all ue4-docker images"
     )
+    parser.add_argument(
+        "--gitdeps",
+        action="store_true",
+        help="Evict the least recently used files from the gitdeps cache until it is no larger than the limit specified by -gitdeps-limit",
+    )
+    parser.add_argument(
+        "-gitdeps-limit",
+        default="0",
+        help="Maximum size of the gitdeps cache when evicting files using --gitdeps (default is 0, which removes everything)",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -68,6 +108,10 @@ def clean():
             cleaner, GlobalConfiguration.resolveTag("ue4-*"), args.tag, args.dry_run
         )
 
+    # If requested, evict files from the gitdeps cache
+    if args.gitdeps == True:
+        _cleanGitdeps(logger, args.gitdeps_limit, args.dry_run)
+
     # If requested, run `docker system prune`
     if args.prune == True:
         logger.action("Running `docker system prune`...")
@@ -1,6 +1,35 @@
 #!/usr/bin/env python3
-import glob, os, shutil, sys
-from os.path import basename, dirname, exists, join
+from concurrent.futures import ThreadPoolExecutor
+import heapq, os, shutil, sys
+from os.path import dirname, join
+
+# The components that we extract, in the order in which they are listed in our summary
+COMPONENTS = [
+    ("DDC", "Derived Data Cache (DDC)"),
+    ("DebugSymbols", "debug symbols"),
+    ("TemplatesAndSamples", "template projects and samples"),
+    ("Binaries", "Binaries subdirectory"),
+    ("Content", "Content subdirectory"),
+    ("Extras", "Extras subdirectory"),
+    ("Intermediate", "Intermediate subdirectory"),
+    ("Plugins", "Plugins subdirectory"),
+    ("Source", "Source subdirectory"),
+]
+
+# The optional components, which are always extracted separately so the Dockerfile can omit them if they were excluded
+OPTIONAL_COMPONENTS = ["DDC", "DebugSymbols", "TemplatesAndSamples"]
+
+# The files that make up the DDC, relative to the root of the Installed Build
+DDC_FILES = [join("Engine", "DerivedDataCache", "Compressed.ddp")]
+
+# The file extensions of debug symbols
+SYMBOL_EXTENSIONS = (".debug", ".sym")
+
+# The top-level directories that contain template projects and samples
+TEMPLATE_DIRS = ["FeaturePacks", "Samples", "Templates"]
+
+# The larger non-optional subdirectories of the Engine directory, each of which is extracted as its own component
+ENGINE_SUBDIRS = ["Binaries", "Content", "Extras", "Intermediate", "Plugins", "Source"]
 
 
 # Logs a message to stderr
@@ -9,62 +38,141 @@ def log(message):
     sys.stderr.flush()
 
 
-# Extracts the files and directories for the specified component and moves them to a separate output directory
-def extractComponent(inputDir, outputDir, component, description, items):
-    # Print progress output
-    log("\nExtracting {}...".format(description))
+# Formats a data size using binary units
+def formatSize(size):
+    for unit in ["bytes", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return "{:.2f} {}".format(size, unit)
+        size /= 1024
+    return "{:.2f} TiB".format(size)
 
-    # Create the output directory for the component if it doesn't already exist
-    componentDir = join(outputDir, component)
-    os.makedirs(outputDir, exist_ok=True)
 
-    # Move each file and directory for the component to the output directory
-    for item in items:
-        # Verify that the item exists
-        if not exists(item):
-            log("Skipping non-existent item: {}".format(item))
-            continue
+# Walks the specified directory tree using `os.scandir()`, yielding the path and size of each file (or symlink)
+def walk(rootDir):
+    pending = [rootDir]
+    while len(pending) > 0:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    yield entry.path, entry.stat(follow_symlinks=False).st_size
 
-        # Print progress output
-        log("Moving: {}".format(item))
 
-        # Ensure the parent directory for the item exists in the output directory
-        parent = dirname(item).replace(inputDir, componentDir)
-        os.makedirs(parent, exist_ok=True)
+# Determines which component a file belongs to, and whether it needs to be moved individually rather than with its parent directory
+def classify(relative):
+    if relative in DDC_FILES:
+        return "DDC", True
+    if relative.endswith(SYMBOL_EXTENSIONS):
+        return "DebugSymbols", True
 
-        # Perform the move
-        shutil.move(item, join(parent, basename(item)))
+    parts = relative.split(os.sep)
+    if parts[0] in TEMPLATE_DIRS:
+        return "TemplatesAndSamples", False
+    if len(parts) > 2 and parts[0] == "Engine" and parts[1] in ENGINE_SUBDIRS:
+        return parts[1], False
+
+    return None, False
+
+
+# Partitions the specified files into the specified number of layers of roughly equal size,
+# by assigning each file (from largest to smallest) to the layer that is currently the smallest
+def partition(files, numLayers):
+    layers = [[] for _ in range(numLayers)]
+    heap = [(0, index) for index in range(numLayers)]
+    for relative, size in sorted(files, key=lambda file: file[1], reverse=True):
+        total, index = heapq.heappop(heap)
+        layers[index].append((relative, size))
+        heapq.heappush(heap, (total + size, index))
+    return layers
+
+
+# Moves a file or directory to the same relative location under the output directory for the specified component
+def move(rootDir, outputDir, component, relative):
+    destination = join(outputDir, component, relative)
+    os.makedirs(dirname(destination), exist_ok=True)
+    shutil.move(join(rootDir, relative), destination)
 
 
 # Retrieve the path to the root directory of the Installed Build
 rootDir = sys.argv[1]
 
-# Retrieve the path to the root output directory for extracted components and ensure it exists
+# Retrieve the path to the root output directory for extracted components
 outputDir = sys.argv[2]
-os.makedirs(outputDir, exist_ok=True)
-
-# Extract the DDC
-ddc = [join(rootDir, "Engine", "DerivedDataCache", "Compressed.ddp")]
-extractComponent(rootDir, outputDir, "DDC", "Derived Data Cache (DDC)", ddc)
-
-# Extract debug symbols
-symbolFiles = glob.glob(join(rootDir, "**", "*.debug"), recursive=True) + glob.glob(
-    join(rootDir, "**", "*.sym"), recursive=True
-)
-extractComponent(rootDir, outputDir, "DebugSymbols", "debug symbols", symbolFiles)
-
-# Extract template projects and samples
-subdirs = [join(rootDir, subdir) for subdir in ["FeaturePacks", "Samples", "Templates"]]
-extractComponent(
-    rootDir, outputDir, "TemplatesAndSamples", "template projects and samples", subdirs
-)
-
-# Extract the larger non-optional subdirectories of the Engine directory
-for subdir in ["Binaries", "Content", "Extras", "Intermediate", "Plugins", "Source"]:
-    extractComponent(
-        rootDir,
-        outputDir,
-        subdir,
-        f"{subdir} subdirectory",
-        [join(rootDir, "Engine", subdir)],
+
+# If a number of layers was specified then the files that are not part of an optional component are
+# partitioned into that many layers of roughly equal size, rather than being split by Engine subdirectory
+numLayers = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+if numLayers > 0:
+    COMPONENTS = [c for c in COMPONENTS if c[0] in OPTIONAL_COMPONENTS] + [
+        ("Layer{}".format(index), "layer {}".format(index))
+        for index in range(numLayers)
+    ]
+
+# Ensure the output directory exists, along with a directory for each component
+# (since the Dockerfile copies every component directory, even those that turn out to be empty)
+for component, _ in COMPONENTS:
+    os.makedirs(join(outputDir, component), exist_ok=True)
+
+# Classify every file in the Installed Build in a single pass, recording the files that must be moved individually
+log("Scanning the Installed Build...")
+counts = {component: 0 for component, _ in COMPONENTS}
+sizes = {component: 0 for component, _ in COMPONENTS}
+individual = []
+remaining = []
+for path, size in walk(rootDir):
+    relative = os.path.relpath(path, rootDir)
+    component, isIndividual = classify(relative)
+    if numLayers > 0 and component not in OPTIONAL_COMPONENTS:
+        remaining.append((relative, size))
+    elif component is not None:
+        counts[component] += 1
+        sizes[component] += size
+        if isIndividual:
+            individual.append((component, relative))
+
+# When partitioning into layers, every remaining file is moved individually into its assigned layer
+for index, files in enumerate(partition(remaining, numLayers) if numLayers > 0 else []):
+    component = "Layer{}".format(index)
+    counts[component] = len(files)
+    sizes[component] = sum(size for _, size in files)
+    individual.extend((component, relative) for relative, _ in files)
+
+# Directories are moved as a whole, so determine which of them exist
+directories = [
+    ("TemplatesAndSamples", subdir)
+    for subdir in TEMPLATE_DIRS
+    if os.path.isdir(join(rootDir, subdir))
+] + [
+    (subdir, join("Engine", subdir))
+    for subdir in ENGINE_SUBDIRS
+    if numLayers == 0 and os.path.isdir(join(rootDir, "Engine", subdir))
+]
+
+with ThreadPoolExecutor() as executor:
+    # Move the individual files first, since debug symbols can reside inside the directories that we move as a whole
+    # (This includes any files that we have partitioned into layers)
+    log("Extracting {} individual files...".format(len(individual)))
+    for future in [
+        executor.submit(move, rootDir, outputDir, component, relative)
+        for component, relative in individual
+    ]:
+        future.result()
+
+    # Move the directories
+    for component, relative in directories:
+        log("Moving: {}".format(join(rootDir, relative)))
+    for future in [
+        executor.submit(move, rootDir, outputDir, component, relative)
+        for component, relative in directories
+    ]:
+        future.result()
+
+# Print a summary of the extracted components
+log("\nExtracted components:")
+for component, description in COMPONENTS:
+    log(
+        "{}: {} files, {}".format(
+            description, counts[component], formatSize(sizes[component])
+        )
     )
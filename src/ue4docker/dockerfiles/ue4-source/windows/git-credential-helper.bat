@@ -1 +1 @@
-@curl http://%HOST_ADDRESS%:9876/?token=%HOST_TOKEN% --silent -X POST -H "Content-Type: text/plain" -d %*
+@curl http://%HOST_ADDRESS%:%HOST_PORT%/?token=%HOST_TOKEN% --silent -X POST -H "Content-Type: text/plain" -d %*
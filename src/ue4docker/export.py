@@ -26,14 +26,23 @@ def export():
             "function": exportInstalledBuild,
             "description": "Exports an Installed Build of the Engine",
             "image": GlobalConfiguration.resolveTag("ue4-full"),
-            "help": "Copies the Installed Build from a container to the host system.\nOnly supported under Linux for UE 4.21.0 and newer.",
+            "help": "Copies the Installed Build from a container to the host system.\nSupported for Linux and Windows images of UE 4.21.0 and newer\n(incremental exports are only supported for Linux images).\n\n"
+            + "Options:\n  -j, --jobs JOBS  Number of parts of the Installed Build to export concurrently\n"
+            + "  --incremental    Update an existing export, transferring only the files that have changed\n"
+            + "  --delete         Allow --incremental to delete files from a directory it did not create\n"
+            + "  --layers         Read the Installed Build from the image layers instead of a container\n"
+            + "  --archive PATH   Read the image layers from a `docker save` archive or OCI image layout\n\n"
+            + "An interrupted export can be resumed by running the same command again.",
         },
         "packages": {
             "function": exportPackages,
             "description": "Exports conan-ue4cli wrapper packages",
             "image": GlobalConfiguration.resolveTag("ue4-full"),
             "help": "Runs a temporary conan server inside a container and uses it to export the\ngenerated conan-ue4cli wrapper packages.\n\n"
-            + 'Currently the only supported destination value is "cache", which exports\nthe packages to the Conan local cache on the host system.',
+            + 'Currently the only supported destination value is "cache", which exports\nthe packages to the Conan local cache on the host system.\n\n'
+            + "Options:\n  -j, --jobs JOBS  Number of packages to upload and download concurrently\n"
+            + "  --force          Download packages whose recipe revision is already in the cache\n"
+            + "  --direct         Copy the packages directly from the cache in the image (Linux only)",
         },
     }
 
@@ -63,8 +72,11 @@ def export():
         details = COMPONENTS[args["component"]]
         requiredImage = "{}:{}".format(details["image"], tag) if ":" not in tag else tag
 
-        # Verify that the required container image exists
-        if DockerUtils.exists(requiredImage) == False:
+        # Verify that the required container image exists, unless it is being read from an archive rather than the Docker daemon
+        fromArchive = any(
+            [arg == "--archive" or arg.startswith("--archive=") for arg in stripped[4:]]
+        )
+        if fromArchive == False and DockerUtils.exists(requiredImage) == False:
             print(
                 'Error: the specified container image "{}" does not exist.'.format(
                     requiredImage
@@ -1,65 +1,701 @@
-import tempfile
-
+from concurrent.futures import ThreadPoolExecutor
 from docker.models.containers import Container
+from docker.models.images import Image
+from typing import Optional
+
+from ..infrastructure import (
+    ArchiveExtractor,
+    ChunkStream,
+    DockerUtils,
+    EngineVersion,
+    ImageArchive,
+    TransferProgress,
+)
+from ..infrastructure.ArchiveExtractor import ARCHIVE_CHUNK_SIZE
+from ..infrastructure.EngineVersion import ENGINE_ROOTS, VERSION_FILE
+import argparse, hashlib, humanfriendly, json, os, posixpath, stat, sys, tempfile, threading
+
+# The file in which we record the progress of an export, so that an interrupted export can be resumed
+EXPORT_STATE_FILE = ".ue4-docker-export.json"
+
+# The file in which we record the manifest of an incremental export, which allows the next export to detect unchanged files
+EXPORT_MANIFEST_FILE = ".ue4-docker-manifest.jsonl"
+
+# The script that generates the manifest of the Installed Build inside the container
+MANIFEST_SCRIPT = os.path.join(os.path.dirname(__file__), "generate-manifest.py")
+
+# The default number of parts of the Installed Build that are exported concurrently
+DEFAULT_EXPORT_JOBS = 4
+
+# The location of the Installed Build within the filesystem layers of the images for each container platform
+LAYER_ENGINE_ROOTS = {"linux": "home/ue4/UnrealEngine", "windows": "Files/UnrealEngine"}
+
+
+class ExportState(object):
+    """
+    Records which parts of the Installed Build have been exported to a destination directory
+    """
 
-from ..infrastructure import DockerUtils, SubprocessUtils
-import json, os, platform, shutil, subprocess, sys
+    def __init__(self, destination: str, image: str):
+        self.path = os.path.join(destination, EXPORT_STATE_FILE)
+        self.image = image
+        self.completed = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(destination: str):
+        """
+        Loads the state of an interrupted export from the specified destination directory, or returns None if there is none
+        """
+        try:
+            with open(os.path.join(destination, EXPORT_STATE_FILE), "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        state = ExportState(destination, data["image"])
+        state.completed = set(data["completed"])
+        return state
+
+    def complete(self, part: str) -> None:
+        """
+        Marks the specified part of the Installed Build as exported
+        """
+        with self._lock:
+            self.completed.add(part)
+            self._write()
+
+    def save(self) -> None:
+        """
+        Writes the state to the destination directory
+        """
+        with self._lock:
+            self._write()
+
+    def remove(self) -> None:
+        """
+        Removes the state once the export has completed
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _write(self) -> None:
+        # Replace the existing state atomically, so an interruption never leaves a truncated file behind
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump({"image": self.image, "completed": sorted(self.completed)}, f)
+        os.replace(temp, self.path)
 
 
 def exportInstalledBuild(image, destination, extraArgs):
-    # Verify that the destination directory does not already exist
-    if os.path.exists(destination) == True:
-        print("Error: the destination directory already exists.", file=sys.stderr)
+    # Parse the options for the export
+    parser = argparse.ArgumentParser(prog="ue4-docker export installed")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_EXPORT_JOBS,
+        help="Number of parts of the Installed Build to export concurrently (default is {})".format(
+            DEFAULT_EXPORT_JOBS
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update an existing destination directory, transferring only the files that have changed and deleting those that were removed",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Allow an incremental export to delete files that are not part of the Installed Build from a destination directory that was not created by a previous incremental export",
+    )
+    parser.add_argument(
+        "--layers",
+        action="store_true",
+        help="Read the Installed Build directly from the filesystem layers of the image rather than copying it from a container",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        default=None,
+        help="Read the Installed Build from an image archive produced by `docker save` or an OCI image layout, without using the Docker daemon",
+    )
+    args = parser.parse_args(extraArgs)
+    if args.jobs < 1:
+        print("Error: the number of jobs must be at least 1.", file=sys.stderr)
+        sys.exit(1)
+
+    # Layer-based exports read the image directly, so they do not create a container
+    if args.layers == True or args.archive is not None:
+        if args.incremental == True:
+            print(
+                "Error: incremental exports cannot be combined with --layers or --archive.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+        exit_code = 1
+        try:
+            exit_code = doLayerExport(image, destination, args.archive, args.jobs)
+        except Exception as e:
+            _reportFailure(destination)
+            raise e
+        finally:
+            sys.exit(exit_code)
+
+    # An existing destination directory is only acceptable for an incremental export or if it contains an interrupted export of the same image
+    details = DockerUtils.client().images.get(image)
+    imageOS = details.attrs["Os"]
+    state = ExportState.load(destination)
+    if args.incremental == True:
+        if imageOS != "linux":
+            print(
+                "Error: incremental exports are only supported for Linux images.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        if not _verifyIncrementalDestination(destination, args.delete):
+            sys.exit(1)
+    elif not _verifyDestination(destination, state, details.id):
+        sys.exit(1)
+
+    # Images built by ue4-docker record the version of the Engine in their labels, which lets us reject
+    # unsupported images without creating a container and reading the version from its filesystem
+    version = EngineVersion.fromLabels(details.labels)
+    if version is not None and not _verifyVersion(lambda: version):
         sys.exit(1)
 
     # Create a container from which we will copy files
-    container = DockerUtils.create(image)
+    # (Under Linux we start the container so we can measure the Installed Build, which we cannot do under Windows)
+    if imageOS == "linux":
+        container = DockerUtils.start(image, ["sleep", "infinity"])
+    else:
+        container = DockerUtils.create(image)
 
     exit_code = 1
     try:
-        exit_code = doExportInstalledBuild(container, destination, extraArgs)
+        # Images without the version labels require us to read the version of the Engine from the container
+        verified = version is not None or _verifyVersion(
+            lambda: EngineVersion.fromContainer(container, imageOS)
+        )
+        if verified == True and args.incremental == True:
+            exit_code = doIncrementalExport(
+                container, ENGINE_ROOTS[imageOS], destination, args.jobs
+            )
+        elif verified == True:
+            exit_code = doExportInstalledBuild(
+                container,
+                ENGINE_ROOTS[imageOS],
+                destination,
+                state if state is not None else ExportState(destination, details.id),
+                args.jobs,
+                imageOS == "linux",
+            )
     except Exception as e:
-        print("Error: failed to export Installed Build.", file=sys.stderr)
+        _reportFailure(destination)
         raise e
     finally:
         # Remove the container, irrespective of whether or not the export succeeded
-        container.remove()
+        container.remove(force=True)
 
         sys.exit(exit_code)
 
 
-def doExportInstalledBuild(container: Container, destination: str, extraArgs) -> int:
-    if platform.system() == "Windows":
-        engineRoot = "C:/UnrealEngine"
+def doExportInstalledBuild(
+    container: Container,
+    engineRoot: str,
+    destination: str,
+    state: ExportState,
+    jobs: int,
+    canMeasure: bool,
+) -> int:
+    # Split the Installed Build into parts that can be exported concurrently
+    parts, total = (
+        _planParts(container, engineRoot, jobs) if canMeasure else ({"": None}, None)
+    )
+
+    # Skip any parts that were exported before the previous attempt was interrupted
+    if len(state.completed) > 0:
+        print(
+            "Resuming the interrupted export to {} ({} of {} parts already exported)...".format(
+                destination, len(state.completed & parts.keys()), len(parts)
+            )
+        )
     else:
-        engineRoot = "/home/ue4/UnrealEngine"
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        versionFilePath = os.path.join(tmpdir, "Build.version")
-        # Verify that the Installed Build in the specified image is at least 4.21.0
-        subprocess.run(
-            [
-                "docker",
-                "cp",
-                f"{container.name}:{engineRoot}/Engine/Build/Build.version",
-                versionFilePath,
-            ],
-            check=True,
+        print("Exporting to {}...".format(destination))
+    os.makedirs(destination, exist_ok=True)
+    state.save()
+
+    progress = TransferProgress(total)
+    for part in state.completed & parts.keys():
+        progress.add(parts[part] or 0)
+
+    # Files left behind by an interrupted part are kept if they match, so we only rewrite what changed
+    extractor = ArchiveExtractor(destination, progress, resume=True)
+
+    # Export the largest parts first, so that the smaller parts fill in the gaps at the end
+    pending = sorted(
+        [part for part in parts if part not in state.completed],
+        key=lambda part: parts[part] or 0,
+        reverse=True,
+    )
+    _exportParts(
+        container, engineRoot, extractor, progress, pending, jobs, state.complete
+    )
+
+    state.remove()
+    return 0
+
+
+def doIncrementalExport(
+    container: Container, engineRoot: str, destination: str, jobs: int
+) -> int:
+    # Generate the manifest of the Installed Build inside the container, and load the manifest from the previous export (if any)
+    print("Generating the manifest of the Installed Build...")
+    with open(MANIFEST_SCRIPT, "r") as f:
+        script = f.read()
+    output = DockerUtils.exec(
+        container, ["python3", "-c", script, engineRoot], stderr=False
+    )
+    manifest = _parseManifest(output.decode("utf-8").splitlines())
+    previous = {}
+    try:
+        with open(os.path.join(destination, EXPORT_MANIFEST_FILE), "r") as f:
+            previous = _parseManifest(f)
+    except OSError:
+        pass
+
+    # Compare the manifest with the destination directory
+    print("Comparing the manifest with {}...".format(destination))
+    os.makedirs(destination, exist_ok=True)
+    changed = _changedPaths(destination, manifest, previous, jobs)
+
+    # Delete any files that are no longer part of the Installed Build, and create any directories that are missing
+    # (Directories containing changed files are also created when the files are transferred, but empty directories are not)
+    removed = _removeStalePaths(destination, manifest)
+    for path, entry in manifest.items():
+        if entry["type"] == "directory":
+            os.makedirs(os.path.join(destination, path), exist_ok=True)
+
+    # Transfer the changed files, fetching whole directories when every file beneath them has changed
+    parts = _groupChangedPaths(manifest, changed, jobs)
+    total = sum(
+        entry.get("size", 0) for path, entry in manifest.items() if path in changed
+    )
+    print(
+        "{} of {} files changed ({}), {} removed.".format(
+            len(changed),
+            len([entry for entry in manifest.values() if entry["type"] != "directory"]),
+            humanfriendly.format_size(total, binary=True),
+            removed,
         )
-        try:
-            with open(versionFilePath, "r") as versionFile:
-                version = json.load(versionFile)
-                if version["MajorVersion"] == 4 and version["MinorVersion"] < 21:
-                    raise Exception()
-        except:
-            print(
-                "Error: Installed Builds can only be exported for Unreal Engine 4.21.0 and newer.",
-                file=sys.stderr,
+    )
+
+    progress = TransferProgress(total)
+    extractor = ArchiveExtractor(destination, progress)
+    _exportParts(
+        container,
+        engineRoot,
+        extractor,
+        progress,
+        sorted(parts, key=lambda part: parts[part], reverse=True),
+        jobs,
+    )
+
+    # Record the manifest so the next export can identify unchanged files without hashing them, and discard any
+    # state left behind by an interrupted non-incremental export, since the destination is now complete
+    temp = os.path.join(destination, EXPORT_MANIFEST_FILE + ".tmp")
+    with open(temp, "w") as f:
+        for entry in manifest.values():
+            f.write(json.dumps(entry) + "\n")
+    os.replace(temp, os.path.join(destination, EXPORT_MANIFEST_FILE))
+    ExportState(destination, None).remove()
+    return 0
+
+
+def doLayerExport(
+    image: str, destination: str, archivePath: Optional[str], jobs: int
+) -> int:
+    # When no archive was specified, verify the destination and the version of the Engine using the details of the image
+    # from the Docker daemon before we spend any time saving the image, which can be tens of gigabytes in size
+    spooled = None
+    if archivePath is None:
+        details = DockerUtils.client().images.get(image)
+        if not _verifyDestination(
+            destination, ExportState.load(destination), details.id
+        ):
+            return 1
+        version = EngineVersion.fromLabels(details.labels)
+        if version is not None and not _verifyVersion(lambda: version):
+            return 1
+
+        # Save the image to a temporary file beside the destination
+        # (The layers are read concurrently and in any order, so we cannot consume the output of `docker save` as a stream)
+        parent = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(parent, exist_ok=True)
+        handle, spooled = tempfile.mkstemp(
+            prefix=".ue4-docker-save-", suffix=".tar", dir=parent
+        )
+        archivePath = spooled
+
+    try:
+        if spooled is not None:
+            _saveImage(image, details, handle)
+
+        archive = ImageArchive(archivePath, image)
+        engineRoot = LAYER_ENGINE_ROOTS[archive.operatingSystem()]
+        state = ExportState.load(destination)
+        if not _verifyDestination(destination, state, archive.id):
+            return 1
+        if state is None:
+            state = ExportState(destination, archive.id)
+
+        # Images built by ue4-docker record the version of the Engine in their labels
+        version = EngineVersion.fromLabels(
+            (archive.config.get("config") or {}).get("Labels", None)
+        )
+        if version is not None and not _verifyVersion(lambda: version):
+            return 1
+
+        # Determine which layer provides the final version of each file, reading the version of the Engine as we go if necessary
+        print("Scanning {} image layers...".format(len(archive.layers)))
+        plans = archive.plan(
+            engineRoot, jobs, [VERSION_FILE] if version is None else []
+        )
+        if version is None and not _verifyVersion(
+            lambda: EngineVersion.fromBuildVersion(
+                ImageArchive.contents(plans, VERSION_FILE)
             )
+        ):
             return 1
 
-    # Attempt to perform the export
-    print("Exporting to {}...".format(destination))
-    subprocess.run(
-        ["docker", "cp", f"{container.name}:{engineRoot}", destination], check=True
+        # Skip any layers that were extracted before the previous attempt was interrupted
+        plans = [plan for plan in plans if len(plan.routes) > 0]
+        completed = [plan for plan in plans if plan.blob in state.completed]
+        if len(completed) > 0:
+            print(
+                "Resuming the interrupted export to {} ({} of {} layers already exported)...".format(
+                    destination, len(completed), len(plans)
+                )
+            )
+        else:
+            print("Exporting to {}...".format(destination))
+        os.makedirs(destination, exist_ok=True)
+        state.save()
+
+        progress = TransferProgress(sum(plan.size for plan in plans))
+        for plan in completed:
+            progress.add(plan.size)
+
+        # Each file is owned by exactly one layer, so the layers can be extracted concurrently
+        extractor = ArchiveExtractor(destination, progress, resume=True)
+        progress.start()
+        try:
+            archive.extract(
+                [plan for plan in plans if plan.blob not in state.completed],
+                engineRoot,
+                extractor,
+                jobs,
+                state.complete,
+            )
+        finally:
+            progress.stop()
+
+        state.remove()
+        return 0
+
+    finally:
+        if spooled is not None and os.path.exists(spooled):
+            os.unlink(spooled)
+
+
+def _saveImage(image: str, details: Image, handle: int) -> None:
+    # Writes the output of `docker save` for the specified image to the supplied file descriptor
+    print("Saving {}...".format(image))
+    progress = TransferProgress(details.attrs.get("Size", None))
+    progress.start()
+    try:
+        with os.fdopen(handle, "wb") as f:
+            for chunk in details.save(chunk_size=ARCHIVE_CHUNK_SIZE, named=True):
+                f.write(chunk)
+                progress.add(len(chunk))
+    finally:
+        progress.stop()
+
+
+def _verifyDestination(destination: str, state, imageId: str) -> bool:
+    # Verify that the destination directory does not exist, unless it contains an interrupted export of the same image
+    if state is None and os.path.exists(destination) == True:
+        print("Error: the destination directory already exists.", file=sys.stderr)
+        return False
+    elif state is not None and state.image != imageId:
+        print(
+            "Error: the destination directory contains an interrupted export of a different image.",
+            file=sys.stderr,
+        )
+        return False
+
+    return True
+
+
+def _verifyIncrementalDestination(destination: str, allowDelete: bool) -> bool:
+    # Since an incremental export deletes every file that is not part of the Installed Build, we only update a destination
+    # directory that is empty or was created by a previous incremental export, unless deletion was explicitly requested
+    if not os.path.exists(destination):
+        return True
+    elif not os.path.isdir(destination):
+        print("Error: the destination is not a directory.", file=sys.stderr)
+        return False
+    elif (
+        allowDelete == True
+        or len(os.listdir(destination)) == 0
+        or os.path.exists(os.path.join(destination, EXPORT_MANIFEST_FILE))
+    ):
+        return True
+
+    print(
+        "Error: the destination directory was not created by an incremental export.",
+        file=sys.stderr,
+    )
+    print(
+        "Specify --delete to allow files that are not part of the Installed Build to be deleted from it.",
+        file=sys.stderr,
     )
+    return False
+
+
+def _reportFailure(destination: str) -> None:
+    print("Error: failed to export Installed Build.", file=sys.stderr)
+    if os.path.exists(os.path.join(destination, EXPORT_STATE_FILE)):
+        print(
+            "Run the same command again to resume the export.",
+            file=sys.stderr,
+        )
+
+
+def _verifyVersion(readVersion) -> bool:
+    # Verify that the Installed Build in the specified image is at least 4.21.0
+    try:
+        if not readVersion().supportsInstalledBuildExport():
+            raise Exception()
+    except:
+        print(
+            "Error: Installed Builds can only be exported for Unreal Engine 4.21.0 and newer.",
+            file=sys.stderr,
+        )
+        return False
+
+    return True
+
+
+def _exportParts(
+    container: Container,
+    engineRoot: str,
+    extractor: ArchiveExtractor,
+    progress: TransferProgress,
+    parts: [str],
+    jobs: int,
+    onComplete=None,
+) -> None:
+    # Exports the specified parts of the Installed Build concurrently, each of which is a file or directory relative to the root
+    def exportPart(part: str) -> None:
+        source = posixpath.join(engineRoot, part) if part != "" else engineRoot
+        stream, _ = container.get_archive(source, chunk_size=ARCHIVE_CHUNK_SIZE)
+        extractor.extract(ChunkStream.open(stream), posixpath.basename(source), part)
+        if onComplete is not None:
+            onComplete(part)
+
+    progress.start()
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    futures = [executor.submit(exportPart, part) for part in parts]
+    try:
+        for future in futures:
+            future.result()
+    except:
+        # Do not start any more parts, and let the caller remove the container to interrupt the parts in progress
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        raise
+    finally:
+        progress.stop()
+
+    executor.shutdown()
+
+
+def _parseManifest(lines) -> dict:
+    # Parses a manifest generated by `generate-manifest.py`, keyed by path
+    manifest = {}
+    for line in lines:
+        if line.strip() != "":
+            entry = json.loads(line)
+            manifest[entry["path"]] = entry
+    return manifest
+
+
+def _hashFile(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(ARCHIVE_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _changedPaths(destination: str, manifest: dict, previous: dict, jobs: int) -> set:
+    # Identifies the paths in the manifest whose contents in the destination directory differ from the image
+    changed = set()
+    unverified = []
+    for path, entry in manifest.items():
+        target = os.path.join(destination, path)
+        try:
+            details = os.lstat(target)
+        except FileNotFoundError:
+            if entry["type"] != "directory":
+                changed.add(path)
+            continue
+
+        # Directories are never transferred, but anything else that has taken the place of a directory must be removed
+        if entry["type"] == "directory":
+            if not stat.S_ISDIR(details.st_mode):
+                os.unlink(target)
+            continue
+
+        if entry["type"] == "symlink":
+            if (
+                not stat.S_ISLNK(details.st_mode)
+                or os.readlink(target) != entry["target"]
+            ):
+                changed.add(path)
+            continue
+
+        if not stat.S_ISREG(details.st_mode) or details.st_size != entry["size"]:
+            changed.add(path)
+            continue
+
+        # A file that has not been modified since the previous export is unchanged if its hash is unchanged,
+        # which is the case for most files when an image is rebuilt, even though their modification times differ
+        last = previous.get(path, None)
+        if (
+            last is not None
+            and last.get("type") == "file"
+            and last["size"] == details.st_size
+            and last["mtime"] == int(details.st_mtime)
+        ):
+            if last["sha256"] != entry["sha256"]:
+                changed.add(path)
+            elif last["mtime"] != entry["mtime"]:
+                os.utime(target, (entry["mtime"], entry["mtime"]))
+            continue
+
+        # Otherwise, a file is unchanged if its modification time matches, and we hash it to find out if it does not
+        if int(details.st_mtime) != entry["mtime"]:
+            unverified.append(path)
+
+    # Hash the files whose contents we could not verify from their metadata alone
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        digests = executor.map(
+            _hashFile, [os.path.join(destination, path) for path in unverified]
+        )
+        for path, digest in zip(unverified, digests):
+            if digest != manifest[path]["sha256"]:
+                changed.add(path)
+            else:
+                mtime = manifest[path]["mtime"]
+                os.utime(os.path.join(destination, path), (mtime, mtime))
+
+    return changed
+
+
+def _removeStalePaths(destination: str, manifest: dict) -> int:
+    # Deletes the files and symlinks in the destination directory that are not in the manifest, along with any
+    # directories that are not in the manifest and are left empty, and returns the number of files and symlinks that were deleted
+    # (The manifest lists every directory in the Installed Build, including empty ones, which are therefore preserved)
+    removed = 0
+    for root, dirs, files in os.walk(destination, topdown=False):
+        relativeRoot = os.path.relpath(root, destination).replace(os.sep, "/")
+        relativeRoot = "" if relativeRoot == "." else relativeRoot
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            relative = posixpath.join(relativeRoot, name)
+            if relativeRoot == "" and name.startswith(
+                (EXPORT_STATE_FILE, EXPORT_MANIFEST_FILE)
+            ):
+                continue
+            if relative not in manifest or manifest[relative]["type"] == "directory":
+                os.unlink(os.path.join(root, name))
+                removed += 1
+        if (
+            relativeRoot != ""
+            and relativeRoot not in manifest
+            and len(os.listdir(root)) == 0
+        ):
+            os.rmdir(root)
+
+    return removed
+
+
+def _groupChangedPaths(manifest: dict, changed: set, jobs: int) -> dict:
+    # Groups the changed paths into parts to export, replacing the changed paths beneath a directory with the directory
+    # itself when every path beneath it has changed (except for the top-level directories that are too large for one worker)
+    sizes, counts, changedCounts = {}, {}, {}
+    for path, entry in manifest.items():
+        if entry["type"] == "directory":
+            continue
+        parent = posixpath.dirname(path)
+        while parent != "":
+            sizes[parent] = sizes.get(parent, 0) + entry.get("size", 0)
+            counts[parent] = counts.get(parent, 0) + 1
+            if path in changed:
+                changedCounts[parent] = changedCounts.get(parent, 0) + 1
+            parent = posixpath.dirname(parent)
+
+    threshold = sum(entry.get("size", 0) for entry in manifest.values()) / (jobs * 2)
+    parts = {}
+    for path in changed:
+        part = path
+        parent = posixpath.dirname(path)
+        while parent != "" and changedCounts.get(parent, 0) == counts[parent]:
+            if "/" in parent or sizes[parent] <= threshold:
+                part = parent
+            parent = posixpath.dirname(parent)
+        parts[part] = sizes.get(part, manifest.get(part, {}).get("size", 0))
+
+    return parts
+
+
+def _planParts(container: Container, engineRoot: str, jobs: int):
+    # Measure every file and directory in the top two levels of the Installed Build
+    sizes = {}
+    for line in (
+        DockerUtils.exec(container, ["du", "-ab", "--max-depth=2", engineRoot])
+        .decode("utf-8")
+        .splitlines()
+    ):
+        size, path = line.split("\t", 1)
+        sizes[posixpath.relpath(path, engineRoot)] = int(size)
+    directories = set(
+        posixpath.relpath(path, engineRoot)
+        for path in DockerUtils.exec(
+            container,
+            ["find", engineRoot, "-mindepth", "1", "-maxdepth", "1", "-type", "d"],
+        )
+        .decode("utf-8")
+        .splitlines()
+    )
+    total = sizes.pop(".")
+
+    # Each top-level file or directory is a part, except that the top-level directories that are too large
+    # to be exported by a single worker (such as the Engine directory) are split into their children
+    threshold = total / (jobs * 2)
+    parts = {}
+    for path, size in sizes.items():
+        parent = posixpath.dirname(path)
+        if parent == "":
+            if path not in directories or size <= threshold:
+                parts[path] = size
+        elif parent in directories and sizes[parent] > threshold:
+            parts[path] = size
+
+    return parts, total
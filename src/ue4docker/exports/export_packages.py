@@ -1,20 +1,52 @@
-from ..infrastructure import DockerUtils, FilesystemUtils, Logger, SubprocessUtils
-import docker, os, subprocess, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from ..infrastructure import (
+    ArchiveExtractor,
+    ChunkStream,
+    DockerUtils,
+    FilesystemUtils,
+    Logger,
+    NetworkUtils,
+    SubprocessUtils,
+    TransferProgress,
+)
+from ..infrastructure.ArchiveExtractor import ARCHIVE_CHUNK_SIZE
+import argparse, docker, fnmatch, os, posixpath, re, subprocess, sys, tempfile
 
-# The name we use for our temporary Conan remote
+# The name we use for our temporary Conan remote (which we qualify with the server port, so concurrent exports do not collide)
 REMOTE_NAME = "_ue4docker_export_temp"
 
+# The number of free ports we try when publishing conan_server, since another process can claim a free port
+# between the time we select it and the time the Docker daemon publishes it
+PORT_ATTEMPTS = 5
+
+# The environment variable that enables Conan's revisions feature, which we use so that conan_server stores
+# the real revision of each recipe and so that we can query the revisions of recipes on both sides of the export
+CONAN_REVISIONS_ENV = {"CONAN_REVISIONS_ENABLED": "1"}
+
+# The default number of packages that are uploaded and downloaded concurrently
+DEFAULT_PACKAGE_JOBS = 4
+
+# The pattern that matches the references of the packages that we export
+PACKAGE_PATTERN = "*/4.*"
+
+# The location of the Conan local cache in the ue4-full image under Linux
+CONTAINER_CACHE_DIR = "/home/ue4/.conan/data"
+
+# The contents of each recipe directory in the Conan local cache that we copy when exporting packages directly
+# (Build and source directories are not needed to consume the packages, and lock files are specific to each cache)
+CACHE_CONTENTS = ["export", "export_source", "package", "metadata.json"]
+
 # Our conan_server config file data
 CONAN_SERVER_CONFIG = """
 [server]
 jwt_secret: jwt_secret
 jwt_expire_minutes: 120
 ssl_enabled: False
-port: 9300
-public_port: 9300
-host_name: {}
+port: {port}
+public_port: {port}
+host_name: {host}
 authorize_timeout: 1800
-disk_storage_path: {}
+disk_storage_path: {dataDir}
 disk_authorize_timeout: 1800
 updown_secret: updown_secret
 
@@ -33,6 +65,32 @@ def exportPackages(image, destination, extraArgs):
     # Create our logger to generate coloured output on stderr
     logger = Logger()
 
+    # Parse the options for the export
+    parser = argparse.ArgumentParser(prog="ue4-docker export packages")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_PACKAGE_JOBS,
+        help="Number of packages to upload and download concurrently (default is {})".format(
+            DEFAULT_PACKAGE_JOBS
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Download every package, even if the host system local cache already contains the same recipe revision",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="Copy the packages directly from the Conan local cache in the image rather than serving them with conan_server (Linux images only)",
+    )
+    args = parser.parse_args(extraArgs)
+    if args.jobs < 1:
+        logger.error("Error: the number of jobs must be at least 1.")
+        sys.exit(1)
+
     # Verify that the destination is "cache"
     if destination.lower() != "cache":
         logger.error('Error: the only supported package export destination is "cache".')
@@ -50,6 +108,16 @@ def exportPackages(image, destination, extraArgs):
     # Determine if the container image is a Windows image or a Linux image
     imageOS = DockerUtils.listImages(image)[0].attrs["Os"]
 
+    # If requested, bypass conan_server entirely and copy the packages directly from the image
+    if args.direct == True:
+        if imageOS != "linux":
+            logger.error(
+                "Error: packages can only be exported directly from Linux images."
+            )
+            sys.exit(1)
+        exportPackagesDirect(image, args.jobs)
+        return
+
     # Use the appropriate commands and paths for the container platform
     cmdsAndPaths = {
         "linux": {
@@ -75,16 +143,17 @@ def exportPackages(image, destination, extraArgs):
         # Progress output
         print("Starting conan_server in a container...")
 
-        # Start a container from which we will export packages, bind-mounting our temp directory
-        container = DockerUtils.start(
+        # Start a container from which we will export packages, bind-mounting our temp directory and publishing
+        # conan_server on a free port, so that exports from multiple images can run concurrently
+        port, container = _startServerContainer(
             image,
             cmdsAndPaths["rootCommand"],
-            ports={"9300/tcp": 9300},
             mounts=[docker.types.Mount(cmdsAndPaths["bindMount"], tempDir, "bind")],
             stdin_open=imageOS == "windows",
             tty=imageOS == "windows",
             remove=True,
         )
+        remote = "{}_{}".format(REMOTE_NAME, port)
 
         # Reload the container attributes from the Docker daemon to ensure the networking fields are populated
         container.reload()
@@ -100,7 +169,9 @@ def exportPackages(image, destination, extraArgs):
         # Generate our server config file in the temp directory
         FilesystemUtils.writeFile(
             os.path.join(tempDir, "server.conf"),
-            CONAN_SERVER_CONFIG.format(externalAddress, cmdsAndPaths["dataDir"]),
+            CONAN_SERVER_CONFIG.format(
+                port=port, host=externalAddress, dataDir=cmdsAndPaths["dataDir"]
+            ),
         )
 
         # Keep track of the `conan_server` log output so we can display it in case of an error
@@ -127,14 +198,33 @@ def exportPackages(image, destination, extraArgs):
             print("Uploading packages to the server...")
 
             # Upload all of the packages in the container's local cache to the server
+            # (Conan uploads files in parallel using the number of threads specified by CONAN_CPU_COUNT)
             DockerUtils.execMultiple(
                 container,
                 [
-                    ["conan", "remote", "add", "localhost", "http://127.0.0.1:9300"],
+                    [
+                        "conan",
+                        "remote",
+                        "add",
+                        "localhost",
+                        "http://127.0.0.1:{}".format(port),
+                    ],
                     ["conan", "user", "user", "-r", "localhost", "-p", "password"],
-                    ["conan", "upload", "*/4.*", "--all", "--confirm", "-r=localhost"],
                 ],
             )
+            DockerUtils.exec(
+                container,
+                [
+                    "conan",
+                    "upload",
+                    PACKAGE_PATTERN,
+                    "--all",
+                    "--confirm",
+                    "--parallel",
+                    "-r=localhost",
+                ],
+                environment=dict(CONAN_REVISIONS_ENV, CONAN_CPU_COUNT=str(args.jobs)),
+            )
 
             # Configure the server as a temporary remote on the host system
             SubprocessUtils.run(
@@ -142,32 +232,69 @@ def exportPackages(image, destination, extraArgs):
                     "conan",
                     "remote",
                     "add",
-                    REMOTE_NAME,
-                    "http://{}:9300".format(externalAddress),
+                    remote,
+                    "http://{}:{}".format(externalAddress, port),
                 ]
             )
             SubprocessUtils.run(
-                ["conan", "user", "user", "-r", REMOTE_NAME, "-p", "password"]
+                ["conan", "user", "user", "-r", remote, "-p", "password"]
             )
 
             # Retrieve the list of packages that were uploaded to the server
             packages = SubprocessUtils.extractLines(
-                SubprocessUtils.capture(
-                    ["conan", "search", "-r", REMOTE_NAME, "*"]
-                ).stdout
+                SubprocessUtils.capture(["conan", "search", "-r", remote, "*"]).stdout
             )
             packages = [
                 package for package in packages if "/" in package and "@" in package
             ]
 
-            # Download each package in turn
-            for package in packages:
-                print(
-                    "Downloading package {} to host system local cache...".format(
+            # Skip any packages whose recipe revision already exists in the host system local cache
+            with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                if args.force == False:
+                    print("Comparing packages with the host system local cache...")
+                    existing = list(
+                        executor.map(
+                            lambda package: _recipeExists(package, remote), packages
+                        )
+                    )
+                    for package in [
+                        package
+                        for package, exists in zip(packages, existing)
+                        if exists == True
+                    ]:
+                        print(
+                            "Skipping package {}, which is already in the host system local cache".format(
+                                package
+                            )
+                        )
+                    packages = [
                         package
+                        for package, exists in zip(packages, existing)
+                        if exists == False
+                    ]
+
+                # Download the remaining packages concurrently
+                def download(package):
+                    SubprocessUtils.run(
+                        ["conan", "download", "-r", remote, package],
+                        env=_revisionsEnvironment(),
+                    )
+                    print(
+                        "Downloaded package {} to host system local cache".format(
+                            package
+                        ),
+                        flush=True,
+                    )
+
+                print(
+                    "Downloading {} packages to host system local cache...".format(
+                        len(packages)
                     )
                 )
-                SubprocessUtils.run(["conan", "download", "-r", REMOTE_NAME, package])
+                for future in [
+                    executor.submit(download, package) for package in packages
+                ]:
+                    future.result()
 
             # Once we reach this point, everything has worked and we don't need to output any logs
             serverOutput = None
@@ -184,4 +311,153 @@ def exportPackages(image, destination, extraArgs):
                     logger.error(chunk.decode("utf-8"))
 
             # Remove the temporary remote if it was created successfully
-            SubprocessUtils.run(["conan", "remote", "remove", REMOTE_NAME], check=False)
+            SubprocessUtils.run(["conan", "remote", "remove", remote], check=False)
+
+
+def exportPackagesDirect(image, jobs):
+    # Copies the packages from the Conan local cache in the image straight into the host system local cache
+    destination = _hostCacheDir()
+    print(
+        "Copying packages directly to the host system local cache at {}...".format(
+            destination
+        )
+    )
+
+    container = DockerUtils.start(image, ["sleep", "infinity"])
+    try:
+        # Identify the recipe directories (`name/version/user/channel`) for the packages that we export
+        recipes = [
+            posixpath.relpath(path, CONTAINER_CACHE_DIR)
+            for path in DockerUtils.exec(
+                container,
+                [
+                    "find",
+                    CONTAINER_CACHE_DIR,
+                    "-mindepth",
+                    "4",
+                    "-maxdepth",
+                    "4",
+                    "-type",
+                    "d",
+                ],
+            )
+            .decode("utf-8")
+            .splitlines()
+        ]
+        recipes = [recipe for recipe in recipes if _matchesPackagePattern(recipe)]
+
+        # Copy the recipes concurrently, leaving the other recipes in the host cache untouched
+        # (Files whose sizes and modification times already match the image are not rewritten)
+        progress = TransferProgress(None)
+        extractor = ArchiveExtractor(destination, progress, resume=True)
+
+        def copyRecipe(recipe):
+            stream, _ = container.get_archive(
+                posixpath.join(CONTAINER_CACHE_DIR, recipe),
+                chunk_size=ARCHIVE_CHUNK_SIZE,
+            )
+            extractor.extract(
+                ChunkStream.open(stream),
+                posixpath.basename(recipe),
+                recipe,
+                route=_routeCacheMember,
+            )
+            print("Copied package {}".format(_recipeReference(recipe)), flush=True)
+
+        progress.start()
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for future in [
+                    executor.submit(copyRecipe, recipe) for recipe in recipes
+                ]:
+                    future.result()
+        finally:
+            progress.stop()
+
+    finally:
+        container.remove(force=True)
+
+
+def _hostCacheDir():
+    # Determines the location of the host system local cache, honouring any custom storage path in conan.conf
+    home = SubprocessUtils.extractLines(
+        SubprocessUtils.capture(["conan", "config", "home"]).stdout
+    )[0]
+    result = SubprocessUtils.capture(
+        ["conan", "config", "get", "storage.path"], check=False
+    )
+    path = (
+        SubprocessUtils.extractLines(result.stdout)[0]
+        if result.returncode == 0
+        else "./data"
+    )
+    return os.path.normpath(os.path.join(home, os.path.expanduser(path)))
+
+
+def _recipeReference(recipe):
+    # Converts a recipe directory (`name/version/user/channel`) into a package reference (`name/version@user/channel`)
+    name, version, user, channel = recipe.split("/")
+    return "{}/{}@{}/{}".format(name, version, user, channel)
+
+
+def _matchesPackagePattern(recipe):
+    return fnmatch.fnmatchcase(_recipeReference(recipe), PACKAGE_PATTERN)
+
+
+def _routeCacheMember(relative):
+    # Determines whether a member of a recipe directory should be copied to the host system local cache
+    components = relative.split("/")
+    if relative != "" and components[0] not in CACHE_CONTENTS:
+        return []
+    if components[-1].endswith((".count", ".count.lock")):
+        return []
+    return [relative]
+
+
+def _startServerContainer(image, command, **kwargs):
+    # Starts the container that runs conan_server, publishing it on a free port and returning the port and the container
+    # (If another process claims the port before the Docker daemon publishes it, we simply try another one)
+    for attempt in range(PORT_ATTEMPTS):
+        port = NetworkUtils.freePort()
+        try:
+            return port, DockerUtils.start(
+                image, command, ports={"{}/tcp".format(port): port}, **kwargs
+            )
+        except docker.errors.APIError as e:
+            message = str(e).lower()
+            if attempt == PORT_ATTEMPTS - 1 or not (
+                "port is already allocated" in message
+                or "address already in use" in message
+            ):
+                raise
+
+
+def _revisionsEnvironment():
+    # Returns the environment for running Conan on the host with the revisions feature enabled
+    return dict(os.environ, **CONAN_REVISIONS_ENV)
+
+
+def _recipeRevision(package, remote=None):
+    # Retrieves the latest revision of a recipe as reported by Conan itself (which is correct for every revision mode),
+    # or returns None if the recipe does not exist
+    command = ["conan", "search", package, "--revisions"]
+    result = SubprocessUtils.capture(
+        command + (["-r", remote] if remote is not None else []),
+        check=False,
+        env=_revisionsEnvironment(),
+    )
+    if result.returncode != 0:
+        return None
+
+    # Each revision is listed on its own line, along with the time it was created, from newest to oldest
+    for line in SubprocessUtils.extractLines(result.stdout):
+        match = re.match("^([0-9a-f]{32,40})(\\s|$)", line.strip())
+        if match is not None:
+            return match[1]
+    return None
+
+
+def _recipeExists(package, remote):
+    # Determines whether the host system local cache contains the same revision of a recipe as the specified remote
+    local = _recipeRevision(package)
+    return local is not None and local == _recipeRevision(package, remote)
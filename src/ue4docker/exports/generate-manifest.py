@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from concurrent.futures import ProcessPoolExecutor
+import hashlib, json, os, sys
+
+# Generates a manifest of the directories, regular files and symlinks in a directory tree, printing one JSON object per line
+# (This runs inside a container based on the image being exported, so it must only depend on the standard library)
+
+# The size of the chunks in which we read file data when hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+# Walks the specified directory tree using `os.scandir()`, yielding the path of each directory, file and symlink relative to the root
+def walk(rootDir):
+    pending = [rootDir]
+    while len(pending) > 0:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                yield os.path.relpath(entry.path, rootDir), entry
+
+
+# Computes the SHA-256 hash of a file
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+if __name__ == "__main__":
+    rootDir = sys.argv[1]
+
+    # Gather the details of each directory, file and symlink, ignoring any special files
+    # (Directories are included so that empty directories are preserved by incremental exports)
+    files = []
+    for relative, entry in walk(rootDir):
+        if entry.is_dir(follow_symlinks=False):
+            print(json.dumps({"path": relative, "type": "directory"}))
+        elif entry.is_symlink():
+            print(
+                json.dumps(
+                    {
+                        "path": relative,
+                        "type": "symlink",
+                        "target": os.readlink(entry.path),
+                    }
+                )
+            )
+        elif entry.is_file(follow_symlinks=False):
+            details = entry.stat(follow_symlinks=False)
+            files.append((relative, details.st_size, int(details.st_mtime)))
+
+    # Hash the files using every available CPU core
+    with ProcessPoolExecutor() as executor:
+        digests = executor.map(
+            hashFile,
+            [os.path.join(rootDir, relative) for relative, _, _ in files],
+            chunksize=64,
+        )
+        for (relative, size, mtime), digest in zip(files, digests):
+            print(
+                json.dumps(
+                    {
+                        "path": relative,
+                        "type": "file",
+                        "size": size,
+                        "mtime": mtime,
+                        "sha256": digest,
+                    }
+                )
+            )
@@ -102,6 +102,25 @@ def info():
             )
         )
 
+    # List the images that contain the Unreal Engine, using the version labels applied when they were built
+    images = EngineVersion.labelledImages()
+    if len(images) > 0:
+        print("\nUnreal Engine images:")
+        PrettyPrinting.printColumns(
+            [
+                (
+                    tag,
+                    str(version)
+                    + (
+                        " (excludes {})".format(", ".join(version.excluded))
+                        if len(version.excluded) > 0
+                        else ""
+                    ),
+                )
+                for tag, version in images
+            ]
+        )
+
     # Warn the user if they're using an older version of Docker that can't build or run UE 5.4 Linux images without config changes
     if DockerUtils.isVersionWithoutIPV6Loopback():
         logger = Logger(prefix="")
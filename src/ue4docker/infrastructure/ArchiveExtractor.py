@@ -0,0 +1,288 @@
+import humanfriendly, io, os, posixpath, shutil, stat, sys, tarfile, threading, time
+from typing import Callable, Iterable, List, Optional
+
+# The size of the chunks in which we request archive data from the Docker daemon and write file data to disk
+ARCHIVE_CHUNK_SIZE = 4 * 1024 * 1024
+
+# The interval (in seconds) between progress reports
+PROGRESS_INTERVAL = 5.0
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Adapts an iterable of byte chunks (such as the stream returned by `Container.get_archive()`) into a readable file object
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self._buffer) == 0:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+        count = min(len(buffer), len(self._buffer))
+        buffer[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+    @staticmethod
+    def open(chunks: Iterable[bytes]) -> io.BufferedReader:
+        """
+        Returns a buffered reader for the supplied chunks, suitable for streaming into `tarfile`
+        """
+        return io.BufferedReader(ChunkStream(chunks), buffer_size=ARCHIVE_CHUNK_SIZE)
+
+
+class TransferProgress(object):
+    """
+    Tracks the number of bytes transferred by concurrent workers and periodically reports the throughput and ETA
+    """
+
+    def __init__(self, total: Optional[int], interval: float = PROGRESS_INTERVAL):
+        """
+        Creates a progress tracker for a transfer of the specified total size (which may be None if it is unknown)
+        """
+        self.total = total
+        self.interval = interval
+        self.transferred = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def add(self, count: int) -> None:
+        """
+        Records the transfer of the specified number of bytes
+        """
+        with self._lock:
+            self.transferred += count
+
+    def start(self) -> None:
+        """
+        Starts reporting progress in a background thread
+        """
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops reporting progress and prints a final report
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._report()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._report()
+
+    def _report(self) -> None:
+        with self._lock:
+            transferred = self.transferred
+
+        elapsed = max(time.time() - self._started, 0.001)
+        rate = transferred / elapsed
+        if self.total is not None and self.total > 0:
+            remaining = max(self.total - transferred, 0)
+            eta = (
+                humanfriendly.format_timespan(remaining / rate)
+                if rate > 0
+                else "unknown"
+            )
+            message = "{} of {} ({:.1f}%), {}/s, ETA {}".format(
+                humanfriendly.format_size(transferred, binary=True),
+                humanfriendly.format_size(self.total, binary=True),
+                min(100.0 * transferred / self.total, 100.0),
+                humanfriendly.format_size(rate, binary=True),
+                eta,
+            )
+        else:
+            message = "{}, {}/s".format(
+                humanfriendly.format_size(transferred, binary=True),
+                humanfriendly.format_size(rate, binary=True),
+            )
+
+        print("Progress: {}".format(message), file=sys.stderr, flush=True)
+
+
+class ArchiveExtractor(object):
+    """
+    Extracts streamed tar archives into a destination directory without buffering them in memory or on disk
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        progress: Optional[TransferProgress] = None,
+        resume: bool = False,
+    ):
+        """
+        Creates an extractor for the specified destination directory
+
+        When `resume` is True, regular files whose size and modification time already match the archive are not rewritten
+        """
+        self.destination = os.path.abspath(destination)
+        self.progress = progress
+        self.resume = resume
+
+        # The parent directories that we have verified reside within the destination
+        self._realDestination = os.path.realpath(self.destination)
+        self._verified = set()
+
+    def extract(
+        self,
+        fileobj,
+        strip: str,
+        into: str = "",
+        route: Optional[Callable[[str], List[str]]] = None,
+    ) -> None:
+        """
+        Extracts the members of the tar archive read from the supplied file object that reside under the path `strip`,
+        writing them to the subdirectory `into` of the destination directory (members outside `strip` are ignored)
+
+        If a `route` function is specified then it receives the path of each member relative to `strip` and returns the
+        relative paths to which the member should be written, which may be empty to skip the member entirely
+        """
+        strip = strip.strip("/")
+        root = os.path.join(self.destination, into)
+        with tarfile.open(fileobj=fileobj, mode="r|") as archive:
+            for member in archive:
+                relative = self._relativePath(member.name, strip)
+                if relative is None:
+                    continue
+
+                destinations = route(relative) if route is not None else [relative]
+                if len(destinations) == 0:
+                    continue
+
+                targets = [
+                    os.path.join(root, path) if path != "" else root
+                    for path in destinations
+                ]
+                self._extractMember(archive, member, targets[0], strip, into)
+
+                # Any additional destinations receive a hard link to (or a copy of) the extracted member
+                for target in targets[1:]:
+                    self._verifyParent(target)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    self._remove(target)
+                    try:
+                        os.link(targets[0], target, follow_symlinks=False)
+                    except OSError:
+                        shutil.copy2(targets[0], target, follow_symlinks=False)
+
+    def _relativePath(self, name: str, strip: str) -> Optional[str]:
+        # Determines the path of an archive member relative to `strip`, rejecting any member that would escape the destination
+        name = posixpath.normpath(name.lstrip("/"))
+        if name == ".." or name.startswith("../"):
+            raise RuntimeError(
+                'refusing to extract archive member "{}" outside the destination'.format(
+                    name
+                )
+            )
+        if strip == "":
+            return "" if name == "." else name
+        if name == strip:
+            return ""
+        if name.startswith(strip + "/"):
+            return name[len(strip) + 1 :]
+        return None
+
+    def _extractMember(self, archive, member, target: str, strip: str, into: str):
+        self._verifyParent(target)
+        if member.isdir():
+            if os.path.islink(target) or os.path.isfile(target):
+                os.unlink(target)
+            os.makedirs(target, exist_ok=True)
+            return
+
+        # Device files, FIFOs and other special files have no place in an Installed Build
+        if not (member.isfile() or member.issym() or member.islnk()):
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        if member.isfile():
+            if self.resume and self._matches(target, member):
+                self._addProgress(member.size)
+                return
+
+            self._remove(target)
+            source = archive.extractfile(member)
+            with open(target, "wb") as f:
+                while True:
+                    chunk = source.read(ARCHIVE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    self._addProgress(len(chunk))
+            os.chmod(target, member.mode & 0o777)
+            os.utime(target, (member.mtime, member.mtime))
+
+        elif member.issym():
+            if os.path.isdir(target) and not os.path.islink(target):
+                self._verified.clear()
+            self._remove(target)
+            os.symlink(member.linkname, target)
+
+        else:
+            # Hard links refer to other members of the same archive by their full name
+            linked = self._relativePath(member.linkname, strip)
+            if linked is None:
+                return
+            self._remove(target)
+            source = os.path.join(self.destination, into, linked)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+
+    def _verifyParent(self, target: str) -> None:
+        # Verifies that a symlink extracted earlier does not redirect the target path outside the destination
+        # (Each parent directory only needs to be checked once, unless a directory is later replaced with a symlink)
+        parent = os.path.dirname(target)
+        if parent in self._verified:
+            return
+        resolved = os.path.realpath(parent)
+        if resolved != self._realDestination and not resolved.startswith(
+            self._realDestination + os.sep
+        ):
+            raise RuntimeError(
+                'refusing to extract "{}" through a symlink that points outside the destination'.format(
+                    target
+                )
+            )
+        self._verified.add(parent)
+
+    def _matches(self, target: str, member) -> bool:
+        # Determines whether an existing file matches the size and modification time of an archive member
+        try:
+            details = os.lstat(target)
+        except FileNotFoundError:
+            return False
+        return (
+            stat.S_ISREG(details.st_mode)
+            and details.st_size == member.size
+            and int(details.st_mtime) == int(member.mtime)
+        )
+
+    def _remove(self, target: str) -> None:
+        # Removes any existing file or symlink at the target path, since it may be read-only or a hard link to another file
+        if os.path.islink(target) or os.path.isfile(target):
+            os.unlink(target)
+        elif os.path.isdir(target):
+            shutil.rmtree(target)
+
+    def _addProgress(self, count: int) -> None:
+        if self.progress is not None:
+            self.progress.add(count)
@@ -0,0 +1,212 @@
+import json, os, re, shutil, threading
+from typing import Optional
+
+from .DockerUtils import DockerUtils
+from .SubprocessUtils import SubprocessUtils
+
+# The buildx driver that builds images directly inside the Docker daemon
+DOCKER_DRIVER = "docker"
+
+# The directory within an OCI image layout in which each image's cache is exported before being merged into the layout
+OCI_STAGING_DIR = ".ue4-docker-staging"
+
+
+class BuildCache(object):
+    """
+    Generates the BuildKit `--cache-from` and `--cache-to` flags for importing and exporting the build cache of each image
+    """
+
+    # The supported cache backends
+    BACKENDS = ["local", "registry", "oci"]
+
+    # The supported cache export modes
+    MODES = ["min", "max"]
+
+    # Serialises updates to the `index.json` file of OCI image layouts, which concurrent builds would otherwise overwrite
+    _ociLock = threading.Lock()
+
+    def __init__(
+        self,
+        backend: str,
+        location: str,
+        mode: str = "max",
+        driver: Optional[str] = DOCKER_DRIVER,
+    ):
+        """
+        Creates a build cache using the specified backend, which stores its data at the specified location:
+
+        - `local`: a directory on the host, with a separate subdirectory for the cache of each image
+        - `registry`: an image repository in a container registry, with a separate tag for the cache of each image
+        - `oci`: a single OCI image layout directory on the host, with a separate tag for the cache of each image
+
+        The driver is that of the active buildx builder (see `builderDriver()`), which determines whether
+        the built images need to be explicitly loaded into the Docker daemon
+        """
+        if backend not in BuildCache.BACKENDS:
+            raise RuntimeError(
+                'unsupported build cache backend "{}", supported backends are {}'.format(
+                    backend, BuildCache.BACKENDS
+                )
+            )
+        if mode not in BuildCache.MODES:
+            raise RuntimeError(
+                'unsupported build cache mode "{}", supported modes are {}'.format(
+                    mode, BuildCache.MODES
+                )
+            )
+
+        self.backend = backend
+        self.location = (
+            os.path.abspath(location) if backend in ["local", "oci"] else location
+        )
+        self.mode = mode
+        self.driver = driver
+
+    def args(self, image: str) -> [str]:
+        """
+        Returns the flags to import and export the build cache for the image with the specified (fully-qualified) tag
+        """
+        key = self._key(image)
+
+        if self.backend == "local":
+            directory = os.path.join(self.location, key)
+            source = "type=local,src={}".format(directory)
+            destination = "type=local,dest={}".format(directory)
+            exists = os.path.exists(os.path.join(directory, "index.json"))
+
+        elif self.backend == "oci":
+            # Each image's cache is exported to its own staging layout, which `commit()` merges into the shared layout
+            staging = self._ociStaging(key)
+            shutil.rmtree(staging, ignore_errors=True)
+            source = "type=local,src={},tag={}".format(self.location, key)
+            destination = "type=local,dest={},tag={},oci-mediatypes=true".format(
+                staging, key
+            )
+            exists = self._ociHasTag(key)
+
+        else:
+            ref = "{}:{}".format(self.location, key)
+            source = "type=registry,ref={}".format(ref)
+            destination = "type=registry,ref={}".format(ref)
+            exists = True
+
+        # BuildKit fails when importing from a local cache that has not yet been created
+        fromArgs = ["--cache-from", source] if exists else []
+
+        # Builders that do not use the `docker` driver do not add the built image to the Docker daemon unless asked to
+        loadArgs = ["--load"] if self.driver != DOCKER_DRIVER else []
+        return (
+            fromArgs
+            + [
+                "--cache-to",
+                "{},mode={}".format(destination, self.mode),
+            ]
+            + loadArgs
+        )
+
+    def commit(self, image: str) -> None:
+        """
+        Completes the export of the build cache for the image with the specified (fully-qualified) tag once it has been built,
+        which merges the cache into our OCI image layout when using the `oci` backend
+        """
+        if self.backend != "oci":
+            return
+
+        key = self._key(image)
+        staging = self._ociStaging(key)
+        try:
+            with open(os.path.join(staging, "index.json"), "r") as f:
+                staged = json.load(f)
+        except (OSError, ValueError):
+            # The image was not built, so there is no cache to merge
+            return
+
+        with BuildCache._ociLock:
+            # Move the blobs into the shared layout before we update its index, since they are content-addressed
+            # and existing blobs can therefore be shared with the cache of any other image
+            for root, _, files in os.walk(os.path.join(staging, "blobs")):
+                target = os.path.join(self.location, os.path.relpath(root, staging))
+                os.makedirs(target, exist_ok=True)
+                for file in files:
+                    if not os.path.exists(os.path.join(target, file)):
+                        os.replace(os.path.join(root, file), os.path.join(target, file))
+
+            # Replace any previous manifest with the same tag in the shared index, writing the new index atomically
+            index = self._ociIndex()
+            index["manifests"] = [
+                manifest
+                for manifest in index.get("manifests", [])
+                if BuildCache._ociTag(manifest) != key
+            ] + staged.get("manifests", [])
+            temp = os.path.join(self.location, "index.json.tmp")
+            with open(temp, "w") as f:
+                json.dump(index, f)
+            os.replace(temp, os.path.join(self.location, "index.json"))
+
+            layout = os.path.join(self.location, "oci-layout")
+            if not os.path.exists(layout):
+                shutil.copyfile(os.path.join(staging, "oci-layout"), layout)
+
+        shutil.rmtree(staging, ignore_errors=True)
+
+    @staticmethod
+    def builderDriver() -> str:
+        """
+        Determines the driver of the active buildx builder
+        """
+        output = SubprocessUtils.capture(["docker", "buildx", "inspect"]).stdout.decode(
+            "utf-8"
+        )
+        match = re.search("^Driver:\\s*(\\S+)", output, re.MULTILINE)
+        if match is None:
+            raise RuntimeError("could not determine the driver of the buildx builder")
+        return match[1]
+
+    @staticmethod
+    def verifyDriver(driver: str) -> None:
+        """
+        Verifies that the specified buildx driver can export the build cache, raising an error if it cannot
+        """
+        # The `docker` driver can only export the build cache when the daemon uses the containerd image store
+        if driver == DOCKER_DRIVER:
+            driverStatus = DockerUtils.info(cached=True).get("DriverStatus") or []
+            if not any("containerd" in str(value) for _, value in driverStatus):
+                raise RuntimeError(
+                    "the default `docker` buildx driver cannot export the build cache unless the containerd image store "
+                    + "is enabled, so either enable the containerd image store or create and select a builder "
+                    + "that uses the `docker-container` driver (`docker buildx create --use --driver docker-container`)"
+                )
+
+    def _ociHasTag(self, tag: str) -> bool:
+        # Determines whether our OCI image layout contains a manifest with the specified tag
+        with BuildCache._ociLock:
+            index = self._ociIndex()
+        return any(
+            BuildCache._ociTag(manifest) == tag
+            for manifest in index.get("manifests", [])
+        )
+
+    def _ociIndex(self) -> dict:
+        # Reads the index of our OCI image layout, which is empty if the layout has not yet been created
+        try:
+            with open(os.path.join(self.location, "index.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"schemaVersion": 2, "manifests": []}
+
+    def _ociStaging(self, key: str) -> str:
+        # Returns the staging layout to which the cache for the image with the specified key is exported
+        return os.path.join(self.location, OCI_STAGING_DIR, key)
+
+    @staticmethod
+    def _ociTag(manifest: dict) -> Optional[str]:
+        return manifest.get("annotations", {}).get("org.opencontainers.image.ref.name")
+
+    def _key(self, image: str) -> str:
+        # Derives a cache key from the image's repository name and tag that is also valid as an image tag
+        # (e.g. "adamrehn/ue4-minimal:5.1.1" becomes "ue4-minimal-5.1.1")
+        repository, _, tag = image.rpartition(":")
+        if "/" in tag or repository == "":
+            repository, tag = image, "latest"
+        key = "{}-{}".format(repository.rsplit("/", 1)[-1], tag)
+        return re.sub("[^A-Za-z0-9_.-]", "-", key)[:128]
@@ -1,11 +1,14 @@
 import json
 import platform
 import random
+import re
 from typing import Optional
 
 import humanfriendly
 from packaging.version import Version, InvalidVersion
 
+from .BuildCache import BuildCache
+from .CredentialEndpoint import DEFAULT_CREDENTIAL_PORT
 from .DockerUtils import DockerUtils
 from .WindowsUtils import WindowsUtils
 
@@ -24,6 +27,14 @@ DEFAULT_LINUX_VERSION = "ubuntu22.04"
 # The default CUDA version to use when `--cuda` is specified without a value
 DEFAULT_CUDA_VERSION = "12.2.0"
 
+# The sparse checkout patterns that exclude the prebuilt binaries for a platform when using the `sparse` clone mode
+# (`{}` is replaced with the name of each platform excluded from the dependencies downloaded by the Setup script)
+SPARSE_CHECKOUT_EXCLUSIONS = [
+    "!**/Binaries/**/{}/",
+    "!**/Source/ThirdParty/**/lib/{}/",
+    "!**/Source/ThirdParty/**/Lib/{}/",
+]
+
 # The default memory limit (in GB) under Windows
 DEFAULT_MEMORY_LIMIT = 10.0
 
@@ -114,6 +125,29 @@ class ExcludedComponent(object):
         }.get(component, "[Unknown component]")
 
 
+class EngineRelease(object):
+    """
+    The details of a single version of the Unreal Engine that we will build
+    """
+
+    def __init__(
+        self,
+        release: str,
+        repository: str,
+        branch: str,
+        custom: bool,
+        changelist: Optional[int],
+    ):
+        self.release = release
+        self.repository = repository
+        self.branch = branch
+        self.custom = custom
+        self.changelist = changelist
+
+    def __str__(self) -> str:
+        return self.release
+
+
 class BuildConfiguration(object):
     @staticmethod
     def addArguments(parser):
@@ -127,8 +161,9 @@ class BuildConfiguration(object):
         )
         parser.add_argument(
             "--ue-version",
+            action="append",
             default=None,
-            help='UE4 release to build, in semver format (e.g. 4.27.0) or "custom" for a custom repo and branch',
+            help='UE4 release to build, in semver format (e.g. 4.27.0) or "custom" for a custom repo and branch. May be specified multiple times or comma-separated to build a matrix of releases',
         )
         parser.add_argument(
             "--linux",
@@ -140,6 +175,11 @@ class BuildConfiguration(object):
             action="store_true",
             help="Rebuild images even if they already exist",
         )
+        parser.add_argument(
+            "--skip-unchanged",
+            action="store_true",
+            help="When used with --rebuild, skip images whose Dockerfile, build arguments, build context and parent images are unchanged",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -215,13 +255,15 @@ class BuildConfiguration(object):
         )
         parser.add_argument(
             "-repo",
+            action="append",
             default=None,
-            help='Set the custom git repository to clone when "custom" is specified as the release value',
+            help='Set the custom git repository to clone when "custom" is specified as the release value (specify once per custom release when building a matrix)',
         )
         parser.add_argument(
             "-branch",
+            action="append",
             default=None,
-            help='Set the custom branch/tag to clone when "custom" is specified as the release value',
+            help='Set the custom branch/tag to clone when "custom" is specified as the release value (specify once per custom release when building a matrix)',
         )
         parser.add_argument(
             "-isolation",
@@ -273,6 +315,17 @@ class BuildConfiguration(object):
             default=20.0,
             help="Sampling interval in seconds when resource monitoring has been enabled using --monitor (default is 20 seconds)",
         )
+        parser.add_argument(
+            "--monitor-output",
+            default=None,
+            metavar="FILE",
+            help="Write each resource usage sample to the specified CSV file when resource monitoring has been enabled using --monitor",
+        )
+        parser.add_argument(
+            "--monitor-cgroups",
+            action="store_true",
+            help="Sample the CPU time, peak memory usage and disk writes of the build containers from their cgroups when resource monitoring has been enabled using --monitor (Linux hosts with cgroup v2 only)",
+        )
         parser.add_argument(
             "--ignore-blacklist",
             action="store_true",
@@ -290,6 +343,76 @@ class BuildConfiguration(object):
             default=None,
             help="Set a specific changelist number in the Unreal Engine's Build.version file",
         )
+        parser.add_argument(
+            "--timing-report",
+            default=None,
+            metavar="FILE",
+            help="Write the duration of every build step, the layer commit time and the layer sizes for each built image to the specified .json or .csv file",
+        )
+        parser.add_argument(
+            "--instrument",
+            action="store_true",
+            help="Wrap each RUN directive in the Linux Dockerfiles to report its duration and exit status, and print a per-step timing summary for each built image",
+        )
+        parser.add_argument(
+            "--instrument-sizes",
+            action="store_true",
+            help="Also report the number of bytes of files created or modified by each RUN directive when step instrumentation has been enabled using --instrument (this scans the container filesystem after every step)",
+        )
+        parser.add_argument(
+            "--cache-backend",
+            default=None,
+            choices=BuildCache.BACKENDS,
+            help="Import and export the BuildKit build cache of each image using the specified backend (Linux containers only)",
+        )
+        parser.add_argument(
+            "--cache-location",
+            default=None,
+            help="The directory (for the local and oci backends) or image repository (for the registry backend) used to store the build cache",
+        )
+        parser.add_argument(
+            "--cache-mode",
+            default="max",
+            choices=BuildCache.MODES,
+            help="Export the build cache for only the layers of the final image (min) or for every intermediate layer (max, the default)",
+        )
+        parser.add_argument(
+            "-credential-port",
+            type=int,
+            default=DEFAULT_CREDENTIAL_PORT,
+            help="Port for the credential endpoint when using the `endpoint` credential mode (default is {}, which is opened by `ue4-docker setup`, and 0 selects an ephemeral port)".format(
+                DEFAULT_CREDENTIAL_PORT
+            ),
+        )
+        parser.add_argument(
+            "--gitdeps-cache",
+            action="store_true",
+            help="Cache the dependency data downloaded by the Setup script in a host directory that is shared between builds (see `ue4-docker clean --gitdeps`)",
+        )
+        parser.add_argument(
+            "--log-file",
+            default=None,
+            metavar="FILE",
+            help="Write the output of every build to the specified log file, which is rotated once it reaches the size given by --log-max-size",
+        )
+        parser.add_argument(
+            "--log-max-size",
+            default="100MiB",
+            metavar="SIZE",
+            help="Maximum size of the log file specified by --log-file before it is rotated (default is 100MiB)",
+        )
+        parser.add_argument(
+            "--log-events",
+            default=None,
+            metavar="FILE",
+            help="Write each line of build output to the specified file as a JSON event",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Maximum number of images to build concurrently when their dependencies allow it, which is only possible when building multiple releases (default is 1)",
+        )
         parser.add_argument(
             "--prerequisites-dockerfile",
             default=None,
@@ -399,65 +522,62 @@ class BuildConfiguration(object):
                 "specified both `--ue-version` and the old positional version option; please use only `--ue-version`!"
             )
 
+        # Gather the list of releases to build, which may contain multiple comma-separated values per flag
+        releaseValues = []
+        if self.args.ue_version is not None:
+            split = [item.split(",") for item in self.args.ue_version]
+            releaseValues = [item.strip() for sublist in split for item in sublist]
+        elif self.args.release is not None:
+            releaseValues = [self.args.release]
+        releaseValues = [value for value in releaseValues if len(value) > 0]
+
         # For the sake of a simpler pull request, we use self.args.release as the canonical place for this data.
         # If support for the old positional version option is removed, this should be fixed.
-        if self.args.ue_version is not None:
-            self.args.release = self.args.ue_version
+        if len(releaseValues) > 0:
+            self.args.release = releaseValues[0]
 
         # We care about the version number only if we're building source
+        self.releases = []
         if self.buildTargets["source"]:
-            if self.args.release is None:
+            if len(releaseValues) == 0:
                 raise RuntimeError("missing `--ue-version` when building source")
 
-            # Determine if we are building a custom version of UE4 rather than an official release
-            self.args.release = self.args.release.lower()
-            if self.args.release == "custom" or self.args.release.startswith("custom:"):
-                # Both a custom repository and a custom branch/tag must be specified
-                if self.args.repo is None or self.args.branch is None:
-                    raise RuntimeError(
-                        "both a repository and branch/tag must be specified when building a custom version of the Engine"
+            # Custom releases consume the specified repositories and branches/tags in order
+            repos = list(self.args.repo) if self.args.repo is not None else []
+            branches = list(self.args.branch) if self.args.branch is not None else []
+            customCount = len(
+                [
+                    value
+                    for value in releaseValues
+                    if value.lower() == "custom" or value.lower().startswith("custom:")
+                ]
+            )
+            if len(repos) != customCount or len(branches) != customCount:
+                raise RuntimeError(
+                    "the number of `-repo` values ({}) and `-branch` values ({}) must match the number of custom `--ue-version` values ({})".format(
+                        len(repos), len(branches), customCount
                     )
-
-                # Use the specified repository and branch/tag
-                customName = (
-                    self.args.release.split(":", 2)[1].strip()
-                    if ":" in self.args.release
-                    else ""
                 )
-                self.release = customName if len(customName) > 0 else "custom"
-                self.repository = self.args.repo
-                self.branch = self.args.branch
-                self.custom = True
+            for value in releaseValues:
+                self.releases.append(self._resolveRelease(value, repos, branches))
 
-            else:
-                # Validate the specified version string
-                try:
-                    ue4Version = Version(self.args.release)
-                    if ue4Version.major not in [4, 5] or ue4Version.pre is not None:
-                        raise Exception(f"unsupported engine version: {ue4Version}")
-                    self.release = (
-                        f"{ue4Version.major}.{ue4Version.minor}.{ue4Version.micro}"
-                    )
-                except InvalidVersion:
-                    raise RuntimeError(
-                        'invalid Unreal Engine release number "{}", full semver format required (e.g. "4.27.0")'.format(
-                            self.args.release
-                        )
+            # Verify that no two releases would produce images with the same tags
+            names = [release.release for release in self.releases]
+            duplicates = sorted(set([name for name in names if names.count(name) > 1]))
+            if len(duplicates) > 0:
+                raise RuntimeError(
+                    "the following releases were specified more than once: {}".format(
+                        ", ".join(duplicates)
                     )
+                )
 
-                # Use the default repository and the release tag for the specified version
-                self.repository = DEFAULT_GIT_REPO
-                self.branch = "{}-release".format(self.release)
-                self.custom = False
-
-                # If the user specified a .0 release of the Unreal Engine and did not specify a changelist override then
-                # use the official changelist number for that release to ensure consistency with Epic Games Launcher builds
-                # (This is necessary because .0 releases do not include a `CompatibleChangelist` value in Build.version)
-                if (
-                    self.changelist is None
-                    and self.release in UNREAL_ENGINE_RELEASE_CHANGELISTS
-                ):
-                    self.changelist = UNREAL_ENGINE_RELEASE_CHANGELISTS[self.release]
+            # The primary release provides the defaults needed by other parts of the codebase
+            primary = self.releases[0]
+            self.release = primary.release
+            self.repository = primary.repository
+            self.branch = primary.branch
+            self.custom = primary.custom
+            self.changelist = primary.changelist
         else:
             # defaults needed by other parts of the codebase
             self.custom = False
@@ -473,6 +593,7 @@ class BuildConfiguration(object):
         )
         self.dryRun = self.args.dry_run
         self.rebuild = self.args.rebuild
+        self.skipUnchanged = self.args.skip_unchanged
         self.suffix = self.args.suffix
         self.platformArgs = ["--no-cache"] if self.args.no_cache == True else []
         self.excludedComponents = set(self.args.exclude)
@@ -482,6 +603,37 @@ class BuildConfiguration(object):
         self.verbose = self.args.verbose
         self.layoutDir = self.args.layout
         self.combine = self.args.combine
+        self.jobs = self.args.jobs
+        self.timingReportFile = self.args.timing_report
+        self.instrument = self.args.instrument or self.args.instrument_sizes
+        self.instrumentSizes = self.args.instrument_sizes
+        self.logFile = self.args.log_file
+        self.logEventsFile = self.args.log_events
+
+        # Parse the maximum size for the build log file
+        try:
+            self.logMaxSize = humanfriendly.parse_size(self.args.log_max_size)
+        except:
+            raise RuntimeError(
+                'invalid log file size "{}"'.format(self.args.log_max_size)
+            )
+
+        # Verify that the maximum number of concurrent image builds is valid
+        if self.jobs < 1:
+            raise RuntimeError("the value for `--jobs` must be at least 1")
+
+        # Generated Dockerfiles are merged and copied in dependency order, so never generate them concurrently
+        if self.layoutDir is not None:
+            self.jobs = 1
+
+        # The images for a single release form a chain in which each image builds upon the previous one,
+        # so images can only be built concurrently when building multiple releases
+        if self.jobs > 1 and len(self.releases) < 2:
+            logger.warning(
+                "Warning: `--jobs` has no effect unless multiple releases are specified with `--ue-version`, since the images for a single release must be built one after another",
+                False,
+            )
+            self.jobs = 1
 
         # If the user specified custom version strings for ue4cli and/or conan-ue4cli, process them
         self.ue4cliVersion = self._processPackageVersion("ue4cli", self.args.ue4cli)
@@ -507,19 +659,85 @@ class BuildConfiguration(object):
             self.opts["combine"] = True
 
         # If the user requested an option that is only compatible with generated Dockerfiles then ensure `-layout` was specified
-        if self.layoutDir is None and self.opts.get("source_mode", "git") != "git":
+        if self.layoutDir is None and self.opts.get("source_mode", "git") == "copy":
             raise RuntimeError(
-                "the `-layout` flag must be used when specifying a non-default value for the `source_mode` option"
+                "the `-layout` flag must be used when setting the `source_mode` option to `copy`"
             )
+        if self.opts.get("source_mode", "git") == "mirror":
+            if self.layoutDir is not None:
+                raise RuntimeError(
+                    "the `-layout` flag cannot be used when setting the `source_mode` option to `mirror`, since the mirror is only served during builds"
+                )
+            if self.containerPlatform != "linux":
+                raise RuntimeError(
+                    "setting the `source_mode` option to `mirror` is only supported when building Linux containers"
+                )
         if self.layoutDir is None and self.combine == True:
             raise RuntimeError(
                 "the `-layout` flag must be used when specifying the `--combine` flag"
             )
+        if self.skipUnchanged and self.opts.get("disable_labels", False) == True:
+            raise RuntimeError(
+                "the `--skip-unchanged` flag cannot be used with the `disable_labels` option, since input hashes are stored as labels"
+            )
+        # We use the well-known port for the credential endpoint by default, since that is the port that `ue4-docker setup`
+        # opens in the host firewall (a port of zero requests an ephemeral port, which avoids conflicts between concurrent runs)
+        self.credentialPort = self.args.credential_port
+        if self.credentialPort < 0 or self.credentialPort > 65535:
+            raise RuntimeError(
+                "invalid credential endpoint port {}".format(self.credentialPort)
+            )
+
+        # The gitdeps cache is served by a proxy that only runs while we are building images
+        self.gitdepsCache = self.args.gitdeps_cache
+        if self.gitdepsCache == True:
+            if self.layoutDir is not None:
+                raise RuntimeError(
+                    "the `--gitdeps-cache` flag cannot be used with the `-layout` flag"
+                )
+            self.opts["gitdeps_cache"] = True
+
+        # RUN directives can only be instrumented when they are executed by a POSIX shell
+        if self.instrument and self.containerPlatform != "linux":
+            raise RuntimeError(
+                "the `--instrument` flag is only supported when building Linux containers"
+            )
+
+        # If a build cache was requested then verify that we can use it
+        self.cache = None
+        if self.args.cache_backend is not None:
+            if self.args.cache_location is None:
+                raise RuntimeError(
+                    "the `--cache-location` flag must be specified when using the `--cache-backend` flag"
+                )
+            if self.containerPlatform != "linux":
+                raise RuntimeError(
+                    "the `--cache-backend` flag is only supported when building Linux containers"
+                )
+            if self.layoutDir is None:
+                # Verify that the active buildx builder can export the build cache before we start building anything
+                driver = BuildCache.builderDriver()
+                BuildCache.verifyDriver(driver)
+                self.cache = BuildCache(
+                    self.args.cache_backend,
+                    self.args.cache_location,
+                    self.args.cache_mode,
+                    driver,
+                )
+        elif self.args.cache_location is not None:
+            raise RuntimeError(
+                "the `--cache-backend` flag must be specified when using the `--cache-location` flag"
+            )
+
+        if self.layoutDir is not None and len(self.releases) > 1:
+            raise RuntimeError(
+                "the `-layout` flag cannot be used when building multiple releases"
+            )
 
         # We care about source_mode and credential_mode only if we're building source
         if self.buildTargets["source"]:
             # Verify that the value for `source_mode` is valid if specified
-            validSourceModes = ["git", "copy"]
+            validSourceModes = ["git", "copy", "mirror"]
             if self.opts.get("source_mode", "git") not in validSourceModes:
                 raise RuntimeError(
                     "invalid value specified for the `source_mode` option, valid values are {}".format(
@@ -546,6 +764,29 @@ class BuildConfiguration(object):
                     )
                 )
 
+        # Verify that the value for `minimal_layers` is valid if specified
+        # (Note that values of "0" and "1" are parsed as booleans, so we map them back to integers before validating them)
+        if "minimal_layers" in self.opts:
+            if self.containerPlatform != "linux":
+                raise RuntimeError(
+                    "the `minimal_layers` option is only supported when building Linux containers"
+                )
+            try:
+                value = self.opts["minimal_layers"]
+                if isinstance(value, bool):
+                    value = int(value)
+                elif isinstance(value, str):
+                    value = int(value.strip())
+                elif not isinstance(value, int):
+                    raise ValueError()
+                if value < 1:
+                    raise ValueError()
+                self.opts["minimal_layers"] = value
+            except ValueError:
+                raise RuntimeError(
+                    "invalid value specified for the `minimal_layers` option, the value must be a positive integer"
+                )
+
         # Generate Jinja context values for keeping or excluding components
         self.opts["excluded_components"] = {
             "ddc": ExcludedComponent.DDC in self.excludedComponents,
@@ -560,6 +801,26 @@ class BuildConfiguration(object):
                 else "--exclude=Android --exclude=Mac --exclude=Win32 --exclude=Win64"
             )
 
+        # If a sparse clone was requested then derive the sparse checkout patterns from the platforms excluded from the
+        # dependencies downloaded by the Setup script, so we never check out the prebuilt binaries for those platforms either
+        # (We only exclude binaries and prebuilt third-party libraries, since UnrealBuildTool and AutomationTool require the
+        # platform-specific source code and build rules for every platform, even when those platforms are not being built)
+        cloneMode = self.opts.get("clone_mode", "full")
+        if cloneMode not in ["full", "sparse"]:
+            raise RuntimeError(
+                "invalid value specified for the `clone_mode` option, valid values are {}".format(
+                    ["full", "sparse"]
+                )
+            )
+        if cloneMode == "sparse" and "sparse_checkout_patterns" not in self.opts:
+            self.opts["sparse_checkout_patterns"] = ["/*"] + [
+                pattern.format(excluded)
+                for excluded in re.findall(
+                    "--exclude=(\\S+)", self.opts["gitdependencies_args"]
+                )
+                for pattern in SPARSE_CHECKOUT_EXCLUSIONS
+            ]
+
         # Warn user that they are in danger of Docker 20GB COPY bug
         # Unfortunately, we don't have a cheap way to check whether user environment is affected
         # See https://github.com/adamrehn/ue4-docker/issues/99
@@ -568,7 +829,10 @@ class BuildConfiguration(object):
             if ExcludedComponent.Debug not in self.excludedComponents:
                 logger.warning("Warning: You didn't pass --exclude debug", False)
                 warn20GiB = True
-            if self.release and not self.custom and Version(self.release).major >= 5:
+            if any(
+                not release.custom and Version(release.release).major >= 5
+                for release in self.releases
+            ):
                 logger.warning("Warning: You're building Unreal Engine 5", False)
                 warn20GiB = True
 
@@ -605,6 +869,59 @@ class BuildConfiguration(object):
             ]
         )
 
+    def _resolveRelease(self, value: str, repos: [str], branches: [str]):
+        """
+        Resolves the repository, branch/tag and changelist for the specified release value
+        """
+
+        # Determine if we are building a custom version of UE4 rather than an official release
+        value = value.lower()
+        if value == "custom" or value.startswith("custom:"):
+            # Both a custom repository and a custom branch/tag must be specified
+            if len(repos) == 0 or len(branches) == 0:
+                raise RuntimeError(
+                    "both a repository and branch/tag must be specified when building a custom version of the Engine"
+                )
+
+            # Use the specified repository and branch/tag
+            customName = value.split(":", 2)[1].strip() if ":" in value else ""
+            return EngineRelease(
+                release=customName if len(customName) > 0 else "custom",
+                repository=repos.pop(0),
+                branch=branches.pop(0),
+                custom=True,
+                changelist=self.changelist,
+            )
+
+        # Validate the specified version string
+        try:
+            ue4Version = Version(value)
+            if ue4Version.major not in [4, 5] or ue4Version.pre is not None:
+                raise Exception(f"unsupported engine version: {ue4Version}")
+            release = f"{ue4Version.major}.{ue4Version.minor}.{ue4Version.micro}"
+        except InvalidVersion:
+            raise RuntimeError(
+                'invalid Unreal Engine release number "{}", full semver format required (e.g. "4.27.0")'.format(
+                    value
+                )
+            )
+
+        # If the user specified a .0 release of the Unreal Engine and did not specify a changelist override then
+        # use the official changelist number for that release to ensure consistency with Epic Games Launcher builds
+        # (This is necessary because .0 releases do not include a `CompatibleChangelist` value in Build.version)
+        changelist = self.changelist
+        if changelist is None and release in UNREAL_ENGINE_RELEASE_CHANGELISTS:
+            changelist = UNREAL_ENGINE_RELEASE_CHANGELISTS[release]
+
+        # Use the default repository and the release tag for the specified version
+        return EngineRelease(
+            release=release,
+            repository=DEFAULT_GIT_REPO,
+            branch="{}-release".format(release),
+            custom=False,
+            changelist=changelist,
+        )
+
     def _generateWindowsConfig(self):
         self.visualStudio = VisualStudios.get(self.args.visual_studio)
         if self.visualStudio is None:
@@ -612,23 +929,26 @@ class BuildConfiguration(object):
                 f"unknown Visual Studio version: {self.args.visual_studio}"
             )
 
-        if self.release is not None and not self.custom:
+        for release in self.releases:
+            if release.custom:
+                continue
+
             # Check whether specified Unreal Engine release is compatible with specified Visual Studio
             if (
                 self.visualStudio.supported_since is not None
-                and Version(self.release) < self.visualStudio.supported_since
+                and Version(release.release) < self.visualStudio.supported_since
             ):
                 raise RuntimeError(
-                    f"specified version of Unreal Engine is too old for Visual Studio {self.visualStudio.name}"
+                    f"specified version of Unreal Engine ({release}) is too old for Visual Studio {self.visualStudio.name}"
                 )
 
             if (
                 self.visualStudio.unsupported_since is not None
-                and Version(self.release) >= self.visualStudio.unsupported_since
+                and Version(release.release) >= self.visualStudio.unsupported_since
             ):
                 raise RuntimeError(
-                    "Visual Studio {} is too old for specified version of Unreal Engine".format(
-                        self.visualStudio
+                    "Visual Studio {} is too old for specified version of Unreal Engine ({})".format(
+                        self.visualStudio, release
                     )
                 )
 
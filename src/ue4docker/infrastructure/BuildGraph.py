@@ -0,0 +1,156 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+import humanfriendly, threading, time
+
+
+class BuildGraphNode(object):
+    def __init__(self, name: str, action: Callable[[], None], dependencies: [str]):
+        self.name = name
+        self.action = action
+        self.dependencies = list(dependencies)
+        self.startTime = None
+        self.endTime = None
+        self.error = None
+
+    def duration(self) -> float:
+        """
+        Returns the wall-clock time (in seconds) that the node took to run, or zero if it did not run
+        """
+        if self.startTime is None or self.endTime is None:
+            return 0.0
+        return self.endTime - self.startTime
+
+
+class BuildGraph(object):
+    def __init__(self, logger, maxWorkers: int = 1):
+        """
+        Creates an empty build graph that will run at most `maxWorkers` nodes concurrently
+        """
+        self.logger = logger
+        self.maxWorkers = max(1, maxWorkers)
+        self._nodes: Dict[str, BuildGraphNode] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self, name: str, action: Callable[[], None], dependencies: [str] = []
+    ) -> None:
+        """
+        Adds a node to the graph, which will run only once all of its dependencies have completed successfully
+        """
+        if name in self._nodes:
+            raise RuntimeError('duplicate build graph node "{}"'.format(name))
+        for dependency in dependencies:
+            if dependency not in self._nodes:
+                raise RuntimeError(
+                    'build graph node "{}" depends on unknown node "{}"'.format(
+                        name, dependency
+                    )
+                )
+
+        self._nodes[name] = BuildGraphNode(name, action, dependencies)
+
+    def nodes(self) -> List[BuildGraphNode]:
+        """
+        Returns the nodes of the graph in the order in which they were added
+        """
+        return list(self._nodes.values())
+
+    def run(self) -> None:
+        """
+        Runs every node in the graph, respecting dependencies and our worker limit
+
+        Nodes become ready in the order in which they were added, so a graph with a single worker
+        runs its nodes in exactly the same order as the equivalent sequence of function calls.
+        """
+        pending = list(self._nodes.keys())
+        completed = set()
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            running = {}
+            while len(pending) > 0 or len(running) > 0:
+                # Submit every pending node whose dependencies have all completed, up to our worker limit
+                # (Once a node fails we stop submitting new work and simply wait for in-flight nodes to finish)
+                if len(failed) == 0:
+                    for name in list(pending):
+                        if len(running) >= self.maxWorkers:
+                            break
+                        node = self._nodes[name]
+                        if all(d in completed for d in node.dependencies):
+                            pending.remove(name)
+                            running[executor.submit(self._runNode, node)] = node
+
+                if len(running) == 0:
+                    break
+
+                # Wait for at least one of the running nodes to finish
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if node.error is None:
+                        completed.add(node.name)
+                    else:
+                        failed.append(node)
+
+        # Propagate the first failure to the caller
+        if len(failed) > 0:
+            raise failed[0].error
+
+    def criticalPath(self) -> (List[str], float):
+        """
+        Returns the names of the nodes along the longest dependency chain (by node duration) and its total duration
+        """
+        best: Dict[str, (float, Optional[str])] = {}
+        for node in self._nodes.values():
+            predecessor = None
+            predecessorTime = 0.0
+            for dependency in node.dependencies:
+                if best[dependency][0] > predecessorTime:
+                    predecessor = dependency
+                    predecessorTime = best[dependency][0]
+            best[node.name] = (predecessorTime + node.duration(), predecessor)
+
+        if len(best) == 0:
+            return [], 0.0
+
+        # Walk back from the node with the longest cumulative duration
+        end = max(best.keys(), key=lambda name: best[name][0])
+        path = []
+        current = end
+        while current is not None:
+            path.insert(0, current)
+            current = best[current][1]
+
+        return path, best[end][0]
+
+    def report(self) -> None:
+        """
+        Logs the duration of each node that ran, along with the critical path through the graph
+        """
+        self.logger.info("BUILD GRAPH TIMING:", False)
+        for node in self._nodes.values():
+            if node.startTime is not None:
+                self.logger.info(
+                    "{}: {}".format(
+                        node.name, humanfriendly.format_timespan(node.duration())
+                    ),
+                    False,
+                )
+
+        path, duration = self.criticalPath()
+        if len(path) > 0:
+            self.logger.info(
+                "Critical path: {} ({})".format(
+                    " -> ".join(path), humanfriendly.format_timespan(duration)
+                ),
+                False,
+            )
+
+    def _runNode(self, node: BuildGraphNode) -> None:
+        node.startTime = time.time()
+        try:
+            node.action()
+        except (Exception, KeyboardInterrupt) as e:
+            node.error = e
+        finally:
+            node.endTime = time.time()
@@ -0,0 +1,333 @@
+from typing import Dict, List, Optional
+import base64, csv, datetime, json, re, threading
+
+# Matches the structured line emitted by each RUN directive instrumented by `DockerUtils.instrumentRunDirectives()`
+# (The numeric fields ensure that we do not match the echo command itself when BuildKit prints the directive)
+STEP_MARKER = re.compile(
+    "##ue4-docker-step ([0-9]+) ([0-9.]+) ([0-9.]+) ([0-9]+)(?: ([0-9]+))?\\s*$"
+)
+
+
+def _parseTimestamp(value: Optional[str]) -> Optional[float]:
+    """
+    Parses an RFC 3339 timestamp (with up to nanosecond precision, as emitted by Go) into a UNIX timestamp
+    """
+    if value is None:
+        return None
+
+    match = re.match(
+        "^(.+?[0-9]{2}:[0-9]{2}:[0-9]{2})(\\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?$",
+        value,
+    )
+    if match is None:
+        return None
+
+    # Python only supports microsecond precision and does not accept the "Z" suffix prior to 3.11
+    # (Prior to 3.11 it also requires exactly three or six fractional digits, so we always use six)
+    fraction = "." + (match[2] or ".")[1:7].ljust(6, "0")
+    offset = "+00:00" if match[3] in [None, "Z"] else match[3]
+    return datetime.datetime.fromisoformat(match[1] + fraction + offset).timestamp()
+
+
+class BuildStep(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+        self.completed = None
+        self.cached = False
+        self.error = None
+
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.completed is None:
+            return None
+        return self.completed - self.started
+
+
+class RawJsonProgressParser(object):
+    """
+    Parses the `--progress=rawjson` output of a BuildKit build, recording step timings and rendering human-readable output
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, BuildStep] = {}
+        self.layerCommits: List[float] = []
+        self._order: List[str] = []
+        self._statuses: Dict[str, BuildStep] = {}
+
+    def feed(self, line: str) -> List[str]:
+        """
+        Processes a line of rawjson output and returns the human-readable lines it represents
+        """
+        try:
+            status = json.loads(line)
+        except ValueError:
+            # Pass through anything that is not a progress update (e.g. errors printed by the Docker CLI itself)
+            return [line]
+
+        output = []
+
+        # Update our records for each build step (known to BuildKit as a vertex)
+        for vertex in status.get("vertexes") or []:
+            digest = vertex["digest"]
+            step = self.steps.get(digest, None)
+            if step is None:
+                step = BuildStep(vertex.get("name", digest))
+                self.steps[digest] = step
+                self._order.append(digest)
+
+            if step.started is None and vertex.get("started") is not None:
+                step.started = _parseTimestamp(vertex["started"])
+                output.append("#{} {}".format(self._number(digest), step.name))
+
+            if step.completed is None and vertex.get("completed") is not None:
+                step.completed = _parseTimestamp(vertex["completed"])
+                step.cached = vertex.get("cached", False)
+                step.error = vertex.get("error", None)
+                if step.error is not None:
+                    output.append(
+                        "#{} ERROR: {}".format(self._number(digest), step.error)
+                    )
+                elif step.cached:
+                    output.append("#{} CACHED".format(self._number(digest)))
+                else:
+                    output.append(
+                        "#{} DONE {:.1f}s".format(
+                            self._number(digest), step.duration() or 0.0
+                        )
+                    )
+
+        # Record the time taken by each filesystem layer commit, which BuildKit reports as a status of the export step
+        for update in status.get("statuses") or []:
+            if not update.get("id", "").startswith("exporting layers"):
+                continue
+            key = "{}/{}".format(update.get("vertex"), update["id"])
+            record = self._statuses.setdefault(key, BuildStep(update["id"]))
+            if record.started is None and update.get("started") is not None:
+                record.started = _parseTimestamp(update["started"])
+            if record.completed is None and update.get("completed") is not None:
+                record.completed = _parseTimestamp(update["completed"])
+                if record.duration() is not None:
+                    self.layerCommits.append(record.duration())
+
+        # Decode the log output for each step
+        for log in status.get("logs") or []:
+            data = base64.b64decode(log.get("data") or "").decode("utf-8", "replace")
+            number = self._number(log.get("vertex"))
+            for logLine in data.replace("\r\n", "\n").rstrip("\n").split("\n"):
+                output.append("#{} {}".format(number, logLine))
+
+        return output
+
+    def orderedSteps(self) -> List[BuildStep]:
+        """
+        Returns the build steps in the order in which BuildKit first reported them
+        """
+        return [self.steps[digest] for digest in self._order]
+
+    def _number(self, digest: Optional[str]) -> int:
+        return self._order.index(digest) + 1 if digest in self.steps else 0
+
+
+class InstrumentedStep(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+        self.completed = None
+        self.exitCode = None
+        self.bytes = None
+
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.completed is None:
+            return None
+        return self.completed - self.started
+
+
+class StepInstrumentationParser(object):
+    """
+    Parses the `##ue4-docker-step` lines emitted by instrumented RUN directives, recording the timings of each step
+    """
+
+    def __init__(self, names: Dict[str, str]):
+        """
+        Creates a parser for the instrumented steps with the specified names, keyed by step ID
+        """
+        self.steps = {step: InstrumentedStep(name) for step, name in names.items()}
+
+    def feed(self, line: str) -> List[str]:
+        """
+        Processes a line of build output, which is always passed through unmodified
+        """
+        match = STEP_MARKER.search(line)
+        if match is not None and match[1] in self.steps:
+            step = self.steps[match[1]]
+            step.started = float(match[2])
+            step.completed = float(match[3])
+            step.exitCode = int(match[4])
+            step.bytes = int(match[5]) if match[5] is not None else None
+        return [line]
+
+    def executedSteps(self) -> List[InstrumentedStep]:
+        """
+        Returns the steps that were executed (rather than being cached), in the order in which they appear in the Dockerfile
+        """
+        return [step for step in self.steps.values() if step.completed is not None]
+
+    def summary(self, nameWidth: int = 60) -> List[str]:
+        """
+        Generates a human-readable summary of the executed steps, from slowest to fastest
+        """
+        lines = []
+        for step in sorted(
+            self.executedSteps(), key=lambda step: step.duration(), reverse=True
+        ):
+            name = (
+                step.name
+                if len(step.name) <= nameWidth
+                else step.name[: nameWidth - 3] + "..."
+            )
+            lines.append(
+                "{:>10.1f}s  {}{}{}".format(
+                    step.duration(),
+                    name,
+                    (
+                        "  [{} bytes written]".format(step.bytes)
+                        if step.bytes is not None
+                        else ""
+                    ),
+                    (
+                        "  [exit code {}]".format(step.exitCode)
+                        if step.exitCode != 0
+                        else ""
+                    ),
+                )
+            )
+        return lines
+
+
+class BuildTimingReport(object):
+    """
+    Accumulates the step timings and layer sizes for every image built during a run
+    """
+
+    def __init__(self):
+        self.images = []
+        self._lock = threading.Lock()
+
+    def addImage(
+        self,
+        image: str,
+        started: float,
+        completed: float,
+        parser: Optional[RawJsonProgressParser],
+        history: List[dict],
+        instrumentation: Optional[StepInstrumentationParser] = None,
+    ) -> None:
+        """
+        Records the timings for a built image, along with the layer history reported by the Docker daemon
+        """
+        record = {
+            "image": image,
+            "started": started,
+            "completed": completed,
+            "seconds": completed - started,
+            "layer_commit_seconds": (
+                sum(parser.layerCommits) if parser is not None else None
+            ),
+            "steps": [
+                {
+                    "name": step.name,
+                    "started": step.started,
+                    "completed": step.completed,
+                    "seconds": step.duration(),
+                    "cached": step.cached,
+                }
+                for step in (parser.orderedSteps() if parser is not None else [])
+            ],
+            "instrumented_steps": [
+                {
+                    "name": step.name,
+                    "started": step.started,
+                    "completed": step.completed,
+                    "seconds": step.duration(),
+                    "exit_code": step.exitCode,
+                    "bytes": step.bytes,
+                }
+                for step in (
+                    instrumentation.executedSteps()
+                    if instrumentation is not None
+                    else []
+                )
+            ],
+            "layers": [
+                {
+                    "created_by": layer.get("CreatedBy", ""),
+                    "size": layer.get("Size", 0),
+                }
+                for layer in history
+            ],
+        }
+
+        with self._lock:
+            self.images.append(record)
+
+    def write(self, path: str) -> None:
+        """
+        Writes the report to the specified file, in CSV format if the filename ends in `.csv` and in JSON format otherwise
+        """
+        with self._lock:
+            images = list(self.images)
+
+        if not path.lower().endswith(".csv"):
+            with open(path, "w") as f:
+                json.dump({"images": images}, f, indent=4)
+            return
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["image", "kind", "name", "cached", "seconds", "size"])
+            for image in images:
+                writer.writerow([image["image"], "image", "", "", image["seconds"], ""])
+                for step in image["steps"]:
+                    writer.writerow(
+                        [
+                            image["image"],
+                            "step",
+                            step["name"],
+                            step["cached"],
+                            step["seconds"],
+                            "",
+                        ]
+                    )
+                for step in image["instrumented_steps"]:
+                    writer.writerow(
+                        [
+                            image["image"],
+                            "instrumented-step",
+                            step["name"],
+                            "",
+                            step["seconds"],
+                            step["bytes"] if step["bytes"] is not None else "",
+                        ]
+                    )
+                if image["layer_commit_seconds"] is not None:
+                    writer.writerow(
+                        [
+                            image["image"],
+                            "layer-commit",
+                            "",
+                            "",
+                            image["layer_commit_seconds"],
+                            "",
+                        ]
+                    )
+                for layer in image["layers"]:
+                    writer.writerow(
+                        [
+                            image["image"],
+                            "layer",
+                            layer["created_by"],
+                            "",
+                            "",
+                            layer["size"],
+                        ]
+                    )
@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional
+import os
+from .DockerUtils import DockerUtils
+
+# The mount point of the unified cgroup v2 hierarchy
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# How deep below the cgroup root we search for the cgroups of BuildKit build steps
+# (The daemon places them under `docker/buildkit/<id>` or `system.slice/buildkit-<id>.scope` depending on its cgroup driver)
+CGROUP_SEARCH_DEPTH = 3
+
+# The name of the cgroup under which the daemon nests the cgroups of BuildKit build steps when using the cgroupfs driver
+BUILDKIT_PARENT_CGROUP = "buildkit"
+
+
+class CgroupUtils(object):
+    @staticmethod
+    def available() -> bool:
+        """
+        Determines whether the host uses the unified cgroup v2 hierarchy
+        """
+        return os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers"))
+
+    @staticmethod
+    def findBuildCgroups() -> List[str]:
+        """
+        Returns the paths of the cgroups for any running build steps, along with those of any BuildKit daemon containers
+        """
+        found = [
+            path
+            for path in CgroupUtils._walkBuildkit()
+            if os.path.basename(path) != BUILDKIT_PARENT_CGROUP
+        ]
+
+        # When building with a `docker-container` buildx driver, every step runs inside the BuildKit daemon's container
+        for container in DockerUtils.client().api.containers(
+            filters={"name": "buildx_buildkit_"}
+        ):
+            path = CgroupUtils._containerCgroup(container["Id"])
+            if path is not None:
+                found.append(path)
+
+        # Only report leaf cgroups, since the statistics of parent cgroups include those of their children
+        return [
+            path
+            for path in found
+            if not any(other.startswith(path + os.sep) for other in found)
+        ]
+
+    @staticmethod
+    def findParentCgroups() -> List[str]:
+        """
+        Returns the paths of the cgroups under which the daemon nests the cgroups of build steps, whose statistics
+        include the usage of any build steps that have already finished
+        """
+        return [
+            path
+            for path in CgroupUtils._walkBuildkit()
+            if os.path.basename(path) == BUILDKIT_PARENT_CGROUP
+        ]
+
+    @staticmethod
+    def readStats(path: str) -> Optional[Dict[str, int]]:
+        """
+        Reads the CPU, memory and I/O statistics for the specified cgroup, or returns None if it no longer exists
+        """
+        try:
+            memoryCurrent = int(CgroupUtils._read(path, "memory.current"))
+
+            # `memory.peak` is only available under Linux 5.19 and newer
+            try:
+                memoryPeak = int(CgroupUtils._read(path, "memory.peak"))
+            except FileNotFoundError:
+                memoryPeak = memoryCurrent
+
+            cpu = CgroupUtils._parseKeyed(CgroupUtils._read(path, "cpu.stat"))
+
+            # `io.stat` contains a line of keyed values for each block device, and is absent if the io controller is disabled
+            try:
+                ioStat = CgroupUtils._read(path, "io.stat")
+            except FileNotFoundError:
+                ioStat = ""
+            readBytes = 0
+            writtenBytes = 0
+            for line in ioStat.splitlines():
+                values = CgroupUtils._parseKeyed(" ".join(line.split()[1:]))
+                readBytes += values.get("rbytes", 0)
+                writtenBytes += values.get("wbytes", 0)
+
+            return {
+                "cpu_usec": cpu.get("usage_usec", 0),
+                "memory_current": memoryCurrent,
+                "memory_peak": memoryPeak,
+                "io_read_bytes": readBytes,
+                "io_write_bytes": writtenBytes,
+            }
+
+        except (FileNotFoundError, ProcessLookupError, ValueError):
+            # The cgroup was removed while we were reading it
+            return None
+
+    @staticmethod
+    def _walkBuildkit() -> List[str]:
+        # BuildKit runs each build step in its own cgroup, whose name (or that of its parent) identifies it as belonging to BuildKit
+        found = []
+        for dirpath, dirnames, _ in os.walk(CGROUP_ROOT):
+            # The children of a cgroup at depth N lie at depth N + 1, so stop descending once they reach the maximum depth
+            relative = os.path.relpath(dirpath, CGROUP_ROOT)
+            depth = 0 if relative == os.curdir else relative.count(os.sep) + 1
+            children = list(dirnames)
+            if depth + 1 >= CGROUP_SEARCH_DEPTH:
+                dirnames.clear()
+            for dirname in children:
+                path = os.path.join(dirpath, dirname)
+                if "buildkit" in path[len(CGROUP_ROOT) :] and os.path.exists(
+                    os.path.join(path, "memory.current")
+                ):
+                    found.append(path)
+        return found
+
+    @staticmethod
+    def _containerCgroup(containerId: str) -> Optional[str]:
+        # The location of a container's cgroup depends on whether the daemon uses the systemd or cgroupfs driver
+        for candidate in [
+            os.path.join(
+                CGROUP_ROOT, "system.slice", "docker-{}.scope".format(containerId)
+            ),
+            os.path.join(CGROUP_ROOT, "docker", containerId),
+        ]:
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    @staticmethod
+    def _parseKeyed(contents: str) -> Dict[str, int]:
+        # Parses either "key value" lines (as in `cpu.stat`) or space-separated "key=value" pairs (as in `io.stat`)
+        tokens = contents.replace("=", " ").split()
+        return {tokens[i]: int(tokens[i + 1]) for i in range(0, len(tokens) - 1, 2)}
+
+    @staticmethod
+    def _read(path: str, filename: str) -> str:
+        with open(os.path.join(path, filename), "r") as f:
+            return f.read()
@@ -1,15 +1,20 @@
-import multiprocessing, secrets, time, urllib.parse
+import secrets, threading, time, urllib.error, urllib.parse, urllib.request
 from .NetworkUtils import NetworkUtils
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 from functools import partial
+from typing import Dict, Optional, Tuple
+
+# The well-known port for the credential endpoint, which `ue4-docker setup` opens in the host firewall
+DEFAULT_CREDENTIAL_PORT = 9876
+
+# The maximum time (in seconds) that we wait for the endpoint to start serving requests
+CREDENTIAL_ENDPOINT_START_TIMEOUT = 10
 
 
 class CredentialRequestHandler(BaseHTTPRequestHandler):
-    def __init__(self, username: str, password: str, token: str, *args, **kwargs):
-        self.username = username
-        self.password = password
-        self.token = token
+    def __init__(self, endpoint: "CredentialEndpoint", *args, **kwargs):
+        self.endpoint = endpoint
         super().__init__(*args, **kwargs)
 
     def log_request(self, code: str = "-", size: str = "-") -> None:
@@ -19,79 +24,139 @@ class CredentialRequestHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         query_components = parse_qs(urlparse(self.path).query)
 
+        content_length = int(self.headers.get("Content-Length", 0))
+        prompt = self.rfile.read(content_length).decode("utf-8")
+
         self.send_response(200)
         self.end_headers()
 
-        if "token" in query_components and query_components["token"][0] == self.token:
-            content_length = int(self.headers["Content-Length"])
-            prompt = self.rfile.read(content_length).decode("utf-8")
-
-            response = self.password if "Password for" in prompt else self.username
+        # Route the request to the credentials registered for the supplied token
+        token = query_components.get("token", [None])[0]
+        credentials = self.endpoint.lookup(token)
+        if credentials is not None:
+            username, password = credentials
+            response = password if "Password for" in prompt else username
             self.wfile.write(response.encode("utf-8"))
 
 
 class CredentialEndpoint(object):
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, port: int = 0):
         """
-        Creates an endpoint manager for the supplied credentials
+        Creates an endpoint manager for the supplied credentials, which listens on the specified port
+        (The default port of zero binds an ephemeral port chosen by the operating system)
         """
 
         # Make sure neither our username or password are blank, since that can cause `git clone` to hang indefinitely
         self.username = username if username is not None and len(username) > 0 else " "
         self.password = password if password is not None and len(password) > 0 else " "
-        self.endpoint = None
+        self.port = port
+        self.server = None
+        self.thread = None
+
+        # The credentials for each registered security token, which allows concurrent builds to share a single endpoint
+        self._tokens: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+        # Generate a default security token to require when requesting credentials
+        self.token = self.register()
+
+    def register(
+        self, username: Optional[str] = None, password: Optional[str] = None
+    ) -> str:
+        """
+        Generates a new security token that will be required when requesting the specified credentials
+        (or the credentials supplied to the constructor if none are specified)
+        """
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._tokens[token] = (
+                username if username else self.username,
+                password if password else self.password,
+            )
+        return token
+
+    def unregister(self, token: str) -> None:
+        """
+        Revokes a security token that was previously generated by `register()`
+        """
+        with self._lock:
+            self._tokens.pop(token, None)
 
-        # Generate a security token to require when requesting credentials
-        self.token = secrets.token_hex(16)
+    def lookup(self, token: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Returns the credentials for the specified security token, or None if the token is not valid
+        """
+        with self._lock:
+            return self._tokens.get(token, None)
 
-    def args(self) -> [str]:
+    def args(self, token: Optional[str] = None) -> [str]:
         """
-        Returns the Docker build arguments for creating containers that require Git credentials
+        Returns the Docker build arguments for creating containers that require Git credentials,
+        using the specified security token (or the default token if none is specified)
         """
 
         # Resolve the IP address for the host system
         hostAddress = NetworkUtils.hostIP()
 
-        # Provide the host address and security token to the container
+        # Provide the host address, port and security token to the container
         return [
             "--build-arg",
             "HOST_ADDRESS_ARG=" + urllib.parse.quote_plus(hostAddress),
             "--build-arg",
-            "HOST_TOKEN_ARG=" + urllib.parse.quote_plus(self.token),
+            "HOST_PORT_ARG={}".format(self.port),
+            "--build-arg",
+            "HOST_TOKEN_ARG="
+            + urllib.parse.quote_plus(token if token is not None else self.token),
         ]
 
     def start(self) -> None:
         """
-        Starts the HTTP endpoint as a child process
+        Starts the HTTP endpoint in a background thread and waits until it is serving requests
         """
 
-        # Create a child process to run the credential endpoint
-        self.endpoint = multiprocessing.Process(
-            target=CredentialEndpoint._endpoint,
-            args=(self.username, self.password, self.token),
+        # Bind the listening socket, which resolves the port number if we were asked to use an ephemeral port
+        handler = partial(CredentialRequestHandler, self)
+        self.server = ThreadingHTTPServer(
+            ("0.0.0.0", self.port), RequestHandlerClass=handler
         )
-
-        # Spawn the child process and give the endpoint time to start
-        self.endpoint.start()
-        time.sleep(2)
-
-        # Verify that the endpoint started correctly
-        if not self.endpoint.is_alive():
-            raise RuntimeError("failed to start the credential endpoint")
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+        # Serve requests in a background thread
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        # Verify that the endpoint started correctly by sending it a request (without a valid token) and checking the response
+        if not self._healthCheck():
+            self.stop()
+            raise RuntimeError(
+                "failed to start the credential endpoint on port {}".format(self.port)
+            )
+
+    def _healthCheck(self) -> bool:
+        # Waits until the endpoint responds to requests, returning False if it fails to do so before the timeout elapses
+        # (We bypass any HTTP proxy configured in the environment, since the request must reach the endpoint directly)
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        deadline = time.time() + CREDENTIAL_ENDPOINT_START_TIMEOUT
+        while time.time() < deadline and self.thread.is_alive():
+            try:
+                with opener.open(
+                    "http://127.0.0.1:{}/".format(self.port), data=b"", timeout=1
+                ) as response:
+                    if response.status == 200:
+                        return True
+            except (urllib.error.URLError, OSError):
+                pass
+            time.sleep(0.1)
+
+        return False
 
     def stop(self) -> None:
         """
-        Stops the HTTP endpoint child process
-        """
-        self.endpoint.terminate()
-        self.endpoint.join()
-
-    @staticmethod
-    def _endpoint(username: str, password: str, token: str) -> None:
+        Stops the HTTP endpoint
         """
-        Implements a HTTP endpoint to provide Git credentials to Docker containers
-        """
-        handler = partial(CredentialRequestHandler, username, password, token)
-
-        server = HTTPServer(("0.0.0.0", 9876), RequestHandlerClass=handler)
-        server.serve_forever()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
@@ -1,11 +1,42 @@
-import docker, fnmatch, humanfriendly, itertools, json, logging, os, platform, re, sys
+import docker, fnmatch, humanfriendly, itertools, json, logging, os, platform, re, sys, threading
 from docker.models.containers import Container
 from packaging.version import Version
+from typing import Optional
 
+from .DockerfileTokenizer import DockerfileTokenizer
 from .FilesystemUtils import FilesystemUtils
+from .NetworkUtils import NetworkUtils
+
+# The maximum number of connections to the Docker daemon that our shared client keeps in its pool
+# (This needs to be large enough to accommodate concurrent image builds and our resource monitor)
+CLIENT_MAX_POOL_SIZE = 32
 
 
 class DockerUtils(object):
+    # The shared Docker client and the lock that guards its creation
+    _client = None
+    _clientLock = threading.Lock()
+
+    # The cached system information for the Docker daemon
+    _info = None
+
+    # The cached inventory of local images and the lock that guards it
+    _images = None
+    _imageRefs = None
+    _imagesLock = threading.Lock()
+
+    @staticmethod
+    def client() -> docker.DockerClient:
+        """
+        Returns the shared Docker client, creating it the first time it is requested
+        """
+        with DockerUtils._clientLock:
+            if DockerUtils._client is None:
+                DockerUtils._client = docker.from_env(
+                    max_pool_size=CLIENT_MAX_POOL_SIZE
+                )
+            return DockerUtils._client
+
     @staticmethod
     def installed():
         """
@@ -22,16 +53,46 @@ class DockerUtils(object):
         """
         Retrieves the version information for the Docker daemon
         """
-        client = docker.from_env()
-        return client.version()
+        return DockerUtils.client().version()
 
     @staticmethod
-    def info():
+    def info(cached: bool = False):
         """
         Retrieves the system information as produced by `docker info`
+        (Specify `cached=True` to reuse the information from a previous call when only static fields are required)
+        """
+        if cached == False or DockerUtils._info is None:
+            DockerUtils._info = DockerUtils.client().info()
+        return DockerUtils._info
+
+    @staticmethod
+    def containerHostAddresses():
+        """
+        Returns the address on which services for our build containers should listen and the address that the containers
+        should use to reach them, so that those services are not exposed to the wider network
+
+        This is the gateway of the default `bridge` network for Linux containers or the `nat` network for Windows containers,
+        which is an address of the host itself. When the Docker daemon runs inside a VM (e.g. Docker Desktop) the gateway
+        belongs to the VM, so we listen on the loopback interface, which containers reach via `host.docker.internal`.
         """
-        client = docker.from_env()
-        return client.info()
+        network = (
+            "nat" if DockerUtils.info(cached=True)["OSType"] == "windows" else "bridge"
+        )
+        try:
+            configs = DockerUtils.client().networks.get(network).attrs["IPAM"]["Config"]
+        except docker.errors.DockerException:
+            configs = []
+
+        for config in configs or []:
+            gateway = config.get("Gateway", "")
+            if (
+                gateway != ""
+                and ":" not in gateway
+                and NetworkUtils.isLocalAddress(gateway)
+            ):
+                return gateway, gateway
+
+        return "127.0.0.1", "host.docker.internal"
 
     @staticmethod
     def minimumVersionForIPV6():
@@ -69,17 +130,75 @@ class DockerUtils(object):
     @staticmethod
     def exists(name):
         """
-        Determines if the specified image exists
+        Determines if the specified image exists, using our cached inventory of local images
         """
-        client = docker.from_env()
-        try:
-            image = client.images.get(name)
-            return True
-        except:
-            return False
+        return DockerUtils.imageSummary(name) is not None
+
+    @staticmethod
+    def imageSummary(name):
+        """
+        Returns the summary details (as reported by `docker image ls`) for the specified image, or None if it does not exist
+        """
+        images, refs = DockerUtils._imageInventory()
+
+        # Image IDs (and unambiguous prefixes thereof) are matched against the IDs in the inventory
+        if re.fullmatch("(sha256:)?[0-9a-f]{6,64}", name) is not None:
+            prefix = name if name.startswith("sha256:") else "sha256:" + name
+            for image in images:
+                if image["Id"].startswith(prefix):
+                    return image
+
+        return refs.get(DockerUtils._normaliseReference(name), None)
+
+    @staticmethod
+    def invalidateImageCache():
+        """
+        Discards our cached inventory of local images, which must be done whenever images are built, pulled or removed
+        """
+        with DockerUtils._imagesLock:
+            DockerUtils._images = None
+            DockerUtils._imageRefs = None
+
+    @staticmethod
+    def _imageInventory():
+        """
+        Returns our cached inventory of local images, populating it with a single request if necessary
+        """
+        with DockerUtils._imagesLock:
+            if DockerUtils._images is None:
+                # Note that we use the low-level API here, since the high-level API inspects each image individually
+                images = DockerUtils.client().api.images()
+                refs = {}
+                for image in images:
+                    for ref in (image.get("RepoTags") or []) + (
+                        image.get("RepoDigests") or []
+                    ):
+                        refs[DockerUtils._normaliseReference(ref)] = image
+                DockerUtils._images = images
+                DockerUtils._imageRefs = refs
+
+            return DockerUtils._images, DockerUtils._imageRefs
+
+    @staticmethod
+    def _normaliseReference(ref: str) -> str:
+        """
+        Normalises an image reference so that equivalent references compare equal (e.g. `ubuntu` and `docker.io/library/ubuntu:latest`)
+        """
+        for prefix in ["docker.io/library/", "docker.io/", "library/"]:
+            if ref.startswith(prefix):
+                ref = ref[len(prefix) :]
+                break
+
+        # Append the implicit `latest` tag to references that specify neither a tag nor a digest
+        if "@" not in ref and ":" not in ref.rsplit("/", 1)[-1]:
+            ref = ref + ":latest"
+
+        return ref
 
     @staticmethod
-    def build(tags: [str], context: str, args: [str]) -> [str]:
+    def build(
+        tags: [str], context: str, args: [str], progress: Optional[str] = None
+    ) -> [str]:
         """
         Returns the `docker build` command to build an image
         """
@@ -88,11 +207,14 @@ class DockerUtils(object):
             ["docker", "build"]
             + list(itertools.chain.from_iterable(tagArgs))
             + [context]
+            + (["--progress={}".format(progress)] if progress is not None else [])
             + args
         )
 
     @staticmethod
-    def buildx(tags: [str], context: str, args: [str], secrets: [str]) -> [str]:
+    def buildx(
+        tags: [str], context: str, args: [str], secrets: [str], progress: str = "plain"
+    ) -> [str]:
         """
         Returns the `docker buildx` command to build an image with the BuildKit backend
         """
@@ -101,11 +223,18 @@ class DockerUtils(object):
             ["docker", "build"]
             + list(itertools.chain.from_iterable(tagArgs))
             + [context]
-            + ["--progress=plain"]
+            + ["--progress={}".format(progress)]
             + args
             + list(itertools.chain.from_iterable([["--secret", s] for s in secrets]))
         )
 
+    @staticmethod
+    def history(image: str) -> [dict]:
+        """
+        Retrieves the layer history for the specified image, as produced by `docker history`
+        """
+        return DockerUtils.client().api.history(image)
+
     @staticmethod
     def pull(image):
         """
@@ -118,16 +247,16 @@ class DockerUtils(object):
         """
         Starts a container in a detached state and returns the container handle
         """
-        client = docker.from_env()
-        return client.containers.run(image, command, detach=True, **kwargs)
+        return DockerUtils.client().containers.run(
+            image, command, detach=True, **kwargs
+        )
 
     @staticmethod
     def create(image: str, **kwargs) -> Container:
         """
         Creates a stopped container for specified image name and returns the container handle
         """
-        client = docker.from_env()
-        return client.containers.create(image, **kwargs)
+        return DockerUtils.client().containers.create(image, **kwargs)
 
     @staticmethod
     def configFilePath():
@@ -186,8 +315,7 @@ class DockerUtils(object):
         """
 
         # Retrieve the list of images matching the specified filters
-        client = docker.from_env()
-        images = client.images.list(filters=filters, all=all)
+        images = DockerUtils.client().images.list(filters=filters, all=all)
 
         # Apply our tag filter if one was specified
         if tagFilter is not None:
@@ -236,26 +364,59 @@ class DockerUtils(object):
             [" && {}{}{}".format(prefix, line, suffix) for line in messageLines]
         )
 
-        # Read the Dockerfile contents and convert all line endings to \n
+        # Read the Dockerfile contents, convert all line endings to \n and split it into instructions
         contents = FilesystemUtils.readFile(dockerfile)
-        contents = contents.replace("\r\n", "\n")
+        tokenizer = DockerfileTokenizer(contents.replace("\r\n", "\n"))
 
-        # Determine the escape character for the Dockerfile
-        escapeMatch = re.search("#[\\s]*escape[\\s]*=[\\s]*([^\n])\n", contents)
-        escape = escapeMatch[1] if escapeMatch is not None else "\\"
+        # Append the `echo` commands to each RUN directive
+        # (Exec form directives and those that run heredoc scripts are not executed as a shell command line that we can extend)
+        for instruction in tokenizer.instructions("RUN"):
+            if not instruction.isExecForm() and not instruction.hasHeredocs():
+                instruction.append(echoCommands)
 
-        # Identify each RUN directive in the Dockerfile
-        runMatches = re.finditer(
-            "^RUN(.+?[^{}])\n".format(re.escape(escape)),
-            contents,
-            re.DOTALL | re.MULTILINE,
-        )
-        if runMatches is not None:
-            for match in runMatches:
-                # Append the `echo` commands to the directive
-                contents = contents.replace(
-                    match[0], "RUN{}{}\n".format(match[1], echoCommands)
+        # Write the modified contents back to the Dockerfile
+        FilesystemUtils.writeFile(dockerfile, tokenizer.render())
+
+    @staticmethod
+    def instrumentRunDirectives(dockerfile, measureSizes=False):
+        """
+        Wraps each RUN directive in the specified (Linux) Dockerfile with commands that emit a structured
+        `##ue4-docker-step` line reporting its start time, end time, exit status and (optionally) the number
+        of bytes of files that it created or modified, and returns the name of each instrumented step keyed by its ID
+        """
+
+        # Read the Dockerfile contents, convert all line endings to \n and split it into instructions
+        contents = FilesystemUtils.readFile(dockerfile)
+        tokenizer = DockerfileTokenizer(contents.replace("\r\n", "\n"))
+
+        # Measuring the files that a step changed requires a marker file with which to compare timestamps
+        # (The marker is removed before the step completes, so it never ends up in the filesystem layer)
+        prologue = "__ue4docker_start=$(date +%s.%N) && "
+        epilogue = ""
+        if measureSizes:
+            prologue += "__ue4docker_marker=$(mktemp) && "
+            epilogue = (
+                "__ue4docker_bytes=$(find / -xdev -cnewer \"$__ue4docker_marker\" -type f -printf '%s\\n' 2>/dev/null"
+                " | awk '{ total += $1 } END { print total + 0 }'); "
+                'rm -f "$__ue4docker_marker"; '
+            )
+
+        # Wrap each RUN directive in a subshell so that we can capture its exit status, and then propagate that status
+        # (Exec form directives and those that run heredoc scripts are not executed as a shell command line that we can wrap)
+        steps = {}
+        for instruction in tokenizer.instructions("RUN"):
+            if instruction.isExecForm() or instruction.hasHeredocs():
+                continue
+
+            step = str(len(steps) + 1)
+            steps[step] = " ".join(instruction.command().split())
+            instruction.prepend(prologue + "( ")
+            instruction.append(
+                ' ); __ue4docker_status=$?; {}echo "##ue4-docker-step {} $__ue4docker_start $(date +%s.%N) $__ue4docker_status{}"; ( exit $__ue4docker_status )'.format(
+                    epilogue, step, " $__ue4docker_bytes" if measureSizes else ""
                 )
+            )
 
         # Write the modified contents back to the Dockerfile
-        FilesystemUtils.writeFile(dockerfile, contents)
+        FilesystemUtils.writeFile(dockerfile, tokenizer.render())
+        return steps
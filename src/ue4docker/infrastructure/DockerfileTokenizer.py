@@ -0,0 +1,201 @@
+import json, re
+from typing import Iterator, List, Optional, Union
+
+# The escape character used by Dockerfiles that do not specify an escape parser directive
+DEFAULT_ESCAPE = "\\"
+
+# Matches a parser directive (e.g. `# escape=``), which may only appear at the very top of a Dockerfile
+PARSER_DIRECTIVE = re.compile("^#\\s*([A-Za-z][A-Za-z0-9_-]*)\\s*=\\s*(.*?)\\s*$")
+
+# Matches the keyword at the start of an instruction
+INSTRUCTION_KEYWORD = re.compile("^\\s*([A-Za-z]+)(\\s|$)")
+
+# Matches a heredoc marker (e.g. `<<EOF`, `<<-EOF` or `<<"EOF"`), ignoring bash here-strings (`<<<`) and arithmetic shifts
+HEREDOC_MARKER = re.compile("(?<!<)<<(?!<)(-?)([\"']?)([A-Za-z_][A-Za-z0-9_]*)\\2")
+
+# Matches the option flags (e.g. `--mount=type=cache,target=/root/.cache`) that can precede the arguments of an instruction
+INSTRUCTION_FLAGS = re.compile("^(\\s*--\\S+)*\\s*")
+
+# Matches the keyword and any option flags at the start of the first line of an instruction
+INSTRUCTION_PREFIX = re.compile("^\\s*[A-Za-z]+(\\s+--\\S+)*\\s*")
+
+# The instructions that support heredocs
+HEREDOC_INSTRUCTIONS = ["ADD", "COPY", "RUN"]
+
+
+class DockerfileInstruction(object):
+    """
+    A single Dockerfile instruction, which retains the raw text of every physical line that it spans
+    """
+
+    def __init__(self, keyword: str, lines: List[str], escape: str):
+        self.keyword = keyword
+        self.lines = lines
+        self.escape = escape
+
+        # The heredoc terminators and the lines of each heredoc body, which follow the instruction lines
+        self.heredocs: List[str] = []
+        self.body: List[str] = []
+
+    def arguments(self) -> str:
+        """
+        Returns the arguments of the instruction as a single logical line, with line continuations and embedded comments removed
+        """
+        logical = "".join(
+            _stripContinuation(line, self.escape)
+            for line in self.lines
+            if not _isCommentOrBlank(line)
+        )
+        return INSTRUCTION_KEYWORD.sub("", logical, count=1).strip()
+
+    def command(self) -> str:
+        """
+        Returns the arguments of the instruction without any leading option flags
+        """
+        return INSTRUCTION_FLAGS.sub("", self.arguments(), count=1)
+
+    def isExecForm(self) -> bool:
+        """
+        Determines whether the instruction uses the exec form (a JSON array) rather than the shell form
+        """
+        arguments = self.command()
+        if not arguments.startswith("["):
+            return False
+        try:
+            return isinstance(json.loads(arguments), list)
+        except ValueError:
+            return False
+
+    def hasHeredocs(self) -> bool:
+        """
+        Determines whether the instruction is followed by one or more heredocs
+        """
+        return len(self.heredocs) > 0
+
+    def prepend(self, text: str) -> None:
+        """
+        Inserts the supplied text at the start of the instruction's arguments (after its keyword and any option flags)
+        """
+        # Option flags may continue onto subsequent lines, so we skip over every line that contains only flags
+        # (along with any comments and blank lines within the continuation) until we reach the first argument
+        for index, line in enumerate(self.lines):
+            if index > 0 and _isCommentOrBlank(line):
+                continue
+            content = _stripContinuation(line, self.escape)
+            pattern = INSTRUCTION_PREFIX if index == 0 else INSTRUCTION_FLAGS
+            prefix = pattern.match(content)[0]
+            if len(content[len(prefix) :].strip()) > 0 or index == len(self.lines) - 1:
+                self.lines[index] = line[: len(prefix)] + text + line[len(prefix) :]
+                return
+
+    def append(self, text: str) -> None:
+        """
+        Appends the supplied text to the end of the instruction's final line (before any heredoc bodies)
+        """
+        for index in range(len(self.lines) - 1, -1, -1):
+            if not _isCommentOrBlank(self.lines[index]) or index == 0:
+                self.lines[index] = self.lines[index] + text
+                return
+
+    def text(self) -> str:
+        """
+        Returns the raw text of the instruction, including any heredoc bodies
+        """
+        return "\n".join(self.lines + self.body)
+
+
+class DockerfileTokenizer(object):
+    """
+    Splits a Dockerfile into instructions and the comments, blank lines and parser directives between them,
+    so that transforms can modify individual instructions and then render the Dockerfile in a single pass
+    """
+
+    def __init__(self, contents: str):
+        """
+        Tokenizes the supplied Dockerfile contents (which must use \\n line endings)
+        """
+        self.tokens: List[Union[str, DockerfileInstruction]] = []
+        self.escape = DEFAULT_ESCAPE
+
+        lines = contents.split("\n")
+        index = 0
+
+        # Parser directives are only recognised until the first line that is not a parser directive
+        while index < len(lines):
+            match = PARSER_DIRECTIVE.match(lines[index])
+            if match is None:
+                break
+            if match[1].lower() == "escape" and len(match[2]) > 0:
+                self.escape = match[2][0]
+            self.tokens.append(lines[index])
+            index += 1
+
+        while index < len(lines):
+            line = lines[index]
+            index += 1
+
+            # Comments and blank lines between instructions are preserved verbatim
+            keyword = INSTRUCTION_KEYWORD.match(line)
+            if _isCommentOrBlank(line) or keyword is None:
+                self.tokens.append(line)
+                continue
+
+            # Consume the physical lines that make up the instruction, skipping over any comments
+            # and blank lines that appear within a line continuation (just as Docker itself does)
+            instruction = DockerfileInstruction(keyword[1].upper(), [line], self.escape)
+            while _isContinued(line, self.escape) and index < len(lines):
+                line = lines[index]
+                index += 1
+                instruction.lines.append(line)
+                if _isCommentOrBlank(line):
+                    line = self.escape
+
+            # Consume the body of each heredoc, which runs until the line consisting of its terminator
+            if instruction.keyword in HEREDOC_INSTRUCTIONS and any(
+                "<<" in line for line in instruction.lines
+            ):
+                for match in HEREDOC_MARKER.finditer(instruction.arguments()):
+                    stripTabs, terminator = match[1] == "-", match[3]
+                    instruction.heredocs.append(terminator)
+                    while index < len(lines):
+                        line = lines[index]
+                        index += 1
+                        instruction.body.append(line)
+                        if (line.lstrip("\t") if stripTabs else line) == terminator:
+                            break
+
+            self.tokens.append(instruction)
+
+    def instructions(
+        self, keyword: Optional[str] = None
+    ) -> Iterator[DockerfileInstruction]:
+        """
+        Iterates over the instructions in the Dockerfile, optionally filtering by keyword
+        """
+        for token in self.tokens:
+            if isinstance(token, DockerfileInstruction) and (
+                keyword is None or token.keyword == keyword.upper()
+            ):
+                yield token
+
+    def render(self) -> str:
+        """
+        Renders the (potentially modified) tokens back into Dockerfile contents
+        """
+        return "\n".join(
+            token if isinstance(token, str) else token.text() for token in self.tokens
+        )
+
+
+def _isCommentOrBlank(line: str) -> bool:
+    stripped = line.strip()
+    return len(stripped) == 0 or stripped.startswith("#")
+
+
+def _isContinued(line: str, escape: str) -> bool:
+    return line.rstrip(" \t").endswith(escape)
+
+
+def _stripContinuation(line: str, escape: str) -> str:
+    stripped = line.rstrip(" \t")
+    return stripped[: -len(escape)] if stripped.endswith(escape) else line
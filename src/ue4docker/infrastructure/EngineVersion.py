@@ -0,0 +1,162 @@
+from docker.models.containers import Container
+from typing import Dict, List, Optional, Tuple
+import json, posixpath, tarfile
+
+from .ArchiveExtractor import ChunkStream
+from .DockerUtils import DockerUtils
+
+# The location of the Engine in the ue4-source, ue4-minimal and ue4-full images for each container platform
+ENGINE_ROOTS = {"linux": "/home/ue4/UnrealEngine", "windows": "C:/UnrealEngine"}
+
+# The file that identifies the version of the Engine, relative to the root of the Engine
+VERSION_FILE = "Engine/Build/Build.version"
+
+# The labels that record the version of the Engine contained in an image
+ENGINE_MAJOR_LABEL = "com.adamrehn.ue4-docker.engine.major"
+ENGINE_MINOR_LABEL = "com.adamrehn.ue4-docker.engine.minor"
+ENGINE_PATCH_LABEL = "com.adamrehn.ue4-docker.engine.patch"
+ENGINE_CHANGELIST_LABEL = "com.adamrehn.ue4-docker.engine.changelist"
+
+# The prefix of the labels that identify which components were excluded from the Installed Build in an image
+EXCLUDED_LABEL_PREFIX = "com.adamrehn.ue4-docker.excluded."
+
+
+class EngineVersion(object):
+    """
+    The version of the Unreal Engine contained in a container image
+    """
+
+    def __init__(
+        self,
+        major: int,
+        minor: int,
+        patch: int,
+        changelist: Optional[int] = None,
+        excluded: Optional[List[str]] = None,
+    ):
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.changelist = changelist
+        self.excluded = excluded if excluded is not None else []
+
+    def __str__(self) -> str:
+        return "{}.{}.{}".format(self.major, self.minor, self.patch) + (
+            " (CL {})".format(self.changelist) if self.changelist is not None else ""
+        )
+
+    def labels(self) -> Dict[str, str]:
+        """
+        Returns the image labels that record this version of the Engine
+        """
+        labels = {
+            ENGINE_MAJOR_LABEL: str(self.major),
+            ENGINE_MINOR_LABEL: str(self.minor),
+            ENGINE_PATCH_LABEL: str(self.patch),
+        }
+        if self.changelist is not None:
+            labels[ENGINE_CHANGELIST_LABEL] = str(self.changelist)
+        return labels
+
+    def labelArgs(self) -> List[str]:
+        """
+        Returns the `docker build` arguments that apply the image labels for this version of the Engine
+        """
+        args = []
+        for label, value in self.labels().items():
+            args.extend(["--label", "{}={}".format(label, value)])
+        return args
+
+    def supportsInstalledBuildExport(self) -> bool:
+        """
+        Determines whether Installed Builds of this version of the Engine can be exported (which requires 4.21.0 or newer)
+        """
+        return (self.major, self.minor) >= (4, 21)
+
+    @staticmethod
+    def fromRelease(release: str, changelist: Optional[int]) -> "EngineVersion":
+        """
+        Creates the version for an official release of the Engine, specified in semver format (e.g. 4.27.0)
+        """
+        major, minor, patch = [int(component) for component in release.split(".")]
+        return EngineVersion(major, minor, patch, changelist)
+
+    @staticmethod
+    def fromBuildVersion(contents: bytes) -> "EngineVersion":
+        """
+        Parses the contents of the Engine's Build.version file
+        """
+        details = json.loads(contents)
+        changelist = details.get("Changelist", 0)
+        return EngineVersion(
+            details["MajorVersion"],
+            details["MinorVersion"],
+            details["PatchVersion"],
+            changelist if changelist != 0 else None,
+        )
+
+    @staticmethod
+    def fromLabels(labels: Optional[Dict[str, str]]) -> Optional["EngineVersion"]:
+        """
+        Parses the version of the Engine from the labels of an image, or returns None if the labels do not include it
+        """
+        labels = labels if labels is not None else {}
+        try:
+            changelist = labels.get(ENGINE_CHANGELIST_LABEL, None)
+            return EngineVersion(
+                int(labels[ENGINE_MAJOR_LABEL]),
+                int(labels[ENGINE_MINOR_LABEL]),
+                int(labels[ENGINE_PATCH_LABEL]),
+                int(changelist) if changelist is not None else None,
+                sorted(
+                    [
+                        label[len(EXCLUDED_LABEL_PREFIX) :]
+                        for label, value in labels.items()
+                        if label.startswith(EXCLUDED_LABEL_PREFIX) and value == "1"
+                    ]
+                ),
+            )
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def fromImage(image: str) -> Optional["EngineVersion"]:
+        """
+        Retrieves the version of the Engine from the labels of a local image, using our cached inventory of local images
+        """
+        summary = DockerUtils.imageSummary(image)
+        return (
+            EngineVersion.fromLabels(summary.get("Labels", None))
+            if summary is not None
+            else None
+        )
+
+    @staticmethod
+    def labelledImages() -> List[Tuple[str, "EngineVersion"]]:
+        """
+        Returns the tag and Engine version of each local image whose labels record the version of the Engine it contains
+        """
+        # Note that we use the low-level API here, since the high-level API inspects each image individually
+        images = DockerUtils.client().api.images(filters={"label": ENGINE_MAJOR_LABEL})
+        labelled = []
+        for image in images:
+            version = EngineVersion.fromLabels(image.get("Labels", None))
+            if version is not None:
+                for tag in image.get("RepoTags") or []:
+                    labelled.append((tag, version))
+        return sorted(labelled, key=lambda pair: pair[0])
+
+    @staticmethod
+    def fromContainer(container: Container, platform: str) -> "EngineVersion":
+        """
+        Reads the version of the Engine from the Build.version file in a container, which does not need to be running
+        """
+        path = posixpath.join(ENGINE_ROOTS[platform], VERSION_FILE)
+        stream, _ = container.get_archive(path)
+        with tarfile.open(fileobj=ChunkStream.open(stream), mode="r|") as archive:
+            for member in archive:
+                if member.isfile():
+                    return EngineVersion.fromBuildVersion(
+                        archive.extractfile(member).read()
+                    )
+        raise RuntimeError('"{}" is not a file'.format(path))
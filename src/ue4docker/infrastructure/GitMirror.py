@@ -0,0 +1,172 @@
+import hashlib, os, stat, subprocess, tempfile, threading
+from .DockerUtils import DockerUtils
+from .NetworkUtils import NetworkUtils
+
+# The port on which `git daemon` serves our mirrors
+# (This is fixed so the build argument that points the ue4-source image at the mirror does not invalidate the Docker build cache between runs)
+GIT_MIRROR_PORT = 9878
+
+# The helper script that supplies the Git credentials to `git fetch` when updating a mirror
+ASKPASS_SCRIPT = """#!/bin/sh
+case "$1" in
+	Username*) printf '%s\\n' "$UE4DOCKER_GIT_USERNAME" ;;
+	*) printf '%s\\n' "$UE4DOCKER_GIT_PASSWORD" ;;
+esac
+"""
+
+
+class GitMirror(object):
+    def __init__(self, mirrorsDir: str, port: int = GIT_MIRROR_PORT):
+        """
+        Creates a manager for the bare git mirrors stored in the specified host directory
+        """
+        self.mirrorsDir = mirrorsDir
+        self.port = port
+        self.daemon = None
+        self.address = None
+
+        # The file that receives the output of `git daemon`, which we report if it fails
+        self._log = None
+
+        # Fetches into the same mirror must not run concurrently, since git locks the shallow file and refs
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Starts `git daemon` to serve our mirrors to the ue4-source image builds, listening only on the address
+        that the build containers use to reach the host (since the daemon does not perform any authentication)
+        """
+        os.makedirs(self.mirrorsDir, exist_ok=True)
+        listen, self.address = DockerUtils.containerHostAddresses()
+        self._log = tempfile.TemporaryFile()
+        try:
+            self.daemon = subprocess.Popen(
+                [
+                    "git",
+                    "daemon",
+                    "--reuseaddr",
+                    "--export-all",
+                    "--listen={}".format(listen),
+                    "--port={}".format(self.port),
+                    "--base-path={}".format(self.mirrorsDir),
+                    self.mirrorsDir,
+                ],
+                stdout=self._log,
+                stderr=subprocess.STDOUT,
+            )
+        except OSError as e:
+            raise RuntimeError("failed to start git daemon: {}".format(e)) from None
+
+        # Fail fast if the daemon exits (e.g. because `git daemon` is not installed or the port is in use)
+        if not NetworkUtils.waitForPort(
+            listen, self.port, lambda: self.daemon.poll() is None
+        ):
+            self.stop()
+            raise RuntimeError(
+                "git daemon failed to listen on {}:{}. Output:\n{}".format(
+                    listen, self.port, self.output()
+                )
+            )
+
+    def output(self) -> str:
+        """
+        Returns the output that `git daemon` has produced so far
+        """
+        if self._log is None:
+            return ""
+        self._log.seek(0)
+        return self._log.read().decode("utf-8", errors="replace").strip()
+
+    def stop(self) -> None:
+        """
+        Stops `git daemon`
+        """
+        if self.daemon is not None:
+            if self.daemon.poll() is None:
+                self.daemon.terminate()
+            self.daemon.wait()
+            self.daemon = None
+
+    def update(
+        self, repository: str, branch: str, username: str, password: str
+    ) -> [str]:
+        """
+        Fetches the specified branch (or tag) of the specified repository into its mirror, creating the mirror if
+        necessary, and returns the Docker build arguments for cloning it from the mirror in the ue4-source image
+        """
+        # Report the output of the daemon if it has exited since we started it, rather than letting the clone fail later
+        if self.daemon is not None and self.daemon.poll() is not None:
+            raise RuntimeError(
+                "git daemon exited unexpectedly with code {}. Output:\n{}".format(
+                    self.daemon.returncode, self.output()
+                )
+            )
+
+        name = GitMirror.mirrorName(repository)
+        mirror = os.path.join(self.mirrorsDir, name)
+        ref = "refs/heads/{}".format(branch)
+
+        with self._lock:
+            if not os.path.exists(mirror):
+                self._git(["init", "--bare", mirror])
+                self._git(["-C", mirror, "remote", "add", "origin", repository])
+
+            # Only the objects that are not already present in the mirror are transferred, so subsequent fetches of
+            # the same branch (or of releases that share most of their files) only download the differences
+            with tempfile.TemporaryDirectory() as tempDir:
+                askpass = os.path.join(tempDir, "askpass.sh")
+                with open(askpass, "w") as f:
+                    f.write(ASKPASS_SCRIPT)
+                os.chmod(askpass, stat.S_IRWXU)
+
+                env = os.environ.copy()
+                env.update(
+                    {
+                        "GIT_ASKPASS": askpass,
+                        "GIT_TERMINAL_PROMPT": "0",
+                        "UE4DOCKER_GIT_USERNAME": username or "",
+                        "UE4DOCKER_GIT_PASSWORD": password or "",
+                    }
+                )
+                self._git(
+                    [
+                        "-C",
+                        mirror,
+                        "fetch",
+                        "--progress",
+                        "--no-tags",
+                        "--depth",
+                        "1",
+                        "origin",
+                        "+{}:{}".format(branch, ref),
+                    ],
+                    env,
+                )
+
+            commit = self._git(["-C", mirror, "rev-parse", ref], capture=True)
+
+        return [
+            "--build-arg",
+            "GIT_MIRROR=git://{}:{}/{}".format(self.address, self.port, name),
+            "--build-arg",
+            "GIT_COMMIT={}".format(commit),
+        ]
+
+    @staticmethod
+    def mirrorName(repository: str) -> str:
+        """
+        Returns the directory name of the mirror for the specified repository
+        """
+        return "{}.git".format(
+            hashlib.sha256(repository.encode("utf-8")).hexdigest()[:16]
+        )
+
+    def _git(self, args: [str], env=None, capture: bool = False) -> str:
+        result = subprocess.run(
+            ["git"] + args,
+            env=env,
+            stdout=subprocess.PIPE if capture else None,
+            check=True,
+            universal_newlines=True,
+        )
+        return result.stdout.strip() if capture else ""
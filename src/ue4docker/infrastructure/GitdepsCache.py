@@ -0,0 +1,224 @@
+import hashlib, os, posixpath, shutil, tempfile, threading, time, urllib.error, urllib.parse, urllib.request
+from .DockerUtils import DockerUtils
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+# The port on which the gitdeps caching proxy listens
+# (This is fixed so the build argument that points Setup.sh at the proxy does not invalidate the Docker build cache between runs)
+GITDEPS_PROXY_PORT = 9877
+
+# The URLs from which the proxy will download dependency data, which must match the `BaseUrl` attribute of the manifests
+# in `Engine/Build/*.gitdeps.xml` (any other URL is rejected, so the proxy cannot be used to reach arbitrary hosts)
+GITDEPS_UPSTREAM_URLS = ["http://cdn.unrealengine.com/dependencies/"]
+
+# The size of the chunks in which we stream dependency data to the client and the cache
+GITDEPS_CHUNK_SIZE = 1024 * 1024
+
+
+class GitdepsProxyRequestHandler(BaseHTTPRequestHandler):
+    def __init__(self, cacheDir: str, upstreams: List[str], *args, **kwargs):
+        self.cacheDir = cacheDir
+        self.upstreams = upstreams
+        super().__init__(*args, **kwargs)
+
+    def log_request(self, code: str = "-", size: str = "-") -> None:
+        # We do not want to log each and every incoming request
+        pass
+
+    def do_GET(self):
+        # GitDependencies sends the absolute URL of each pack file when it is configured to use a proxy
+        url = self.path
+        if not url.startswith("http://"):
+            self.send_error(400, "only absolute http:// URLs can be proxied")
+            return
+        if not GitdepsCache.isAllowed(url, self.upstreams):
+            self.send_error(403, "only gitdeps dependency data can be proxied")
+            return
+
+        # Pack files are content-addressed, so a cached copy can be served indefinitely
+        cached = GitdepsCache.cachePath(self.cacheDir, url)
+        if os.path.exists(cached):
+            try:
+                # Mark the cached file as recently used, which drives our LRU eviction
+                os.utime(cached)
+                with open(cached, "rb") as f:
+                    self._sendFile(f, os.fstat(f.fileno()).st_size)
+                return
+            except FileNotFoundError:
+                # The file was evicted while we were serving it, so fall through and download it again
+                pass
+
+        # Download the file from upstream, streaming it to both the client and a temporary file in the cache directory
+        try:
+            upstream = urllib.request.urlopen(url)
+        except urllib.error.HTTPError as e:
+            self.send_error(e.code, str(e.reason))
+            return
+        except urllib.error.URLError as e:
+            self.send_error(502, str(e.reason))
+            return
+
+        with upstream:
+            length = upstream.headers.get("Content-Length", None)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            if length is not None:
+                self.send_header("Content-Length", length)
+            self.end_headers()
+
+            handle, temp = tempfile.mkstemp(dir=self.cacheDir, suffix=".partial")
+            try:
+                with os.fdopen(handle, "wb") as f:
+                    while True:
+                        chunk = upstream.read(GITDEPS_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        self.wfile.write(chunk)
+
+                # Only add the file to the cache once it has been downloaded completely
+                os.replace(temp, cached)
+            finally:
+                if os.path.exists(temp):
+                    os.unlink(temp)
+
+    def _sendFile(self, f, size: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        shutil.copyfileobj(f, self.wfile, GITDEPS_CHUNK_SIZE)
+
+
+class GitdepsCache(object):
+    def __init__(
+        self,
+        cacheDir: str,
+        port: int = GITDEPS_PROXY_PORT,
+        upstreams: List[str] = GITDEPS_UPSTREAM_URLS,
+    ):
+        """
+        Creates a caching HTTP proxy for the dependency data downloaded by the Unreal Engine's Setup script,
+        which stores the downloaded pack files in the specified directory on the host and only forwards
+        requests for URLs under the specified upstream base URLs
+        """
+        self.cacheDir = cacheDir
+        self.port = port
+        self.upstreams = upstreams
+        self.address = None
+        self.server = None
+        self.thread = None
+
+    def args(self) -> [str]:
+        """
+        Returns the Docker build arguments for directing Setup.sh / Setup.bat to use the proxy
+        """
+        return [
+            "--build-arg",
+            "GITDEPS_PROXY=http://{}:{}".format(self.address, self.port),
+        ]
+
+    def start(self) -> None:
+        """
+        Starts the proxy in a background thread, listening only on the address that the build containers use to reach the host
+        """
+        os.makedirs(self.cacheDir, exist_ok=True)
+        listen, self.address = DockerUtils.containerHostAddresses()
+        handler = partial(GitdepsProxyRequestHandler, self.cacheDir, self.upstreams)
+        self.server = ThreadingHTTPServer(
+            (listen, self.port), RequestHandlerClass=handler
+        )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the proxy
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    @staticmethod
+    def isAllowed(url: str, upstreams: List[str]) -> bool:
+        """
+        Determines whether the specified URL refers to a file under one of the specified upstream base URLs
+        """
+        try:
+            parsed = urllib.parse.urlsplit(url)
+        except ValueError:
+            return False
+
+        # Reject anything that could escape the base path once normalised, such as `..` segments or encoded separators
+        path = urllib.parse.unquote(parsed.path)
+        if (
+            parsed.query != ""
+            or parsed.fragment != ""
+            or parsed.username is not None
+            or ".." in path.split("/")
+            or "\\" in path
+            or posixpath.normpath(path) != path
+        ):
+            return False
+
+        for upstream in upstreams:
+            base = urllib.parse.urlsplit(upstream)
+            prefix = base.path if base.path.endswith("/") else base.path + "/"
+            if (
+                parsed.scheme == base.scheme
+                and parsed.netloc.lower() == base.netloc.lower()
+                and path.startswith(prefix)
+            ):
+                return True
+
+        return False
+
+    @staticmethod
+    def cachePath(cacheDir: str, url: str) -> str:
+        """
+        Returns the path of the cached copy of the file with the specified URL
+        """
+        return os.path.join(cacheDir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def entries(cacheDir: str) -> List[Tuple[str, int, float]]:
+        """
+        Returns the path, size and last use time of each file in the cache, from least to most recently used
+        """
+        if not os.path.isdir(cacheDir):
+            return []
+
+        entries = []
+        with os.scandir(cacheDir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".partial"):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    @staticmethod
+    def evict(
+        cacheDir: str, limit: int, dryRun: bool = False
+    ) -> List[Tuple[str, int, float]]:
+        """
+        Removes the least recently used files from the cache until its total size is no more than the specified limit,
+        returning the entries for the removed files
+        """
+        entries = GitdepsCache.entries(cacheDir)
+        total = sum(size for _, size, _ in entries)
+
+        removed = []
+        for path, size, used in entries:
+            if total <= limit:
+                break
+            if dryRun == False:
+                os.unlink(path)
+            removed.append((path, size, used))
+            total -= size
+
+        return removed
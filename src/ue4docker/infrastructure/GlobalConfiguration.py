@@ -7,6 +7,15 @@ import json
 # The default namespace for our tagged container images
 DEFAULT_TAG_NAMESPACE = "adamrehn"
 
+# The default location of the host directory that caches the dependency data downloaded by the Unreal Engine's Setup script
+DEFAULT_GITDEPS_CACHE_DIR = os.path.join("~", ".ue4-docker", "gitdeps")
+
+# The default location of the host directory that holds our bare mirrors of Unreal Engine git repositories
+DEFAULT_GIT_MIRROR_DIR = os.path.join("~", ".ue4-docker", "mirrors")
+
+# The location of the file that caches the hashes of build context files, keyed by their path, size and modification time
+FILE_HASH_CACHE = os.path.join("~", ".ue4-docker", "file-hashes.json")
+
 
 class GlobalConfiguration(object):
     """
@@ -30,6 +39,31 @@ class GlobalConfiguration(object):
         """
         return os.environ.get("UE4DOCKER_TAG_NAMESPACE", DEFAULT_TAG_NAMESPACE)
 
+    @staticmethod
+    def getGitdepsCacheDir():
+        """
+        Returns the currently-configured host directory for caching the dependency data downloaded by the Setup script
+        """
+        return os.path.expanduser(
+            os.environ.get("UE4DOCKER_GITDEPS_CACHE", DEFAULT_GITDEPS_CACHE_DIR)
+        )
+
+    @staticmethod
+    def getGitMirrorDir():
+        """
+        Returns the currently-configured host directory for our bare mirrors of Unreal Engine git repositories
+        """
+        return os.path.expanduser(
+            os.environ.get("UE4DOCKER_GIT_MIRRORS", DEFAULT_GIT_MIRROR_DIR)
+        )
+
+    @staticmethod
+    def getFileHashCache():
+        """
+        Returns the path of the file that caches the hashes of build context files between runs
+        """
+        return os.path.expanduser(FILE_HASH_CACHE)
+
     @staticmethod
     def resolveTag(tag):
         """
@@ -0,0 +1,386 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import gzip, hashlib, io, json, os, posixpath, tarfile
+
+from .ArchiveExtractor import ARCHIVE_CHUNK_SIZE, ArchiveExtractor
+from .DockerUtils import DockerUtils
+
+# The prefix of whiteout files, which delete the corresponding path in lower layers
+WHITEOUT_PREFIX = ".wh."
+
+# The name of the opaque whiteout file, which hides the contents of its directory in lower layers
+OPAQUE_WHITEOUT = ".wh..wh..opq"
+
+# The magic numbers that identify compressed layer blobs
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class _BoundedReader(io.RawIOBase):
+    """
+    Reads a byte range of a file through its own file handle, so that multiple ranges can be read concurrently
+    """
+
+    def __init__(self, path: str, offset: int, size: int):
+        self._file = open(path, "rb")
+        self._file.seek(offset)
+        self._offset = offset
+        self._remaining = size
+        self._size = size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), self._remaining)
+        if count == 0:
+            return 0
+        data = self._file.read(count)
+        buffer[: len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        current = self._size - self._remaining
+        target = {
+            io.SEEK_SET: position,
+            io.SEEK_CUR: current + position,
+            io.SEEK_END: self._size + position,
+        }[whence]
+        target = min(max(target, 0), self._size)
+        self._file.seek(self._offset + target)
+        self._remaining = self._size - target
+        return target
+
+    def tell(self) -> int:
+        return self._size - self._remaining
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class LayerPlan(object):
+    """
+    The members of a single image layer that are written to the destination, as determined by `ImageArchive.plan()`
+    """
+
+    def __init__(self, blob: str):
+        self.blob = blob
+        self.routes: Dict[str, List[str]] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.size = 0
+
+
+class ImageArchive(object):
+    """
+    Reads the layers of a container image from an archive produced by `docker save` or from an OCI image layout
+    (either a directory or a tar archive of one), without requiring a Docker daemon
+    """
+
+    def __init__(self, path: str, reference: Optional[str] = None):
+        """
+        Opens the specified archive or OCI image layout directory, selecting the image with the specified reference
+        (The reference may be omitted if the archive only contains a single image)
+        """
+        self.path = os.path.abspath(path)
+        self._members: Dict[str, tarfile.TarInfo] = {}
+        if not os.path.isdir(self.path):
+            with tarfile.open(self.path, "r:") as archive:
+                for member in archive:
+                    self._members[posixpath.normpath(member.name)] = member
+
+        # The ID of an image is the digest of its configuration
+        configName, self.layers = self._resolveImage(reference)
+        with self.open(configName) as f:
+            data = f.read()
+        self.id = "sha256:" + hashlib.sha256(data).hexdigest()
+        self.config = json.loads(data.decode("utf-8"))
+
+    def operatingSystem(self) -> str:
+        """
+        Returns the operating system of the image (e.g. "linux" or "windows")
+        """
+        return self.config.get("os", "linux")
+
+    def open(self, name: str) -> io.RawIOBase:
+        """
+        Opens the file with the specified path (relative to the root of the archive or image layout) for reading
+        """
+        if os.path.isdir(self.path):
+            return open(os.path.join(self.path, name), "rb", buffering=0)
+
+        # Legacy `docker save` archives represent duplicate layers as symlinks to other layers
+        member = self._members.get(posixpath.normpath(name), None)
+        for _ in range(8):
+            if member is None or not member.issym():
+                break
+            target = posixpath.normpath(
+                posixpath.join(posixpath.dirname(member.name), member.linkname)
+            )
+            member = self._members.get(target, None)
+
+        if member is None or not member.isfile():
+            raise RuntimeError(
+                'the image archive does not contain the file "{}"'.format(name)
+            )
+        return _BoundedReader(self.path, member.offset_data, member.size)
+
+    def openLayer(self, blob: str):
+        """
+        Opens the specified layer blob for reading, decompressing it if necessary
+        """
+        raw = io.BufferedReader(self.open(blob), buffer_size=ARCHIVE_CHUNK_SIZE)
+        magic = raw.peek(4)[:4]
+        if magic.startswith(GZIP_MAGIC):
+            return gzip.GzipFile(fileobj=raw, mode="rb")
+        if magic.startswith(ZSTD_MAGIC):
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError(
+                    "the image contains zstd-compressed layers, which require the `zstandard` Python package"
+                )
+            return zstandard.ZstdDecompressor().stream_reader(raw)
+        return raw
+
+    def plan(
+        self, root: str, jobs: int, read: Optional[List[str]] = None
+    ) -> List[LayerPlan]:
+        """
+        Determines which layer provides the final version of each file under the specified root directory,
+        scanning the layers concurrently, and returns the members that need to be extracted from each layer
+
+        The contents of the final version of each of the (small) files listed in `read` are captured during the scan,
+        and can be retrieved with `ImageArchive.contents()`
+        """
+        root = root.strip("/")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            listings = list(
+                executor.map(
+                    lambda blob: self._listLayer(blob, root, set(read or [])),
+                    self.layers,
+                )
+            )
+
+        # Process the layers from the top down, so that the first layer to provide a path is the one that owns it
+        owned: Set[str] = set()
+        hidden: Set[str] = set()
+        opaque: Set[str] = set()
+        plans = []
+        for blob, (entries, whiteouts, opaques, contents) in reversed(
+            list(zip(self.layers, listings))
+        ):
+            plan = LayerPlan(blob)
+            links = {}
+            sizes = {path: size for path, _, size, _ in entries}
+            for path, kind, size, linkname in entries:
+                if path in owned or self._isHidden(path, hidden, opaque):
+                    continue
+                owned.add(path)
+                if path in contents:
+                    plan.contents[path] = contents[path]
+                if kind == "link":
+                    links[path] = linkname
+                else:
+                    plan.routes.setdefault(path, []).insert(0, path)
+                    plan.size += size
+
+            # A hard link refers to a member of the same layer, which may be owned by a higher layer,
+            # in which case we write that member's data to the hard link's path instead
+            for path, target in links.items():
+                if target in plan.routes and plan.routes[target][0] == target:
+                    plan.routes[path] = [path]
+                else:
+                    plan.routes.setdefault(target, []).append(path)
+                    plan.size += sizes.get(target, 0)
+
+            # Non-directory entries in this layer also hide any lower entries beneath the same path
+            for path, kind, _, _ in entries:
+                if kind != "dir":
+                    hidden.add(path)
+            hidden.update(whiteouts)
+            opaque.update(opaques)
+            plans.append(plan)
+
+        plans.reverse()
+        return plans
+
+    @staticmethod
+    def contents(plans: List[LayerPlan], path: str) -> Optional[bytes]:
+        """
+        Returns the captured contents of the final version of a file that was listed in the `read` argument of
+        `ImageArchive.plan()`, or None if the file does not exist
+        """
+        for plan in plans:
+            if path in plan.contents:
+                return plan.contents[path]
+        return None
+
+    def extract(
+        self,
+        plans: List[LayerPlan],
+        root: str,
+        extractor: ArchiveExtractor,
+        jobs: int,
+        onComplete: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        Extracts the planned members of each layer concurrently, since each path is owned by exactly one layer
+
+        If an `onComplete` function is specified then it receives the blob of each layer once it has been extracted
+        """
+
+        def extractLayer(plan: LayerPlan) -> None:
+            with self.openLayer(plan.blob) as layer:
+                extractor.extract(
+                    layer,
+                    root,
+                    route=lambda relative: plan.routes.get(relative, []),
+                )
+            if onComplete is not None:
+                onComplete(plan.blob)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(extractLayer, plan)
+                for plan in plans
+                if len(plan.routes) > 0
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except:
+                # Do not start extracting any more layers if one of them fails
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _listLayer(self, blob: str, root: str, read: Set[str]):
+        # Lists the entries of a layer beneath the specified root, along with its whiteouts and the contents of any files in `read`
+        entries: List[Tuple[str, str, int, Optional[str]]] = []
+        whiteouts: Set[str] = set()
+        opaques: Set[str] = set()
+        contents: Dict[str, bytes] = {}
+        # (Uncompressed layers are seekable, which allows tarfile to skip over file data rather than reading it)
+        with self.openLayer(blob) as layer:
+            mode = "r:" if isinstance(layer, io.BufferedReader) else "r|"
+            with tarfile.open(fileobj=layer, mode=mode) as archive:
+                for member in archive:
+                    relative = _relativeTo(member.name, root)
+                    if relative is None:
+                        continue
+
+                    parent, name = posixpath.split(relative)
+                    if name == OPAQUE_WHITEOUT:
+                        opaques.add(parent)
+                    elif name.startswith(WHITEOUT_PREFIX):
+                        whiteouts.add(
+                            posixpath.join(parent, name[len(WHITEOUT_PREFIX) :])
+                        )
+                    elif member.isdir():
+                        entries.append((relative, "dir", 0, None))
+                    elif member.islnk():
+                        entries.append(
+                            (relative, "link", 0, _relativeTo(member.linkname, root))
+                        )
+                    elif member.isfile() or member.issym():
+                        entries.append((relative, "file", member.size, None))
+                        if member.isfile() and relative in read:
+                            contents[relative] = archive.extractfile(member).read()
+
+        return entries, whiteouts, opaques, contents
+
+    @staticmethod
+    def _isHidden(path: str, hidden: Set[str], opaque: Set[str]) -> bool:
+        # Determines whether a path is hidden by a whiteout or a non-directory entry in a higher layer,
+        # or resides within a directory that a higher layer marked as opaque
+        if path in hidden:
+            return True
+        parent = posixpath.dirname(path)
+        while True:
+            if parent in hidden or parent in opaque:
+                return True
+            if parent == "":
+                return False
+            parent = posixpath.dirname(parent)
+
+    def _readJson(self, name: str):
+        with self.open(name) as f:
+            return json.loads(f.read().decode("utf-8"))
+
+    def _exists(self, name: str) -> bool:
+        if os.path.isdir(self.path):
+            return os.path.exists(os.path.join(self.path, name))
+        return posixpath.normpath(name) in self._members
+
+    def _resolveImage(self, reference: Optional[str]):
+        # Archives produced by `docker save` include a manifest that lists the layers of each image in order
+        if self._exists("manifest.json"):
+            images = self._readJson("manifest.json")
+            image = self._selectImage(
+                images, lambda image: image.get("RepoTags") or [], reference
+            )
+            return image["Config"], image["Layers"]
+
+        # Otherwise we have an OCI image layout, whose index references the manifest of each image
+        index = self._readJson("index.json")
+        descriptor = self._selectImage(
+            index.get("manifests", []),
+            lambda descriptor: [
+                (descriptor.get("annotations") or {}).get(key, "")
+                for key in [
+                    "io.containerd.image.name",
+                    "org.opencontainers.image.ref.name",
+                ]
+            ],
+            reference,
+        )
+        manifest = self._readJson(_blobPath(descriptor["digest"]))
+
+        # Multi-platform images reference a manifest for each platform, of which we select the first
+        if "manifests" in manifest:
+            manifest = self._readJson(_blobPath(manifest["manifests"][0]["digest"]))
+
+        return (
+            _blobPath(manifest["config"]["digest"]),
+            [_blobPath(layer["digest"]) for layer in manifest["layers"]],
+        )
+
+    def _selectImage(self, images: list, references, reference: Optional[str]):
+        # Selects the image whose references include the specified reference (which may be just a tag)
+        if reference is not None:
+            tag = reference.rsplit(":", 1)[-1] if ":" in reference else None
+            for image in images:
+                for candidate in references(image):
+                    if candidate in [reference, tag] or (
+                        candidate != ""
+                        and DockerUtils._normaliseReference(candidate)
+                        == DockerUtils._normaliseReference(reference)
+                    ):
+                        return image
+
+        if len(images) == 1:
+            return images[0]
+
+        raise RuntimeError(
+            'the image archive does not contain the image "{}"'.format(reference)
+        )
+
+
+def _blobPath(digest: str) -> str:
+    algorithm, _, value = digest.partition(":")
+    return posixpath.join("blobs", algorithm, value)
+
+
+def _relativeTo(name: str, root: str) -> Optional[str]:
+    # Determines the path of a layer member relative to the specified root directory, or None if it lies outside it
+    name = posixpath.normpath(name.lstrip("/"))
+    if name == root:
+        return ""
+    if name.startswith(root + "/"):
+        return name[len(root) + 1 :]
+    return None
@@ -1,23 +1,71 @@
-from typing import Dict, Optional
-
+from typing import Dict, List, Optional
+
+from .BuildCache import BuildCache
+from .BuildTimings import (
+    BuildTimingReport,
+    RawJsonProgressParser,
+    StepInstrumentationParser,
+)
 from .DockerUtils import DockerUtils
 from .FilesystemUtils import FilesystemUtils
 from .GlobalConfiguration import GlobalConfiguration
-import glob, humanfriendly, os, shutil, subprocess, tempfile, time
+from .OutputSinks import ConsoleSink, OutputSink, TransformSink
+from .SubprocessUtils import SubprocessUtils
+import glob, hashlib, humanfriendly, json, os, re, shutil, tempfile, threading, time
 from os.path import basename, exists, join
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
+
+# Matches runs of blank lines introduced during Jinja rendering, which we compress into a single blank line
+EXCESS_NEWLINES = re.compile("\n{3,}")
+
+# The image label used to record the hash of the inputs from which an image was built
+INPUTS_HASH_LABEL = "com.adamrehn.ue4-docker.inputs-hash"
+
+# Build arguments whose values change between runs without affecting the built image, and which are therefore excluded from input hashes
+VOLATILE_BUILD_ARGS = [
+    "HOST_ADDRESS_ARG",
+    "HOST_PORT_ARG",
+    "HOST_TOKEN_ARG",
+    "GITDEPS_PROXY",
+    "GIT_MIRROR",
+]
+
+# The size of the chunks in which we read build context files when hashing them
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 class ImageBuildParams(object):
     def __init__(
-        self, dockerfile: str, context_dir: str, env: Optional[Dict[str, str]] = None
+        self,
+        dockerfile: str,
+        context_dir: str,
+        env: Optional[Dict[str, str]] = None,
+        inputs_hash: Optional[str] = None,
+        rawjson: bool = False,
+        steps: Optional[Dict[str, str]] = None,
     ):
         self.dockerfile = dockerfile
         self.context_dir = context_dir
         self.env = env
+        self.inputs_hash = inputs_hash
+        self.rawjson = rawjson
+        self.steps = steps
 
 
 class ImageBuilder(object):
+    # The Jinja environment shared by every ImageBuilder, which caches compiled templates both in memory and on disk
+    _environment = None
+
+    # Rendered Dockerfiles, keyed by template path and a hash of the template context
+    _rendered: Dict[tuple, str] = {}
+    _renderLock = threading.Lock()
+
+    # The size, modification time and SHA-256 hash of each build context file we have hashed, keyed by absolute path
+    # (This is loaded from disk on first use, so files whose metadata is unchanged since the last run are never read)
+    _fileHashes: Optional[Dict[str, list]] = None
+    _fileHashesChanged = False
+    _fileHashLock = threading.Lock()
+
     def __init__(
         self,
         tempDir: str,
@@ -28,6 +76,12 @@ class ImageBuilder(object):
         layoutDir: str = None,
         templateContext: Dict[str, str] = None,
         combine: bool = False,
+        skipUnchanged: bool = False,
+        timingReport: Optional[BuildTimingReport] = None,
+        sinks: Optional[List[OutputSink]] = None,
+        cache: Optional[BuildCache] = None,
+        instrument: bool = False,
+        instrumentSizes: bool = False,
     ):
         """
         Creates an ImageBuilder for the specified build parameters
@@ -40,6 +94,12 @@ class ImageBuilder(object):
         self.layoutDir = layoutDir
         self.templateContext = templateContext if templateContext is not None else {}
         self.combine = combine
+        self.skipUnchanged = skipUnchanged
+        self.timingReport = timingReport
+        self.sinks = sinks if sinks is not None else [ConsoleSink()]
+        self.cache = cache
+        self.instrument = instrument
+        self.instrumentSizes = instrumentSizes
 
     def get_built_image_context(self, name):
         """
@@ -86,24 +146,21 @@ class ImageBuilder(object):
         workdir = join(self.tempDir, basename(name), self.platform)
         os.makedirs(workdir, exist_ok=True)
 
-        # Create a Jinja template environment and render the Dockerfile template
-        environment = Environment(
-            autoescape=False, trim_blocks=True, lstrip_blocks=True
-        )
+        # Render the Dockerfile template and save the rendered contents to disk
         dockerfile = join(workdir, "Dockerfile")
-
-        templateInstance = environment.from_string(
-            FilesystemUtils.readFile(dockerfile_template)
+        rendered = ImageBuilder.renderTemplate(
+            dockerfile_template, self.templateContext
         )
-        rendered = templateInstance.render(self.templateContext)
-
-        # Compress excess whitespace introduced during Jinja rendering and save the contents back to disk
-        # (Ensure that we still have a single trailing newline at the end of the Dockerfile)
-        while "\n\n\n" in rendered:
-            rendered = rendered.replace("\n\n\n", "\n\n")
-        rendered = rendered.strip("\n") + "\n"
         FilesystemUtils.writeFile(dockerfile, rendered)
 
+        # If step instrumentation was requested then wrap each RUN directive to report its timings
+        # (This must happen before we inject our commit message, which is then only echoed if the wrapped step succeeded)
+        steps = None
+        if self.instrument and self.platform == "linux" and self.layoutDir is None:
+            steps = DockerUtils.instrumentRunDirectives(
+                dockerfile, self.instrumentSizes
+            )
+
         # Inject our filesystem layer commit message after each RUN directive in the Dockerfile
         DockerUtils.injectPostRunMessage(
             dockerfile,
@@ -120,11 +177,29 @@ class ImageBuilder(object):
         # When building Linux images, explicitly specify the target CPU architecture
         archFlags = ["--platform", "linux/amd64"] if self.platform == "linux" else []
 
+        # Compute the hash of the inputs for the image and stamp it as a label, unless labels have been disabled
+        # (There is no point computing the hash when we're just copying the Dockerfile to an output directory)
+        inputsHash = None
+        labelFlags = []
+        if self.layoutDir is None and not self.templateContext.get(
+            "disable_labels", False
+        ):
+            inputsHash = self._computeInputsHash(dockerfile, context_dir, args)
+            labelFlags = ["--label", "{}={}".format(INPUTS_HASH_LABEL, inputsHash)]
+
+        # If we are recording step timings then request machine-readable progress output from BuildKit
+        # (Windows containers are built with the legacy builder, so we can only record their total build time)
+        rawjson = self.timingReport is not None and self.platform == "linux"
+
         # Create a temporary directory to hold any files needed for the build
         with tempfile.TemporaryDirectory() as tempDir:
             # Determine whether we are building using `docker buildx` with build secrets
             imageTags = self._formatTags(name, tags)
 
+            # If a build cache was specified then import and export the cache for this image
+            # (These flags are deliberately excluded from the input hash, since they do not affect the built image)
+            cacheFlags = self.cache.args(imageTags[0]) if self.cache is not None else []
+
             if self.platform == "linux" and secrets is not None and len(secrets) > 0:
                 # Create temporary files to store the contents of each of our secrets
                 secretFlags = []
@@ -135,10 +210,19 @@ class ImageBuilder(object):
 
                 # Generate the `docker buildx` command to use our build secrets
                 command = DockerUtils.buildx(
-                    imageTags, context_dir, archFlags + args, secretFlags
+                    imageTags,
+                    context_dir,
+                    archFlags + args + labelFlags + cacheFlags,
+                    secretFlags,
+                    progress="rawjson" if rawjson else "plain",
                 )
             else:
-                command = DockerUtils.build(imageTags, context_dir, archFlags + args)
+                command = DockerUtils.build(
+                    imageTags,
+                    context_dir,
+                    archFlags + args + labelFlags + cacheFlags,
+                    progress="rawjson" if rawjson else None,
+                )
 
             command += ["--file", dockerfile]
 
@@ -153,15 +237,67 @@ class ImageBuilder(object):
                 command,
                 "build",
                 "built",
-                ImageBuildParams(dockerfile, context_dir, env),
+                ImageBuildParams(
+                    dockerfile, context_dir, env, inputsHash, rawjson, steps
+                ),
             )
 
+            # Complete the export of the build cache for the image, now that it has been built
+            if self.cache is not None and not self.dryRun:
+                self.cache.commit(imageTags[0])
+
     def pull(self, image: str) -> None:
         """
         Pulls the specified image if it doesn't exist or if we're forcing a pull of a newer version
         """
         self._processImage(image, None, DockerUtils.pull(image), "pull", "pulled")
 
+    @staticmethod
+    def renderTemplate(path: str, context: Dict[str, str]) -> str:
+        """
+        Renders the specified Dockerfile template, reusing the result of any previous render with an identical context
+        """
+        key = (
+            os.path.abspath(path),
+            hashlib.sha256(
+                json.dumps(context, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest(),
+        )
+
+        with ImageBuilder._renderLock:
+            rendered = ImageBuilder._rendered.get(key, None)
+            if rendered is not None:
+                return rendered
+            if ImageBuilder._environment is None:
+                ImageBuilder._environment = Environment(
+                    loader=FunctionLoader(ImageBuilder._loadTemplate),
+                    bytecode_cache=FileSystemBytecodeCache(),
+                    autoescape=False,
+                    trim_blocks=True,
+                    lstrip_blocks=True,
+                )
+
+        rendered = ImageBuilder._environment.get_template(key[0]).render(context)
+
+        # Compress excess whitespace introduced during Jinja rendering
+        # (Ensure that we still have a single trailing newline at the end of the Dockerfile)
+        rendered = EXCESS_NEWLINES.sub("\n\n", rendered).strip("\n") + "\n"
+
+        with ImageBuilder._renderLock:
+            ImageBuilder._rendered[key] = rendered
+        return rendered
+
+    @staticmethod
+    def _loadTemplate(path: str):
+        # Templates are identified by their absolute path, since custom templates can reside anywhere on the filesystem
+        # (Jinja reloads a template whenever the returned uptodate callback reports that its modification time has changed)
+        mtime = os.path.getmtime(path)
+        return (
+            FilesystemUtils.readFile(path),
+            path,
+            lambda: os.path.exists(path) and os.path.getmtime(path) == mtime,
+        )
+
     def willBuild(self, name: str, tags: [str]) -> bool:
         """
         Determines if we will build the specified image, based on our build settings
@@ -177,12 +313,176 @@ class ImageBuilder(object):
             "{}:{}".format(GlobalConfiguration.resolveTag(name), tag) for tag in tags
         ]
 
-    def _willProcess(self, image: [str]) -> bool:
+    def _willProcess(self, image: [str], inputsHash: Optional[str] = None) -> bool:
         """
         Determines if we will build or pull the specified image, based on our build settings
         """
+        if self.rebuild and self.skipUnchanged and inputsHash is not None:
+            return not self._isUnchanged(image, inputsHash)
         return self.rebuild or not DockerUtils.exists(image)
 
+    def _isUnchanged(self, image: str, inputsHash: str) -> bool:
+        """
+        Determines if the specified image exists and was built from inputs with the specified hash
+        """
+        summary = DockerUtils.imageSummary(image)
+        labels = (summary.get("Labels") or {}) if summary is not None else {}
+        return labels.get(INPUTS_HASH_LABEL) == inputsHash
+
+    def _computeInputsHash(self, dockerfile: str, context_dir: str, args: [str]) -> str:
+        """
+        Computes a hash of the rendered Dockerfile, build arguments, build context files and parent images for an image
+        """
+        digest = hashlib.sha256()
+
+        def update(kind: str, data: bytes):
+            digest.update("{}:{}:".format(kind, len(data)).encode("utf-8"))
+            digest.update(data)
+
+        # Hash the rendered Dockerfile
+        contents = FilesystemUtils.readFile(dockerfile)
+        update("dockerfile", contents.encode("utf-8"))
+
+        # Hash the build arguments, ignoring any whose values are expected to change between runs
+        buildArgs = {}
+        for flag, value in zip(args, args[1:]):
+            if flag == "--build-arg":
+                key, _, argValue = value.partition("=")
+                buildArgs[key] = argValue
+        for key, value in sorted(buildArgs.items()):
+            if key not in VOLATILE_BUILD_ARGS:
+                update("arg", "{}={}".format(key, value).encode("utf-8"))
+
+        # Hash the path and contents of every file in the build context
+        for root, dirs, files in os.walk(context_dir):
+            dirs.sort()
+            for file in sorted(files):
+                path = join(root, file)
+                update("path", os.path.relpath(path, context_dir).encode("utf-8"))
+                update("file", ImageBuilder._hashFile(path).encode("utf-8"))
+        ImageBuilder._saveFileHashes()
+
+        # Hash the ID of each parent image, falling back to the image reference for images that do not exist locally
+        for parent in self._parentImages(contents, buildArgs):
+            summary = DockerUtils.imageSummary(parent)
+            update(
+                "parent",
+                (summary["Id"] if summary is not None else parent).encode("utf-8"),
+            )
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _hashFile(path: str) -> str:
+        """
+        Returns the SHA-256 hash of the specified file, only reading its contents if its size or modification time
+        differ from when we last hashed it
+        """
+        details = os.stat(path)
+        key = os.path.abspath(path)
+        with ImageBuilder._fileHashLock:
+            hashes = ImageBuilder._loadFileHashes()
+            cached = hashes.get(key, None)
+            if cached is not None and cached[:2] == [
+                details.st_size,
+                details.st_mtime_ns,
+            ]:
+                return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+        with ImageBuilder._fileHashLock:
+            ImageBuilder._loadFileHashes()[key] = [
+                details.st_size,
+                details.st_mtime_ns,
+                digest.hexdigest(),
+            ]
+            ImageBuilder._fileHashesChanged = True
+        return digest.hexdigest()
+
+    @staticmethod
+    def _loadFileHashes() -> Dict[str, list]:
+        """
+        Loads our cache of file hashes from disk, if we have not already done so (callers must hold the lock)
+        """
+        if ImageBuilder._fileHashes is None:
+            ImageBuilder._fileHashes = {}
+            try:
+                with open(GlobalConfiguration.getFileHashCache(), "r") as f:
+                    ImageBuilder._fileHashes = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return ImageBuilder._fileHashes
+
+    @staticmethod
+    def _saveFileHashes() -> None:
+        """
+        Writes our cache of file hashes to disk if it has changed, discarding the entries for files that no longer exist
+        """
+        with ImageBuilder._fileHashLock:
+            if ImageBuilder._fileHashes is None or not ImageBuilder._fileHashesChanged:
+                return
+            hashes = {
+                path: entry
+                for path, entry in ImageBuilder._fileHashes.items()
+                if os.path.exists(path)
+            }
+            ImageBuilder._fileHashes = hashes
+            ImageBuilder._fileHashesChanged = False
+
+            # Failing to write the cache only means that we will need to read the files again next time
+            cacheFile = GlobalConfiguration.getFileHashCache()
+            try:
+                os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+                temp = "{}.{}.tmp".format(cacheFile, os.getpid())
+                with open(temp, "w") as f:
+                    json.dump(hashes, f)
+                os.replace(temp, cacheFile)
+            except OSError:
+                pass
+
+    def _parentImages(self, contents: str, buildArgs: Dict[str, str]) -> [str]:
+        """
+        Resolves the references of the external images that a Dockerfile builds upon
+        """
+        values = {}
+        stages = set()
+        parents = []
+        substitute = lambda value: re.sub(
+            "\\$(?:\\{(\\w+)\\}|(\\w+))",
+            lambda m: values.get(m[1] or m[2], ""),
+            value,
+        )
+
+        for line in contents.split("\n"):
+            # Keep track of the default values of build arguments, which are overridden by any supplied values
+            argMatch = re.match("^\\s*ARG\\s+(\\w+)(?:=(\\S*))?", line, re.IGNORECASE)
+            if argMatch is not None:
+                name = argMatch[1]
+                values[name] = buildArgs.get(name, substitute(argMatch[2] or ""))
+                continue
+
+            # Resolve the image referenced by each FROM directive, ignoring references to earlier build stages
+            fromMatch = re.match(
+                "^\\s*FROM\\s+(?:--\\S+\\s+)*(\\S+)(?:\\s+AS\\s+(\\S+))?",
+                line,
+                re.IGNORECASE,
+            )
+            if fromMatch is not None:
+                parent = substitute(fromMatch[1])
+                if parent.lower() not in stages and parent.lower() != "scratch":
+                    parents.append(parent)
+                if fromMatch[2] is not None:
+                    stages.add(fromMatch[2].lower())
+
+        return parents
+
     def _processImage(
         self,
         image: str,
@@ -197,7 +497,16 @@ class ImageBuilder(object):
         """
 
         # Determine if we are processing the image
-        if not self._willProcess(image):
+        inputsHash = build_params.inputs_hash if build_params is not None else None
+        if not self._willProcess(image, inputsHash):
+            if self.rebuild:
+                self.logger.info(
+                    'Image "{}" was built from identical inputs, skipping {}.'.format(
+                        image, actionPresentTense
+                    )
+                )
+                return
+
             self.logger.info(
                 'Image "{}" exists and rebuild not requested, skipping {}.'.format(
                     image, actionPresentTense
@@ -272,12 +581,53 @@ class ImageBuilder(object):
             return
 
         # Attempt to process the image using the supplied command
+        # (The image inventory is stale once the command has run, irrespective of whether it succeeded)
         startTime = time.time()
-        exitCode = subprocess.call(
-            command, env=build_params.env if build_params else None
+        parser = (
+            RawJsonProgressParser()
+            if build_params is not None and build_params.rawjson
+            else None
         )
+        instrumentation = (
+            StepInstrumentationParser(build_params.steps)
+            if build_params is not None and build_params.steps is not None
+            else None
+        )
+        sinks = self.sinks
+        if instrumentation is not None:
+            sinks = [TransformSink(instrumentation.feed, sinks)]
+        if parser is not None:
+            sinks = [TransformSink(parser.feed, sinks)]
+        try:
+            exitCode = SubprocessUtils.stream(
+                command,
+                sinks,
+                image,
+                env=build_params.env if build_params else None,
+            )
+        finally:
+            DockerUtils.invalidateImageCache()
         endTime = time.time()
 
+        # Report the timings of the instrumented steps, which is useful even when the build failed
+        if instrumentation is not None and len(instrumentation.executedSteps()) > 0:
+            self.logger.info(
+                'Instrumented RUN directive timings for image "{}":'.format(image)
+            )
+            for line in instrumentation.summary():
+                self.logger.info(line, False)
+
+        # Record the step timings and layer sizes for the built image if requested
+        if exitCode == 0 and self.timingReport is not None and build_params is not None:
+            self.timingReport.addImage(
+                image,
+                startTime,
+                endTime,
+                parser,
+                DockerUtils.history(image),
+                instrumentation,
+            )
+
         # Determine if processing succeeded
         if exitCode == 0:
             self.logger.action(
@@ -18,6 +18,7 @@ class ImageCleaner(object):
             print(cleanCommand)
         else:
             subprocess.call(cleanCommand)
+            DockerUtils.invalidateImageCache()
 
     def cleanMultiple(self, images, dryRun=False):
         """
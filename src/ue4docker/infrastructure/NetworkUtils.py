@@ -1,4 +1,4 @@
-import socket
+import socket, time
 
 
 class NetworkUtils(object):
@@ -17,3 +17,47 @@ class NetworkUtils(object):
         finally:
             s.close()
         return IP
+
+    @staticmethod
+    def freePort():
+        """
+        Returns a TCP port that is not currently in use on the host, as chosen by the operating system
+        (Another process may claim the port before the caller binds it, so callers should retry with a new port on failure)
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind(("", 0))
+            return s.getsockname()[1]
+        finally:
+            s.close()
+
+    @staticmethod
+    def isLocalAddress(address):
+        """
+        Determines whether the specified IP address belongs to one of the host's network interfaces (and can therefore be listened on)
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind((address, 0))
+            return True
+        except OSError:
+            return False
+        finally:
+            s.close()
+
+    @staticmethod
+    def waitForPort(address, port, isAlive, timeout=10.0):
+        """
+        Waits until a TCP port accepts connections, returning False if `isAlive()` reports that the listening process
+        has exited or the timeout elapses first
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if isAlive() == False:
+                return False
+            try:
+                socket.create_connection((address, port), timeout=1.0).close()
+                return True
+            except OSError:
+                time.sleep(0.1)
+        return False
@@ -0,0 +1,117 @@
+from typing import Callable, List
+import json, os, sys, threading, time
+
+
+class OutputSink(object):
+    """
+    Base class for the destinations that receive the lines of output produced by child processes
+    """
+
+    def write(self, source: str, stream: str, line: str) -> None:
+        """
+        Receives a single line of output (without its trailing newline) from the specified stream of the specified source
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        """
+        Flushes and releases any resources held by the sink
+        """
+        pass
+
+
+class ConsoleSink(OutputSink):
+    # Console output is shared between every sink instance, so a single lock serialises writes across threads
+    _lock = threading.Lock()
+
+    def __init__(self, prefix: bool = False):
+        """
+        Creates a sink that echoes output to the console, optionally prefixing each line with its source
+        (Prefixes keep output readable when multiple processes are running concurrently)
+        """
+        self.prefix = prefix
+
+    def write(self, source: str, stream: str, line: str) -> None:
+        output = "[{}] {}".format(source, line) if self.prefix else line
+        with ConsoleSink._lock:
+            print(
+                output,
+                file=sys.stderr if stream == "stderr" else sys.stdout,
+                flush=True,
+            )
+
+
+class RotatingFileSink(OutputSink):
+    def __init__(self, path: str, maxBytes: int, backupCount: int = 5):
+        """
+        Creates a sink that writes output to a log file, rotating it once it exceeds the specified size
+        """
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._size = self._file.tell()
+
+    def write(self, source: str, stream: str, line: str) -> None:
+        data = "[{}] {}\n".format(source, line)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            if self._size > 0 and self._size + size > self.maxBytes:
+                self._rotate()
+            self._file.write(data)
+            self._size += size
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def _rotate(self) -> None:
+        # Shift each existing backup up by one, discarding the oldest, and start a fresh log file
+        self._file.close()
+        for index in range(self.backupCount - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index + 1))
+        if self.backupCount > 0:
+            os.replace(self.path, "{}.1".format(self.path))
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "w", encoding="utf-8", buffering=1)
+        self._size = 0
+
+
+class JsonEventSink(OutputSink):
+    def __init__(self, path: str):
+        """
+        Creates a sink that writes each line of output as a JSON event to the specified file (one event per line)
+        """
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def write(self, source: str, stream: str, line: str) -> None:
+        event = json.dumps(
+            {"time": time.time(), "source": source, "stream": stream, "line": line}
+        )
+        with self._lock:
+            self._file.write(event + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class TransformSink(OutputSink):
+    def __init__(
+        self, transform: Callable[[str], List[str]], downstream: List[OutputSink]
+    ):
+        """
+        Creates a sink that rewrites each line of output (into zero or more lines) before passing it to the downstream sinks
+        """
+        self.transform = transform
+        self.downstream = downstream
+
+    def write(self, source: str, stream: str, line: str) -> None:
+        for output in self.transform(line):
+            for sink in self.downstream:
+                sink.write(source, stream, output)
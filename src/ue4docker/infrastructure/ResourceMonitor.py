@@ -1,83 +1,407 @@
-import datetime, humanfriendly, os, psutil, shutil, threading, time
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional
+import humanfriendly, math, os, psutil, shutil, threading, time
+from .CgroupUtils import CgroupUtils
 from .DockerUtils import DockerUtils
 
+# The maximum number of samples retained in memory for computing summary statistics
+# (At the default sampling interval of 20 seconds this covers more than two days of builds)
+MONITOR_BUFFER_SIZE = 8192
+
+# While the ue4-minimal image is being built (which is when RunUAT performs the Installed Build), we sample
+# more frequently than the requested interval, and while no images are being built we sample less frequently
+MONITOR_BUSY_DIVISOR = 4
+MONITOR_IDLE_MULTIPLIER = 3
+MONITOR_MIN_INTERVAL = 1.0
+MONITOR_BUSY_STAGE = "ue4-minimal"
+
+# The binary units used when formatting data sizes
+SIZE_UNITS = ["bytes", "KiB", "MiB", "GiB", "TiB", "PiB"]
+
+
+def _formatSize(size: int) -> str:
+    """
+    Formats a data size using binary units, with a fixed number of decimal places
+    (This is far cheaper than `humanfriendly.format_size()`, which matters since we format several sizes for every sample)
+    """
+    unit = 0
+    value = float(size)
+    while value >= 1024.0 and unit < len(SIZE_UNITS) - 1:
+        value /= 1024.0
+        unit += 1
+    return "{:.2f} {}".format(value, SIZE_UNITS[unit])
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """
+    Computes the specified percentile of a list of values using the nearest-rank method
+    """
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(percent / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class ResourceSamples(object):
+    """
+    Fixed-size ring buffer of resource usage samples, stored in typed arrays to keep the memory footprint compact
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self.time = array("d", [0.0] * capacity)
+        self.diskFree = array("q", [0] * capacity)
+        self.memoryUsed = array("q", [0] * capacity)
+        self.cpu = array("d", [0.0] * capacity)
+        self.label = array("i", [0] * capacity)
+
+    def append(
+        self, when: float, diskFree: int, memoryUsed: int, cpu: float, label: int
+    ) -> None:
+        """
+        Appends a sample, overwriting the oldest sample once the buffer is full
+        """
+        index = self.count % self.capacity
+        self.time[index] = when
+        self.diskFree[index] = diskFree
+        self.memoryUsed[index] = memoryUsed
+        self.cpu[index] = cpu
+        self.label[index] = label
+        self.count += 1
+
+    def indices(self) -> Iterator[int]:
+        """
+        Returns the buffer indices of the retained samples, from oldest to newest
+        """
+        start = max(0, self.count - self.capacity)
+        return (i % self.capacity for i in range(start, self.count))
+
 
 class ResourceMonitor(threading.Thread):
-    def __init__(self, logger, interval):
+    def __init__(
+        self,
+        logger,
+        interval,
+        outputFile: Optional[str] = None,
+        cgroups: bool = False,
+    ):
         """
         Creates a resource monitor with the specified configuration
         """
         super().__init__()
         self._logger = logger
         self._interval = interval
+        self._outputFile = outputFile
+        self._monitorCgroups = cgroups
         self._lock = threading.Lock()
-        self._shouldStop = False
+
+        # The monitor loop waits on our wakeup event, which is set whenever we are asked to stop or the active stages change
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+        # Each sample is tagged with the set of stages (image builds) that were active when it was taken,
+        # stored as an index into our table of distinct stage sets
+        self._samples = ResourceSamples(MONITOR_BUFFER_SIZE)
+        self._stages: Dict[str, int] = {}
+        self._labels: List[frozenset] = [frozenset()]
+        self._labelIndices: Dict[frozenset, int] = {frozenset(): 0}
+
+        # The most recent statistics for each build cgroup, and the usage attributed to each stage from those statistics
+        # (BuildKit's step cgroups do not identify the image being built, so usage sampled while several stages are
+        # active is attributed to those stages jointly rather than being counted once for each of them)
+        self._cgroupStats: Dict[str, Dict[str, int]] = {}
+        self._cgroupUsage: Dict[str, Dict[str, int]] = {}
 
     def stop(self):
         """
         Stops the resource monitor thread
         """
 
-        # Set the flag to instruct the resource monitor loop to stop
-        with self._lock:
-            self._shouldStop = True
+        # Wake the resource monitor loop and instruct it to stop
+        self._stopped.set()
+        self._wakeup.set()
 
         # Wait for the resource monitor thread to complete
         if self.is_alive() == True:
             self.join()
 
+    def beginStage(self, stage: str) -> None:
+        """
+        Marks the start of a stage, so that subsequent samples are attributed to it
+        """
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0) + 1
+        self._wakeup.set()
+
+    def endStage(self, stage: str) -> None:
+        """
+        Marks the end of a stage that was previously started with `beginStage()`
+        """
+        with self._lock:
+            remaining = self._stages.get(stage, 0) - 1
+            if remaining > 0:
+                self._stages[stage] = remaining
+            else:
+                self._stages.pop(stage, None)
+        self._wakeup.set()
+
+    def tagged(self, stage: str, action: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wraps the specified function so that samples taken while it runs are attributed to the specified stage
+        """
+
+        def wrapper():
+            self.beginStage(stage)
+            try:
+                action()
+            finally:
+                self.endStage(stage)
+
+        return wrapper
+
+    def report(self) -> None:
+        """
+        Logs the peak memory usage, minimum available disk space and CPU usage percentiles for each stage
+        """
+        summaries = self.summarise()
+        if len(summaries) == 0:
+            return
+
+        self._logger.info("RESOURCE USAGE SUMMARY:", False)
+        for stage, summary in summaries.items():
+            self._logger.info(
+                "{}: [Samples: {}] [Peak memory: {}] [Minimum available disk: {}] [CPU usage: p50 {:.2f}%, p95 {:.2f}%]".format(
+                    stage,
+                    summary["samples"],
+                    _formatSize(summary["peak_memory"]),
+                    (
+                        _formatSize(summary["min_disk_free"])
+                        if summary["min_disk_free"] is not None
+                        else "Unknown"
+                    ),
+                    summary["cpu_p50"],
+                    summary["cpu_p95"],
+                ),
+                False,
+            )
+
+        # Report the usage measured from the cgroups of the build containers, if any
+        with self._lock:
+            usage = dict(self._cgroupUsage)
+        if len(usage) > 0:
+            self._logger.info("BUILD CONTAINER RESOURCE USAGE:", False)
+            if len(usage) > 1:
+                usage["Total"] = {
+                    "cpu_usec": sum(stats["cpu_usec"] for stats in usage.values()),
+                    "memory_peak": max(
+                        stats["memory_peak"] for stats in usage.values()
+                    ),
+                    "io_write_bytes": sum(
+                        stats["io_write_bytes"] for stats in usage.values()
+                    ),
+                }
+            for stage, stats in usage.items():
+                self._logger.info(
+                    "{}: [CPU time: {}] [Peak RSS: {}] [Written to disk: {}]".format(
+                        stage,
+                        humanfriendly.format_timespan(stats["cpu_usec"] / 1000000.0),
+                        _formatSize(stats["memory_peak"]),
+                        _formatSize(stats["io_write_bytes"]),
+                    ),
+                    False,
+                )
+
+    def summarise(self) -> Dict[str, dict]:
+        """
+        Computes summary statistics for each stage from the samples retained in our ring buffer
+        """
+        with self._lock:
+            samples = self._samples
+            labels = list(self._labels)
+
+            # Group the retained samples by stage, in the order in which each stage was first sampled
+            grouped: Dict[str, List[int]] = {}
+            for index in samples.indices():
+                for stage in sorted(labels[samples.label[index]]):
+                    grouped.setdefault(stage, []).append(index)
+
+            summaries = {}
+            for stage, indices in grouped.items():
+                disk = [
+                    samples.diskFree[i] for i in indices if samples.diskFree[i] >= 0
+                ]
+                cpu = [samples.cpu[i] for i in indices]
+                summaries[stage] = {
+                    "samples": len(indices),
+                    "peak_memory": max(samples.memoryUsed[i] for i in indices),
+                    "min_disk_free": min(disk) if len(disk) > 0 else None,
+                    "cpu_p50": _percentile(cpu, 50),
+                    "cpu_p95": _percentile(cpu, 95),
+                }
+
+            return summaries
+
     def run(self):
         """
         The resource monitor loop itself
         """
 
         # Determine which filesystem the Docker daemon uses for storing its data directory
-        dockerInfo = DockerUtils.info()
+        # (The data directory does not change while the daemon is running, so we reuse the information retrieved during startup)
+        dockerInfo = DockerUtils.info(cached=True)
         rootDir = dockerInfo["DockerRootDir"]
 
         # If we cannot access the Docker data directory (e.g. when the daemon is in a Moby VM), don't report disk space
         reportDisk = os.path.exists(rootDir)
 
-        # Sample the CPU usage using an interval of 1 second the first time to prime the system
+        # Per-container sampling requires the unified cgroup v2 hierarchy
+        monitorCgroups = self._monitorCgroups
+        if monitorCgroups == True and CgroupUtils.available() == False:
+            self._logger.error(
+                "Warning: cgroup v2 is not available on this host, build container resource usage will not be reported",
+                False,
+            )
+            monitorCgroups = False
+
+        # If an output file was requested then open it and write the CSV header
+        output = None
+        if self._outputFile is not None:
+            output = open(self._outputFile, "w", buffering=1)
+            output.write(
+                "time,stages,disk_free,memory_used,memory_free,swap_free,cpu_percent\n"
+            )
+
+        # Prime the CPU usage sampling and wait for up to 1 second before our first sample, so that it is meaningful
         # (See: <https://psutil.readthedocs.io/en/latest/#psutil.cpu_percent>)
-        psutil.cpu_percent(1.0)
+        psutil.cpu_percent(None)
+        self._wakeup.wait(MONITOR_MIN_INTERVAL)
 
-        # Loop until asked to stop
-        while True:
-            # Check that the thread has not been asked to stop
-            with self._lock:
-                if self._shouldStop == True:
-                    return
+        try:
+            # Loop until asked to stop
+            while self._stopped.is_set() == False:
+                self._wakeup.clear()
+                with self._lock:
+                    stages = frozenset(self._stages.keys())
+                    label = self._labelFor(stages)
 
-            # Format the timestamp for the current time in ISO 8601 format (albeit without the "T" separator)
-            isoTime = datetime.datetime.now().replace(microsecond=0).isoformat(" ")
+                # Format the timestamp for the current time in ISO 8601 format (albeit without the "T" separator)
+                now = time.time()
+                isoTime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
 
-            # We format data sizes using binary units (KiB, MiB, GiB, etc.)
-            formatSize = lambda size: humanfriendly.format_size(
-                size, binary=True, keep_width=True
-            )
+                # Sample the current levels of our available resources
+                diskFree = shutil.disk_usage(rootDir).free if reportDisk == True else -1
+                memory = psutil.virtual_memory()
+                swapFree = psutil.swap_memory().free
+                cpu = psutil.cpu_percent()
 
-            # Format the current quantity of available disk space on the Docker data directory's filesystem
-            diskSpace = (
-                formatSize(shutil.disk_usage(rootDir).free)
-                if reportDisk == True
-                else "Unknown"
-            )
+                # Record the sample in our ring buffer and in the output file, if any
+                memoryUsed = memory.total - memory.available
+                with self._lock:
+                    self._samples.append(now, diskFree, memoryUsed, cpu, label)
+                if output is not None:
+                    output.write(
+                        '{},"{}",{},{},{},{},{:.2f}\n'.format(
+                            isoTime.replace(" ", "T"),
+                            ";".join(sorted(self._labels[label])),
+                            diskFree if diskFree >= 0 else "",
+                            memoryUsed,
+                            memory.free,
+                            swapFree,
+                            cpu,
+                        )
+                    )
 
-            # Format the current quantity of available system memory
-            physicalMemory = formatSize(psutil.virtual_memory().free)
-            virtualMemory = formatSize(psutil.swap_memory().free)
+                # Sample the usage of the build containers, if requested
+                if monitorCgroups == True:
+                    self._sampleCgroups(label)
 
-            # Format the current CPU usage levels
-            cpu = psutil.cpu_percent()
+                # Report the current levels of our available resources
+                self._logger.info(
+                    "[{}] [Available disk: {}] [Available memory: {} physical, {} virtual] [CPU usage: {:.2f}%]".format(
+                        isoTime,
+                        _formatSize(diskFree) if reportDisk == True else "Unknown",
+                        _formatSize(memory.free),
+                        _formatSize(swapFree),
+                        cpu,
+                    ),
+                    False,
+                )
 
-            # Report the current levels of our available resources
-            self._logger.info(
-                "[{}] [Available disk: {}] [Available memory: {} physical, {} virtual] [CPU usage: {:.2f}%]".format(
-                    isoTime, diskSpace, physicalMemory, virtualMemory, cpu
-                ),
-                False,
-            )
+                # Wait until the next sampling interval, or until we are woken early by a stage change or a request to stop
+                self._wakeup.wait(self._intervalFor(stages))
+
+        finally:
+            if output is not None:
+                output.close()
+
+    def _intervalFor(self, stages: frozenset) -> float:
+        # Determines the sampling interval to use while the specified stages are active
+        if len(stages) == 0:
+            return self._interval * MONITOR_IDLE_MULTIPLIER
+        if any(stage.startswith(MONITOR_BUSY_STAGE) for stage in stages):
+            return max(MONITOR_MIN_INTERVAL, self._interval / MONITOR_BUSY_DIVISOR)
+        return self._interval
+
+    def _sampleCgroups(self, label: int) -> None:
+        # Attributes the CPU time and disk writes that the build cgroups have accumulated since our previous sample, along
+        # with the highest memory usage seen for any cgroup, to the currently active stage (or jointly to the active stages,
+        # since we cannot tell which of them owns each cgroup), so that each cgroup's usage is only ever counted once
+        # (Where build steps are nested under a parent cgroup, we use the parent's cumulative statistics instead, since
+        # these include the usage of any steps that started and finished between our samples)
+        parents = CgroupUtils.findParentCgroups()
+        current = {}
+        for path in CgroupUtils.findBuildCgroups() + parents:
+            stats = CgroupUtils.readStats(path)
+            if stats is not None:
+                current[path] = stats
+
+        with self._lock:
+            # A parent cgroup's statistics can only be used once we have a previous sample to compare them against
+            tracked = [parent for parent in parents if parent in self._cgroupStats]
+
+            stages = self._labels[label]
+            if len(stages) > 0:
+                usage = self._cgroupUsage.setdefault(
+                    " + ".join(sorted(stages)),
+                    {"cpu_usec": 0, "memory_peak": 0, "io_write_bytes": 0},
+                )
+                for path, stats in current.items():
+                    previous = self._cgroupStats.get(path, {})
+
+                    # Skip the cumulative counters of build steps whose usage is reported by a tracked parent cgroup,
+                    # along with those of untracked parent cgroups, whose usage to date we cannot attribute to this stage
+                    if path in parents:
+                        counted = path in tracked
+                        memoryPeak = (
+                            stats["memory_peak"]
+                            if counted
+                            and stats["memory_peak"] > previous["memory_peak"]
+                            else 0
+                        )
+                    else:
+                        counted = not any(
+                            path.startswith(parent + os.sep) for parent in tracked
+                        )
+                        memoryPeak = stats["memory_peak"]
+
+                    if counted:
+                        usage["cpu_usec"] += stats["cpu_usec"] - previous.get(
+                            "cpu_usec", 0
+                        )
+                        usage["io_write_bytes"] += stats[
+                            "io_write_bytes"
+                        ] - previous.get("io_write_bytes", 0)
+                    usage["memory_peak"] = max(usage["memory_peak"], memoryPeak)
+
+            # Forget about any cgroups that have since been removed
+            self._cgroupStats = current
 
-            # Sleep until the next sampling interval
-            time.sleep(self._interval)
+    def _labelFor(self, stages: frozenset) -> int:
+        # Retrieves the index of the specified stage set in our label table, adding it if necessary
+        # (Callers must hold our lock)
+        index = self._labelIndices.get(stages, None)
+        if index is None:
+            index = len(self._labels)
+            self._labels.append(stages)
+            self._labelIndices[stages] = index
+        return index
@@ -1,4 +1,10 @@
-import subprocess
+import asyncio, subprocess
+
+# The maximum length (in bytes) of a single line of output before it is split into multiple lines when streaming
+STREAM_LINE_LIMIT = 64 * 1024
+
+# The maximum number of lines of output that can be buffered between reading and dispatching to sinks when streaming
+STREAM_QUEUE_SIZE = 256
 
 
 class VerboseCalledProcessError(RuntimeError):
@@ -49,3 +55,58 @@ class SubprocessUtils(object):
         If the child process fails and `check` is True then a verbose exception will be raised.
         """
         return SubprocessUtils.capture(command, check, **kwargs)
+
+    @staticmethod
+    def stream(command, sinks, source, env=None):
+        """
+        Executes a child process and streams its stdout and stderr line by line to the supplied output sinks.
+
+        Output is passed through a bounded buffer, so memory usage remains constant irrespective of how much output
+        the child process produces. Returns the exit code of the child process.
+        """
+        return asyncio.run(SubprocessUtils._stream(command, sinks, source, env))
+
+    @staticmethod
+    async def _stream(command, sinks, source, env):
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=STREAM_LINE_LIMIT,
+        )
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+        async def read(reader, name):
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    # We have reached EOF, so emit any trailing output that lacks a newline
+                    line = e.partial
+                except asyncio.LimitOverrunError as e:
+                    # The line is too long to buffer, so emit the data we have as a partial line
+                    line = await reader.read(e.consumed)
+
+                if len(line) == 0:
+                    break
+                await queue.put((name, line))
+
+            await queue.put((name, None))
+
+        async def dispatch():
+            remaining = 2
+            while remaining > 0:
+                name, line = await queue.get()
+                if line is None:
+                    remaining -= 1
+                    continue
+
+                text = line.decode("utf-8", "replace").rstrip("\r\n")
+                for sink in sinks:
+                    sink.write(source, name, text)
+
+        await asyncio.gather(
+            read(process.stdout, "stdout"), read(process.stderr, "stderr"), dispatch()
+        )
+        return await process.wait()
@@ -1,14 +1,31 @@
+from .ArchiveExtractor import ArchiveExtractor, ChunkStream, TransferProgress
 from .BuildConfiguration import BuildConfiguration
+from .BuildCache import BuildCache
+from .BuildGraph import BuildGraph
+from .BuildTimings import BuildTimingReport, RawJsonProgressParser
+from .CgroupUtils import CgroupUtils
 from .ContainerUtils import ContainerUtils
-from .CredentialEndpoint import CredentialEndpoint
+from .CredentialEndpoint import CredentialEndpoint, DEFAULT_CREDENTIAL_PORT
 from .DarwinUtils import DarwinUtils
+from .DockerfileTokenizer import DockerfileInstruction, DockerfileTokenizer
 from .DockerUtils import DockerUtils
+from .EngineVersion import EngineVersion
 from .FilesystemUtils import FilesystemUtils
+from .GitdepsCache import GitdepsCache, GITDEPS_PROXY_PORT
+from .GitMirror import GitMirror, GIT_MIRROR_PORT
 from .GlobalConfiguration import GlobalConfiguration
+from .ImageArchive import ImageArchive
 from .ImageBuilder import ImageBuilder
 from .ImageCleaner import ImageCleaner
 from .Logger import Logger
 from .NetworkUtils import NetworkUtils
+from .OutputSinks import (
+    ConsoleSink,
+    JsonEventSink,
+    OutputSink,
+    RotatingFileSink,
+    TransformSink,
+)
 from .PrettyPrinting import PrettyPrinting
 from .ResourceMonitor import ResourceMonitor
 from .SubprocessUtils import SubprocessUtils
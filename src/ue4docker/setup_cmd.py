@@ -8,18 +8,22 @@ def _runSilent(command):
     return result.returncode
 
 
-# Performs setup for Linux hosts
-def _setupLinux():
-    # Pull the latest version of the Alpine container image
-    alpineImage = "alpine:latest"
-    SubprocessUtils.capture(["docker", "pull", alpineImage])
-
-    # Start the credential endpoint with blank credentials
-    endpoint = CredentialEndpoint("", "")
+# The host ports that our containers need to access during builds, along with a description of the service for each
+_CONTAINER_PORTS = [
+    (DEFAULT_CREDENTIAL_PORT, "credential endpoint"),
+    (GITDEPS_PROXY_PORT, "gitdeps caching proxy"),
+    (GIT_MIRROR_PORT, "git mirror daemon"),
+]
+
+
+# Opens the specified host port in the Linux firewall if our containers cannot access it
+def _openLinuxPort(alpineImage, port, description):
+    # Start a credential endpoint with blank credentials on the port, which our test container can send a request to
+    endpoint = CredentialEndpoint("", "", port)
     endpoint.start()
 
     try:
-        # Run an Alpine container to see if we can access the host port for the credential endpoint
+        # Run an Alpine container to see if we can access the host port
         SubprocessUtils.capture(
             [
                 "docker",
@@ -29,38 +33,102 @@ def _setupLinux():
                 "wget",
                 "--timeout=1",
                 "--post-data=dummy",
-                "http://{}:9876".format(NetworkUtils.hostIP()),
+                "http://{}:{}".format(NetworkUtils.hostIP(), port),
             ],
             check=True,
         )
 
         # If we reach this point then the host port is accessible
-        print("No firewall configuration required.")
+        print("No firewall configuration required for {}.".format(description))
+        return False
 
     except:
         # The host port is blocked, so we need to perform firewall configuration
-        print("Creating firewall rule for credential endpoint...")
+        print("Creating firewall rule for {}...".format(description))
 
         # Create the firewall rule
         subprocess.run(
-            ["iptables", "-I", "INPUT", "-p", "tcp", "--dport", "9876", "-j", "ACCEPT"],
+            [
+                "iptables",
+                "-I",
+                "INPUT",
+                "-p",
+                "tcp",
+                "--dport",
+                str(port),
+                "-j",
+                "ACCEPT",
+            ],
             check=True,
         )
+        return True
 
-        # Ensure the firewall rule persists after reboot
+    finally:
+        # Stop the credential endpoint
+        endpoint.stop()
+
+
+# Performs setup for Linux hosts
+def _setupLinux():
+    # Pull the latest version of the Alpine container image
+    alpineImage = "alpine:latest"
+    SubprocessUtils.capture(["docker", "pull", alpineImage])
+
+    # Open the ports for the credential endpoint and the gitdeps caching proxy, if they are blocked
+    created = False
+    for port, description in _CONTAINER_PORTS:
+        created = _openLinuxPort(alpineImage, port, description) or created
+
+    if created == True:
+        # Ensure the firewall rules persist after reboot
         # (Requires the `iptables-persistent` service to be installed and running)
         os.makedirs("/etc/iptables", exist_ok=True)
         subprocess.run("iptables-save > /etc/iptables/rules.v4", shell=True, check=True)
 
         # Inform users of the `iptables-persistent` requirement
         print(
-            "Firewall rule created. Note that the `iptables-persistent` service will need to"
+            "Firewall rules created. Note that the `iptables-persistent` service will need to"
         )
-        print("be installed for the rule to persist after the host system reboots.")
+        print("be installed for the rules to persist after the host system reboots.")
 
-    finally:
-        # Stop the credential endpoint
-        endpoint.stop()
+
+# Opens the specified host port in the Windows firewall if we have not already created a rule for it
+def _openWindowsPort(port, description):
+    ruleName = "Open TCP port {} for ue4-docker {}".format(port, description)
+    ruleExists = (
+        _runSilent(
+            [
+                "netsh",
+                "advfirewall",
+                "firewall",
+                "show",
+                "rule",
+                "name={}".format(ruleName),
+            ]
+        )
+        == 0
+    )
+    if ruleExists == False:
+        # Add a rule to ensure Windows firewall allows access to the port from our containers
+        print("Creating firewall rule for {}...".format(description))
+        subprocess.run(
+            [
+                "netsh",
+                "advfirewall",
+                "firewall",
+                "add",
+                "rule",
+                "name={}".format(ruleName),
+                "dir=in",
+                "action=allow",
+                "protocol=TCP",
+                "localport={}".format(port),
+            ],
+            check=True,
+        )
+
+    else:
+        print("Firewall rule for {} is already configured.".format(description))
 
 
 # Performs setup for Windows Server hosts
@@ -96,42 +164,9 @@ def _setupWindowsServer():
     else:
         print("Maximum image size is already correctly configured.")
 
-    # Determine if we need to configure Windows firewall
-    ruleName = "Open TCP port 9876 for ue4-docker credential endpoint"
-    ruleExists = (
-        _runSilent(
-            [
-                "netsh",
-                "advfirewall",
-                "firewall",
-                "show",
-                "rule",
-                "name={}".format(ruleName),
-            ]
-        )
-        == 0
-    )
-    if ruleExists == False:
-        # Add a rule to ensure Windows firewall allows access to the credential helper from our containers
-        print("Creating firewall rule for credential endpoint...")
-        subprocess.run(
-            [
-                "netsh",
-                "advfirewall",
-                "firewall",
-                "add",
-                "rule",
-                "name={}".format(ruleName),
-                "dir=in",
-                "action=allow",
-                "protocol=TCP",
-                "localport=9876",
-            ],
-            check=True,
-        )
-
-    else:
-        print("Firewall rule for credential endpoint is already configured.")
+    # Open the ports for the credential endpoint and the gitdeps caching proxy in the Windows firewall
+    for port, description in _CONTAINER_PORTS:
+        _openWindowsPort(port, description)
 
 
 def setup():
@@ -3,11 +3,12 @@ import os
 import posixpath
 import sys
 
-import docker
 from docker.errors import ImageNotFound
 
 from .infrastructure import (
     ContainerUtils,
+    DockerUtils,
+    EngineVersion,
     GlobalConfiguration,
     Logger,
 )
@@ -17,8 +18,8 @@ def test():
     # Create our logger to generate coloured output on stderr
     logger = Logger(prefix="[{} test] ".format(sys.argv[0]))
 
-    # Create our Docker API client
-    client = docker.from_env()
+    # Retrieve our shared Docker API client
+    client = DockerUtils.client()
 
     # Check that an image tag has been specified
     if len(sys.argv) > 1 and sys.argv[1].strip("-") not in ["h", "help"]:
@@ -38,6 +39,14 @@ def test():
             )
             sys.exit(1)
 
+        # Report the version of the Engine if the image records it in its labels
+        version = EngineVersion.fromLabels(image.labels)
+        if version is not None:
+            logger.action(
+                'The "{}" image contains Unreal Engine {}'.format(image_name, version),
+                False,
+            )
+
         # Use process isolation mode when testing Windows containers, since running Hyper-V containers don't currently support manipulating the filesystem
         platform = image.attrs["Os"]
         isolation = "process" if platform == "windows" else None
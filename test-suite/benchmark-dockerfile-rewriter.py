@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import argparse, re, sys, timeit
+from pathlib import Path
+
+try:
+    from ue4docker.infrastructure import DockerfileTokenizer, ImageBuilder
+except:
+    print(
+        "Error: could not import ue4docker! Make sure you install ue4-docker at least once before running the benchmark."
+    )
+    sys.exit(1)
+
+# The directory containing the Dockerfile templates that ship with ue4-docker
+DOCKERFILES_DIR = Path(__file__).parent.parent / "src" / "ue4docker" / "dockerfiles"
+
+# The template context used to render the shipped Dockerfiles, which enables as many optional blocks as possible
+TEMPLATE_CONTEXT = {
+    "buildgraph_args": " -set:HostPlatformOnly=true",
+    "clone_mode": "sparse",
+    "combine": False,
+    "credential_mode": "secrets",
+    "disable_all_patches": False,
+    "disable_labels": False,
+    "enable_dso_patch": True,
+    "enable_ushell": True,
+    "excluded_components": {"ddc": False, "debug": False, "templates": False},
+    "git_config": {"user.name": "ue4-docker"},
+    "gitdependencies_args": "--exclude=Win32 --exclude=Win64",
+    "gitdeps_cache": True,
+    "minimal_layers": 4,
+    "source_mode": "git",
+    "sparse_checkout_patterns": ["/*", "!**/Win32/", "!**/Win64/"],
+}
+
+# The message injected by `ImageBuilder`
+MESSAGE_LINES = [
+    "",
+    "RUN directive complete. Docker will now commit the filesystem layer to disk.",
+    "Note that for large filesystem layers this can take quite some time.",
+    "Performing filesystem layer commit...",
+    "",
+]
+
+
+# The regular expression-based implementation that the tokenizer replaced, which we benchmark against
+def legacyRewrite(contents: str, echoCommands: str) -> str:
+    escapeMatch = re.search("#[\\s]*escape[\\s]*=[\\s]*([^\n])\n", contents)
+    escape = escapeMatch[1] if escapeMatch is not None else "\\"
+    for match in re.finditer(
+        "^RUN(.+?[^{}])\n".format(re.escape(escape)),
+        contents,
+        re.DOTALL | re.MULTILINE,
+    ):
+        contents = contents.replace(
+            match[0], "RUN{}{}\n".format(match[1], echoCommands)
+        )
+    return contents
+
+
+# The tokenizer-based implementation used by `DockerUtils.injectPostRunMessage()`
+def tokenizerRewrite(contents: str, echoCommands: str) -> str:
+    tokenizer = DockerfileTokenizer(contents)
+    for instruction in tokenizer.instructions("RUN"):
+        if not instruction.isExecForm() and not instruction.hasHeredocs():
+            instruction.append(echoCommands)
+    return tokenizer.render()
+
+
+# Generates a synthetic Dockerfile with (at least) the specified number of lines, made up of multi-line RUN directives
+def syntheticDockerfile(numLines: int) -> str:
+    lines = ["FROM ubuntu:22.04"]
+    index = 0
+    while len(lines) < numLines:
+        lines.extend(
+            [
+                "",
+                "# Step {}".format(index),
+                "RUN apt-get update && \\",
+                "\tapt-get install -y --no-install-recommends package-{} && \\".format(
+                    index
+                ),
+                "\trm -rf /var/lib/apt/lists/*",
+            ]
+        )
+        index += 1
+    return "\n".join(lines) + "\n"
+
+
+# Times both implementations over the supplied Dockerfile contents and reports the results
+def benchmark(name: str, contents: str, echoCommands: str, repeat: int) -> None:
+    legacy = min(
+        timeit.repeat(
+            lambda: legacyRewrite(contents, echoCommands), number=1, repeat=repeat
+        )
+    )
+    tokenizer = min(
+        timeit.repeat(
+            lambda: tokenizerRewrite(contents, echoCommands), number=1, repeat=repeat
+        )
+    )
+    matches = (
+        "identical"
+        if legacyRewrite(contents, echoCommands)
+        == tokenizerRewrite(contents, echoCommands)
+        else "DIFFERENT"
+    )
+    print(
+        "{:<48} {:>7} lines  legacy {:>9.3f} ms  tokenizer {:>9.3f} ms  output {}".format(
+            name,
+            contents.count("\n"),
+            legacy * 1000,
+            tokenizer * 1000,
+            matches,
+        ),
+        flush=True,
+    )
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--repeat", type=int, default=5, help="The number of times to time each rewrite"
+)
+parser.add_argument(
+    "--lines",
+    type=int,
+    default=10000,
+    help="The number of lines in the synthetic Dockerfile",
+)
+args = parser.parse_args()
+
+for platform in ["linux", "windows"]:
+    prefix = "echo." if platform == "windows" else "echo '"
+    suffix = "" if platform == "windows" else "'"
+    echoCommands = "".join(
+        [" && {}{}{}".format(prefix, line, suffix) for line in MESSAGE_LINES]
+    )
+
+    # Benchmark the rewrite over each of the shipped Dockerfiles for the platform
+    for template in sorted(DOCKERFILES_DIR.glob("*/{}/Dockerfile".format(platform))):
+        contents = ImageBuilder.renderTemplate(str(template), TEMPLATE_CONTEXT)
+        benchmark(
+            str(template.relative_to(DOCKERFILES_DIR)),
+            contents,
+            echoCommands,
+            args.repeat,
+        )
+
+    # Benchmark the rewrite over a large synthetic Dockerfile
+    if platform == "linux":
+        benchmark(
+            "synthetic",
+            syntheticDockerfile(args.lines),
+            echoCommands,
+            args.repeat,
+        )
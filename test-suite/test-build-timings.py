@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import datetime, sys, unittest
+
+try:
+    from ue4docker.infrastructure.BuildTimings import _parseTimestamp
+except:
+    print(
+        "Error: could not import ue4docker! Make sure you install ue4-docker at least once before running the tests."
+    )
+    sys.exit(1)
+
+
+# The UNIX timestamp of 2024-01-02T03:04:05Z
+BASE_TIMESTAMP = datetime.datetime(
+    2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc
+).timestamp()
+
+
+class ParseTimestampTests(unittest.TestCase):
+    def test_fraction_lengths(self):
+        # Go omits trailing zeros from the fractional seconds, so every length from zero to nine digits can occur
+        for fraction, expected in [
+            ("", 0),
+            (".5", 500000),
+            (".25", 250000),
+            (".125", 125000),
+            (".1234", 123400),
+            (".12345", 123450),
+            (".123456", 123456),
+            (".1234567", 123456),
+            (".123456789", 123456),
+        ]:
+            with self.subTest(fraction=fraction):
+                self.assertAlmostEqual(
+                    _parseTimestamp("2024-01-02T03:04:05" + fraction + "Z"),
+                    BASE_TIMESTAMP + expected / 1000000,
+                    places=6,
+                )
+
+    def test_offsets(self):
+        self.assertAlmostEqual(
+            _parseTimestamp("2024-01-02T13:04:05.5+10:00"),
+            BASE_TIMESTAMP + 0.5,
+            places=6,
+        )
+        self.assertAlmostEqual(
+            _parseTimestamp("2024-01-02T03:04:05.5"), BASE_TIMESTAMP + 0.5, places=6
+        )
+
+    def test_invalid(self):
+        self.assertIsNone(_parseTimestamp(None))
+        self.assertIsNone(_parseTimestamp("not a timestamp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os, shutil, subprocess, sys, tempfile, unittest
+
+try:
+    from ue4docker.infrastructure import DockerfileTokenizer, DockerUtils
+except:
+    print(
+        "Error: could not import ue4docker! Make sure you install ue4-docker at least once before running the tests."
+    )
+    sys.exit(1)
+
+
+# A RUN directive whose option flags span multiple lines, as found in the ue4-source image when using build secrets
+MULTILINE_FLAGS = "\n".join(
+    [
+        "FROM ubuntu:22.04",
+        "RUN --mount=type=secret,id=username,uid=1000,required \\",
+        "\t--mount=type=secret,id=password,uid=1000,required \\",
+        "\t# A comment within the continuation",
+        "\t--network=host \\",
+        '\tCHANGELIST="$CHANGELIST" \\',
+        "\tmkdir /tmp/example && \\",
+        "\techo hello",
+        "",
+    ]
+)
+
+
+class DockerfileTokenizerTests(unittest.TestCase):
+    def _prepended(self, contents: str) -> str:
+        tokenizer = DockerfileTokenizer(contents)
+        for instruction in tokenizer.instructions("RUN"):
+            instruction.prepend("PREFIX ")
+        return tokenizer.render()
+
+    def test_prepend_single_line(self):
+        self.assertEqual(
+            self._prepended("RUN --mount=type=cache,target=/tmp echo hello"),
+            "RUN --mount=type=cache,target=/tmp PREFIX echo hello",
+        )
+
+    def test_prepend_without_flags(self):
+        self.assertEqual(
+            self._prepended("RUN echo hello \\\n\t&& echo world"),
+            "RUN PREFIX echo hello \\\n\t&& echo world",
+        )
+
+    def test_prepend_flags_on_first_line_only(self):
+        self.assertEqual(
+            self._prepended("RUN --network=host \\\n\techo hello"),
+            "RUN --network=host \\\n\tPREFIX echo hello",
+        )
+
+    def test_prepend_multiline_flags(self):
+        rendered = self._prepended(MULTILINE_FLAGS).split("\n")
+        self.assertEqual(rendered[1:5], MULTILINE_FLAGS.split("\n")[1:5])
+        self.assertEqual(rendered[5], '\tPREFIX CHANGELIST="$CHANGELIST" \\')
+
+    def test_instrument_multiline_flags(self):
+        # The instrumented command (with the flags removed, as BuildKit does) must be a valid shell command line
+        tempDir = tempfile.mkdtemp()
+        try:
+            dockerfile = os.path.join(tempDir, "Dockerfile")
+            with open(dockerfile, "w") as f:
+                f.write(MULTILINE_FLAGS)
+            steps = DockerUtils.instrumentRunDirectives(dockerfile, True)
+            self.assertEqual(
+                steps["1"],
+                'CHANGELIST="$CHANGELIST" mkdir /tmp/example && echo hello',
+            )
+
+            with open(dockerfile, "r") as f:
+                tokenizer = DockerfileTokenizer(f.read())
+            command = next(tokenizer.instructions("RUN")).command()
+            self.assertTrue(command.startswith("__ue4docker_start="))
+            subprocess.run(["sh", "-n", "-c", command], check=True)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+if __name__ == "__main__":
+    unittest.main()